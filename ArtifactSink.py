@@ -0,0 +1,202 @@
+"""
+Structured records of the winning artifacts.
+
+By default :meth:'MetaHaikuEnvironment.vote' writes the winners to the log as free text.  With an
+:class:'ArtifactSink' as the environment's *artifact_sink*, every winner becomes one JSON line instead::
+
+    env.artifact_sink = ArtifactSink('logs/artifacts.jsonl')
+
+The vote only puts a tuple of plain values on a queue.  A writer thread turns them into JSON and writes them in
+batches, so formatting and file writes stay off the voting path.  Records are:
+
+* metaphors: {"round", "type": "metaphor", "creator", "score", "rank", "noun_1", "noun_2", "adjective"}
+* haiku: {"round", "type": "haiku", "creator", "score", "guessed_by", "metaphors_used", "topic", "lines"}, where
+  lines is a list of three lists of words
+
+A record which can not be formatted is logged and skipped, and the rest of its batch is written.  If the file write
+itself fails, the batch is logged and dropped.  Either way the writer goes on, *dropped* counts the records lost, and
+the first error is raised again from flush() or close(), so a failing sink does not go unnoticed.
+
+read_artifacts() and read_columns() load the records for analysis.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import numpy as np
+
+# The default record file, next to the creamas logs
+ARTIFACTS_FILE = os.path.join('logs', 'artifacts.jsonl')
+
+METAPHOR = 'metaphor'
+HAIKU = 'haiku'
+
+_CLOSE = None
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactSink:
+    """
+    Writes winner records from a background thread, see the module documentation.
+
+    Attributes:
+        dropped    The number of records which could not be written
+    """
+    def __init__(self, file_name=ARTIFACTS_FILE, batch=256):
+        """
+        :param file_name (str): the JSON lines file to append the records to.  Its folder is created if needed
+        :param batch (int): the largest number of records written at once
+        """
+        self.file_name = file_name
+        self.batch = batch
+        folder = os.path.dirname(file_name)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._file = open(file_name, 'a', encoding='utf8')
+        self._error = None
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write, name='ArtifactSink', daemon=True)
+        self._thread.start()
+
+    def add_metaphor(self, round_number, artifact, score, rank):
+        """
+        Record a winning metaphor.
+
+        :param round_number (int): the round it won
+        :param artifact: the Artifact of the :class:'Metaphor'
+        :param score (float): its score in the vote
+        :param rank (int): its place among the round's winners, 0 for the best
+        """
+        metaphor = artifact.obj
+        self._queue.put((METAPHOR, round_number, artifact.creator, float(score), rank, metaphor.noun_1.word,
+                         metaphor.noun_2.word, metaphor.adjective.word))
+
+    def add_haiku(self, round_number, artifact, score):
+        """
+        Record a winning haiku.  Its guessed_by count is taken now, as the object may be voted on again.
+
+        :param round_number (int): the round it won
+        :param artifact: the Artifact of the :class:'Haiku'
+        :param score (float): its score in the vote, after the guess penalty
+        """
+        haiku = artifact.obj
+        self._queue.put((HAIKU, round_number, artifact.creator, float(score), haiku.guessed_by, haiku.metaphors_used,
+                         haiku.topic.word, haiku.line_1, haiku.line_2, haiku.line_3))
+
+    @staticmethod
+    def _record(item):
+        if item[0] == METAPHOR:
+            kind, round_number, creator, score, rank, noun_1, noun_2, adjective = item
+            record = {'round': round_number, 'type': kind, 'creator': str(creator), 'score': score, 'rank': rank,
+                      'noun_1': noun_1, 'noun_2': noun_2, 'adjective': adjective}
+        else:
+            kind, round_number, creator, score, guessed_by, metaphors_used, topic, line_1, line_2, line_3 = item
+            record = {'round': round_number, 'type': kind, 'creator': str(creator), 'score': score,
+                      'guessed_by': guessed_by, 'metaphors_used': metaphors_used, 'topic': topic,
+                      'lines': [[word.word for word in line] for line in (line_1, line_2, line_3)]}
+        return json.dumps(record, separators=(',', ':'))
+
+    def _failed(self, error, count, message, *args):
+        logger.exception(message, *args)
+        self.dropped += count
+        if self._error is None:
+            self._error = error
+
+    def _format(self, records):
+        lines = []
+        for item in records:
+            try:
+                lines.append(self._record(item))
+            except Exception as error:
+                self._failed(error, 1, "Could not format an artifact record for %s: %r", self.file_name, item)
+        return lines
+
+    def _write(self):
+        closing = False
+        while not closing:
+            items = [self._queue.get()]
+            lines = []
+            try:
+                while len(items) < self.batch:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if items[-1] is _CLOSE:
+                    closing = True
+                    records = items[:-1]
+                else:
+                    records = items
+                lines = self._format(records)
+                if lines:
+                    self._file.write('\n'.join(lines) + '\n')
+                    self._file.flush()
+            except Exception as error:
+                self._failed(error, len(lines), "Could not write %d artifact records to %s", len(lines), self.file_name)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def flush(self):
+        """
+        Wait until every record added so far is written.
+
+        :raises Exception: the first error the writer met since the last flush() or close(), if any
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Write the remaining records and stop the writer thread.
+
+        :raises Exception: the first error the writer met since the last flush(), if any
+        """
+        if self._thread is not None:
+            self._queue.put(_CLOSE)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+            self._raise_error()
+
+
+def read_artifacts(file_name=ARTIFACTS_FILE, kind=None):
+    """
+    Read the records written by :class:'ArtifactSink'.
+
+    :param file_name (str): the record file
+    :param kind (str): only read records of this type, 'metaphor' or 'haiku'.  Other lines are skipped without parsing
+    :return: list of dicts
+    """
+    tag = None if kind is None else '"type":"{}"'.format(kind)
+    with open(file_name, 'r', encoding='utf8') as f:
+        return [json.loads(line) for line in f if line.strip() and (tag is None or tag in line)]
+
+
+def read_columns(file_name=ARTIFACTS_FILE, kind=METAPHOR):
+    """
+    Read the records of one type as columns.  Numeric fields become numpy arrays, the others lists.
+
+    :param file_name (str): the record file
+    :param kind (str): 'metaphor' or 'haiku'
+    :return: dict from field name to column
+    """
+    records = read_artifacts(file_name, kind)
+    columns = dict()
+    for record in records:
+        for key in record:
+            columns.setdefault(key, [])
+    for key, column in columns.items():
+        column.extend(record.get(key) for record in records)
+        if key in ('round', 'score', 'rank', 'guessed_by', 'metaphors_used'):
+            columns[key] = np.array(column, dtype=np.float64 if key == 'score' else np.int64)
+    return columns
@@ -0,0 +1,1003 @@
+"""
+Micro-benchmarks for the hot paths of the simulation.
+
+Run this module directly to print the results.  The benchmarks use the noun lists shipped with the repository, or a
+synthetic lexicon with --synthetic, and stub embeddings, so they run offline without the word2vec models or a creamas
+environment.  With --json the results are saved with a description of the environment, and --compare reports the
+results which got worse than in such a file, e.g.
+
+    python Benchmarks.py --json baseline.json
+    python Benchmarks.py --compare baseline.json --tolerance 0.25
+
+The benchmarks only time.  That the fast paths give the same results as the legacy versions kept here as references
+is checked by the tests in tests/, run with pytest.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import time
+import zlib
+import numpy as np
+from creamas import Artifact
+from Model_Classes import Word, Noun, Metaphor, Haiku
+from Lexicon import Lexicon, filter_nouns, incidence_matrix, shared_adjective_counts
+from Embeddings import NounEmbeddings
+from CompiledLexicon import write_compiled_lexicon
+from MetaphorAgent import MetaphorAgent
+from MetaphorMemory import MetaphorMemory, MetaphorStore, EVICTION_POLICIES
+from MetaHaikuEnvironment import mean_scores, top_k
+from HaikuAgent import HaikuAgent
+from VoteExecutor import EXECUTORS, Candidate
+import FastSimulation
+from ShardedSimulation import ShardedSimulation
+
+
+def load_nouns(file_name='nouns_brown.txt'):
+    """
+    Parse a noun data file the same way Main.py does.
+
+    :param file_name: the data file, relative to this module
+    :return: list of :class:'Noun'
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name), 'r') as f:
+        return [Noun.parse(line) for line in f.readlines()]
+
+
+def synthetic_nouns(count, adjectives=None, per_noun=5, seed=0, skew=1.0):
+    """
+    Generate a random noun list.  Adjective popularity follows a Zipf-like distribution, like in the real noun lists
+    where a few adjectives ('other', 'new', 'big') describe many nouns.  The overlap between the nouns' adjectives grows
+    with *per_noun* and *skew* and shrinks with the size of the vocabulary.
+
+    :param count: the number of nouns
+    :param adjectives: the size of the adjective vocabulary, by default half the number of nouns
+    :param per_noun: the average number of adjectives per noun
+    :param seed: the random seed
+    :param skew: the Zipf exponent of adjective popularity, 0 for uniform
+    :return: list of :class:'Noun'
+    """
+    rng = np.random.RandomState(seed)
+    adjectives = adjectives or max(2, count // 2)
+    vocabulary = [Word('adj{}'.format(i), 1 + i % 3) for i in range(adjectives)]
+    popularity = 1.0 / np.arange(1, adjectives + 1) ** skew
+    popularity /= popularity.sum()
+    nouns = []
+    for i in range(count):
+        k = min(adjectives, 1 + rng.poisson(per_noun - 1))
+        chosen = rng.choice(adjectives, size=k, replace=False, p=popularity)
+        nouns.append(Noun('noun{}'.format(i), 1 + i % 4, [vocabulary[j] for j in chosen]))
+    return nouns
+
+
+def best_time(func, repeat=5, number=1):
+    """
+    Time a function the way timeit does: the best of *repeat* runs of *number* calls.
+
+    :return: the best time per call in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+class StubWord2Vec:
+    """
+    Stands in for a gensim word2vec model.  Every word gets a random vector seeded by the word itself, so results are
+    the same on every run without a trained model file.
+    """
+    def __init__(self, vector_size=100):
+        self.vector_size = vector_size
+        self._vectors = dict()
+
+    def __contains__(self, word):
+        return True
+
+    def __getitem__(self, word):
+        if word not in self._vectors:
+            rng = np.random.RandomState(zlib.crc32(word.encode('utf8')))
+            self._vectors[word] = rng.standard_normal(self.vector_size).astype(np.float32)
+        return self._vectors[word]
+
+    def similarity(self, word_1, word_2):
+        v_1 = self[word_1]
+        v_2 = self[word_2]
+        return np.dot(v_1, v_2) / (np.linalg.norm(v_1) * np.linalg.norm(v_2))
+
+
+def distinct_metaphors(count, nouns=100):
+    """
+    Build *count* distinct metaphors over a small set of nouns, so that large memories can be filled without a large
+    lexicon.  Each noun pair gets many adjectives.
+    """
+    nouns = [Noun('noun{}'.format(i), 1) for i in range(nouns)]
+    pairs = [(noun_1, noun_2) for i, noun_1 in enumerate(nouns) for noun_2 in nouns[i + 1:]]
+    adjectives = [Word('adj{}'.format(i), 1) for i in range(count // len(pairs) + 1)]
+    return [Metaphor(pair[0], pair[1], adj) for adj in adjectives for pair in pairs][:count]
+
+
+# The filler words of Main.py
+FILLERS = ['is', 'and', 'ere', 'such', 'how', 'grows', 'finds', 'flees', 'looms', 'rises', 'yo', 'this', 'there', 'of',
+           'like']
+
+
+def local_metaphor_agent(nouns, embeddings, lexicon=None, mem_cap=100, env=None):
+    """
+    Create a MetaphorAgent in a :class:'LocalEnvironment', see FastSimulation.local_agent().  Agents created in the same
+    *env* share its :class:'MetaphorStore'.
+    """
+    env = env if env is not None else FastSimulation.LocalEnvironment()
+    return FastSimulation.local_agent(MetaphorAgent, env, nouns, embeddings, mem_cap=mem_cap, lexicon=lexicon)
+
+
+def local_haiku_agent(mem_cap=500, env=None):
+    """
+    Create a HaikuAgent with the fillers of Main.py in a :class:'LocalEnvironment', see local_metaphor_agent().
+    """
+    env = env if env is not None else FastSimulation.LocalEnvironment()
+    return FastSimulation.local_agent(HaikuAgent, env, [Word(word, 1) for word in FILLERS], mem_cap=mem_cap)
+
+
+def simulation_inputs(nouns):
+    """
+    The inputs of a simulation as Main.py prepares them, with stub embeddings.
+
+    :return: a tuple of the filtered nouns, their :class:'NounEmbeddings' and the fillers
+    """
+    nouns = filter_nouns(nouns)
+    embeddings = NounEmbeddings.from_word2vec(StubWord2Vec(), [noun.word for noun in nouns])
+    return nouns, embeddings, [Word(filler, 1) for filler in FILLERS]
+
+
+@contextlib.contextmanager
+def quiet_environment():
+    """
+    Keep the environment from logging every winner while a simulation is timed.
+    """
+    logger = logging.getLogger('MetaHaikuEnvironment')
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def fill_memory(memory, lexicon, count):
+    """
+    Memorize *count* random metaphors drawn from the lexicon.
+    """
+    for _ in range(count):
+        memory.memorize(Metaphor(*lexicon.sample()))
+
+
+def legacy_filter_nouns(nouns):
+    """
+    The pairwise filter_nouns from Main.py before the incidence matrix version, kept as a reference.  Note that it
+    also matches a noun with itself.
+    """
+    matched = []
+    for noun in nouns:
+        matched_this = False
+        for other_noun in nouns:
+            if matched_this:
+                break
+            for adj in other_noun.adjectives:
+                if adj in noun.adjectives:
+                    matched += [noun]
+                    matched_this = True
+                    break
+    return matched
+
+
+def legacy_generate(nouns):
+    """
+    The search loop MetaphorAgent.generate used before the :class:'Lexicon' sampler, kept as a reference.
+    """
+    random.shuffle(nouns)
+    for noun_1 in nouns:
+        for noun_2 in nouns:
+            if noun_1.word != noun_2.word:
+                for adj in noun_1.get_adjectives():
+                    if adj.word in [adj2.word for adj2 in noun_2.get_adjectives()]:
+                        if random.randint(0, 1) == 1:
+                            return Metaphor(noun_1, noun_2, adj)
+    return None
+
+
+def legacy_parse_sentence(sentence, nouns):
+    """
+    NounListGenerator.parse_sentence before the tag scanner, kept as a reference.  It builds a chunk parser for every
+    sentence and deduplicates adjectives by searching the lists.
+    """
+    import nltk
+    result = nltk.RegexpParser("NP: {<DT>?<JJ>*<NN>}").parse(sentence)
+    for np in result:
+        if type(np) is nltk.Tree and np.label() == 'NP':
+            noun = None
+            adjectives = []
+            for pos in np:
+                if pos[1] == 'NN':
+                    noun = pos[0]
+                if pos[1] == 'JJ':
+                    adjectives.append(pos[0])
+            if noun is not None and len(adjectives) > 0:
+                if noun not in nouns:
+                    nouns[noun] = adjectives
+                else:
+                    for adj in adjectives:
+                        if not adj in nouns[noun]:
+                            nouns[noun].append(adj)
+
+
+def legacy_vote_winners(votes, candidates, k):
+    """
+    The bookkeeping of MetaHaikuEnvironment.vote before the score matrix, kept as a reference: per-vote division into
+    a dict, then a full sort to take the top k.
+
+    :param votes: one list of (candidate, score) tuples per agent, as CreativeAgent.vote returns them
+    """
+    scores = dict((candidate, 0) for candidate in candidates)
+    for agent_votes in votes:
+        for vote in agent_votes:
+            scores[vote[0]] += vote[1] / len(votes)
+    return sorted(scores, key=scores.get, reverse=True)[0:k]
+
+
+def legacy_eval_haiku(agent, haiku):
+    """
+    The topic guessing of HaikuAgent.eval_haiku before the adjective index, kept as a reference: every word of the
+    haiku is compared with the adjective of every candidate metaphor.
+
+    :return: the topic scores
+    """
+    haiku_content = haiku.line_1 + haiku.line_2 + haiku.line_3
+    candidate_metaphors = []
+    for word in haiku_content:
+        candidate_metaphors += agent.memory.metaphors_with(word)
+    candidate_scores = dict([(candidate, 1) for candidate in candidate_metaphors])
+    for word in haiku_content:
+        for metaphor in candidate_metaphors:
+            if word == metaphor.adjective:
+                candidate_scores[metaphor] += 1
+    topic_scores = dict()
+    for cand in candidate_scores.keys():
+        if cand.noun_2 not in topic_scores.keys():
+            topic_scores[cand.noun_2] = 0
+        topic_scores[cand.noun_2] += candidate_scores[cand]
+    return topic_scores
+
+
+def legacy_write_line(agent, length, nouns, adjectives):
+    """
+    The original HaikuAgent.write_line, kept as a reference: draw words until the line is long enough, drop the last
+    word if it overshoots and pad with fillers.  The word kinds are drawn with randint as it did, not with the class
+    weights.
+    """
+    line = []
+    sylla_count = 0
+    while sylla_count < length:
+        choice = random.randint(0, 5)
+        if choice <= 1:
+            line += [random.choice(nouns)]
+        elif choice <= 3:
+            line += [random.choice(adjectives)]
+        else:
+            line += [random.choice(agent.fillers)]
+        sylla_count += line[-1].syllables
+    if sylla_count > length:
+        sylla_count -= line[-1].syllables
+        line = line[:-1]
+    while sylla_count < length:
+        line += [random.choice(agent.fillers)]
+        sylla_count += 1
+    return line
+
+
+def legacy_haiku_lines(agent):
+    """
+    The lines of HaikuAgent.generate before the :class:'LineTable'.
+    """
+    topic = random.choice(agent.memory.nouns())
+    nouns, adjectives = agent.get_applicable(topic)
+    return [legacy_write_line(agent, length, nouns, adjectives) for length in (5, 7, 5)]
+
+
+def bench_generate(nouns, draws=1000):
+    """
+    Compare drawing metaphors with the legacy search loop and with the :class:'Lexicon' sampler.
+
+    :param nouns: the noun list to draw from
+    :param draws: the number of metaphors drawn per timed run
+    :return: dict of seconds per metaphor for each method
+    """
+    nouns = list(nouns)
+    start = time.perf_counter()
+    lexicon = Lexicon(nouns)
+    build = time.perf_counter() - start
+    results = {
+        'legacy': best_time(lambda: legacy_generate(nouns), repeat=3, number=max(1, draws // 10)),
+        'lexicon_build': build,
+        'lexicon_first': best_time(lambda: [lexicon.sample() for _ in range(draws)], repeat=1) / draws,
+        'lexicon': best_time(lambda: [lexicon.sample() for _ in range(draws)]) / draws,
+    }
+    return results
+
+
+def bench_similarity(nouns, pairs=10000):
+    """
+    Compare one-pair-at-a-time similarity queries on the model with batched queries on :class:'NounEmbeddings' for each
+    cache type.
+
+    :return: dict of seconds per pair for each method
+    """
+    model = StubWord2Vec()
+    words = [noun.word for noun in nouns]
+    sample = [(random.choice(words), random.choice(words)) for _ in range(pairs)]
+    results = {'model': best_time(lambda: [model.similarity(w_1, w_2) for w_1, w_2 in sample], repeat=3) / pairs}
+    for cache in ['dense', 'blocked', None]:
+        embeddings = NounEmbeddings.from_word2vec(model, words, cache=cache)
+        results['single_{}'.format(cache)] = best_time(
+            lambda: [embeddings.similarity(w_1, w_2) for w_1, w_2 in sample], repeat=3) / pairs
+        results['batched_{}'.format(cache)] = best_time(lambda: embeddings.similarities(sample)) / pairs
+    return results
+
+
+def bench_invent(nouns, tries=(10, 100, 500)):
+    """
+    Compare scoring invent candidates one eval_metaphor call at a time with scoring them in one eval_metaphors batch,
+    for agents with a full memory.
+
+    :param tries: the INVENT_TRIES values to time
+    :return: dict of seconds per invent for each method and number of tries
+    """
+    lexicon = Lexicon(nouns)
+    embeddings = NounEmbeddings.from_word2vec(StubWord2Vec(), [noun.word for noun in nouns])
+    agent = local_metaphor_agent(nouns, embeddings, lexicon)
+    fill_memory(agent.memory, lexicon, agent.memory.capacity)
+    results = dict()
+    for n in tries:
+        candidates = [Metaphor(*lexicon.sample()) for _ in range(n)]
+        results['loop_{}'.format(n)] = best_time(lambda: max(agent.eval_metaphor(c) for c in candidates), repeat=3)
+        results['batch_{}'.format(n)] = best_time(lambda: agent.eval_metaphors(candidates).argmax(), repeat=3)
+    return results
+
+
+def bench_filter_nouns(sizes=(1000, 10000, 100000), legacy_limit=10000, product_limit=10000):
+    """
+    Time filter_nouns on synthetic lexicons of increasing size.  The legacy pairwise filter and the full shared count
+    product are only timed up to the given limits.
+
+    :return: dict of seconds per call for each method and size
+    """
+    results = dict()
+    for size in sizes:
+        nouns = synthetic_nouns(size)
+        results['incidence_{}'.format(size)] = best_time(lambda: incidence_matrix(nouns), repeat=3)
+        results['filter_{}'.format(size)] = best_time(lambda: filter_nouns(nouns), repeat=3)
+        if size <= product_limit:
+            results['shared_counts_{}'.format(size)] = best_time(lambda: shared_adjective_counts(nouns), repeat=3)
+        if size <= legacy_limit:
+            results['legacy_{}'.format(size)] = best_time(lambda: legacy_filter_nouns(nouns), repeat=1)
+    return results
+
+
+def bench_noun_extraction(limit=10000):
+    """
+    Time noun extraction from the Brown categories used by NounListGenerator, one sentence at a time (tagging and
+    chunk parsing per sentence) against the batched tagging and tag scanner.  The two stages are also timed on their
+    own.  Needs the nltk brown corpus and tagger data.
+
+    :param limit: the number of sentences to process, None for all of them
+    :return: dict of sentences per second for each path
+    """
+    import nltk
+    from nltk.corpus import brown
+    import NounListGenerator
+
+    sentences = list(brown.sents(categories=NounListGenerator.BROWN_CATEGORIES)[:limit])
+    results = dict()
+
+    start = time.perf_counter()
+    tagged = [nltk.pos_tag(sentence) for sentence in sentences]
+    results['tag_per_sentence'] = len(sentences) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    tagged = nltk.pos_tag_sents(sentences)
+    results['tag_batched'] = len(sentences) / (time.perf_counter() - start)
+
+    legacy = dict()
+    start = time.perf_counter()
+    for sentence in tagged:
+        legacy_parse_sentence(sentence, legacy)
+    results['chunk_parser'] = len(sentences) / (time.perf_counter() - start)
+    scanned, seen = dict(), dict()
+    start = time.perf_counter()
+    for sentence in tagged:
+        NounListGenerator.parse_sentence(sentence, scanned, seen)
+    results['chunk_scanner'] = len(sentences) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    NounListGenerator.process_sentences(sentences, tokenize=False)
+    results['process_sentences'] = len(sentences) / (time.perf_counter() - start)
+    return results
+
+
+def bench_vote_aggregation(sizes=((20, 25), (500, 500)), k=5):
+    """
+    Time the vote bookkeeping for random evaluations of the given numbers of agents and candidates: averaging the
+    evaluations and picking the top k candidates.  Evaluation itself is not included.
+
+    :return: dict of seconds per vote for each method and size
+    """
+    results = dict()
+    rng = np.random.RandomState(0)
+    for agents, count in sizes:
+        candidates = list(range(count))
+        scores = rng.random_sample((agents, count))
+        votes = [sorted(zip(candidates, row.tolist()), key=lambda vote: vote[1], reverse=True) for row in scores]
+        name = '{}x{}'.format(agents, count)
+        results['legacy_' + name] = best_time(lambda: legacy_vote_winners(votes, candidates, k))
+        results['matrix_' + name] = best_time(lambda: top_k(mean_scores(scores), k))
+    return results
+
+
+def bench_vote_executors(nouns, agent_counts=(25, 500), rounds=3, mem_cap=100):
+    """
+    Time one round of vote evaluations with every :mod:'VoteExecutor' backend.  Four in five agents are MetaphorAgents
+    voting on one metaphor each, the rest are HaikuAgents voting on one haiku each, as in Main.py.
+
+    :return: dict of the best wall-clock seconds per round for each backend and agent count
+    """
+    results = dict()
+    lexicon = Lexicon(nouns)
+    embeddings = NounEmbeddings.from_word2vec(StubWord2Vec(), [noun.word for noun in nouns])
+    for count in agent_counts:
+        env = FastSimulation.LocalEnvironment()
+        metaphor_agents = []
+        for _ in range(count - count // 5):
+            agent = local_metaphor_agent(nouns, embeddings, lexicon, mem_cap, env)
+            fill_memory(agent.memory, lexicon, mem_cap)
+            metaphor_agents.append(agent)
+        haiku_agents = []
+        for _ in range(count // 5):
+            agent = local_haiku_agent(5 * mem_cap, env)
+            fill_memory(agent.memory, lexicon, 5 * mem_cap)
+            haiku_agents.append(agent)
+        metaphors = [Candidate(Metaphor(*lexicon.sample())) for _ in metaphor_agents]
+        haiku = [Candidate(agent.generate().obj) for agent in haiku_agents]
+
+        for name, executor_class in EXECUTORS.items():
+            executor = executor_class()
+            for _ in range(rounds):
+                start = time.perf_counter()
+                executor.evaluate(metaphor_agents, metaphors)
+                executor.evaluate(haiku_agents, haiku)
+                results['{}_{}'.format(name, count)] = min(results.get('{}_{}'.format(name, count), float('inf')),
+                                                          time.perf_counter() - start)
+            executor.close()
+    return results
+
+
+def bench_haiku_evaluate(capacities=(500, 5000, 50000), haiku=50, nouns=2000):
+    """
+    Time HaikuAgent.eval_haiku against the legacy topic guessing for memories of increasing size, filled from a
+    synthetic lexicon which is large enough for 50,000 distinct metaphors.
+
+    :return: dict of seconds per evaluated haiku for each method and memory size
+    """
+    results = dict()
+    lexicon = Lexicon(synthetic_nouns(nouns))
+    for capacity in capacities:
+        agent = local_haiku_agent(capacity)
+        fill_memory(agent.memory, lexicon, 2 * capacity)
+        poems = [agent.generate().obj for _ in range(haiku)]
+        name = '{}'.format(agent.memory.count)
+        results['legacy_' + name] = best_time(lambda: [legacy_eval_haiku(agent, poem) for poem in poems], 3) / haiku
+        results['indexed_' + name] = best_time(lambda: [agent.eval_haiku(poem) for poem in poems], 3) / haiku
+    return results
+
+
+def bench_haiku_generate(nouns, mem_cap=500, haiku=2000):
+    """
+    Haiku generation throughput of the rejection loop against the :class:'LineTable' generator, with the tables kept
+    for the round (the memory does not change between haiku) and rebuilt for every haiku, as when the topic's
+    metaphors changed since its last haiku.  Only the topic and the lines are generated, without building the Artifact.
+
+    :return: dict of haiku per second for each method
+    """
+    lexicon = Lexicon(nouns)
+    agent = local_haiku_agent(mem_cap)
+    fill_memory(agent.memory, lexicon, mem_cap)
+
+    def table_lines():
+        table, _ = agent.line_table(random.choice(agent.memory.nouns()))
+        return [table.line(length) for length in (5, 7, 5)]
+
+    def rebuilt():
+        agent._line_tables = dict()
+        return table_lines()
+
+    return {
+        'legacy': haiku / best_time(lambda: [legacy_haiku_lines(agent) for _ in range(haiku)], 3),
+        'table_cached': haiku / best_time(lambda: [table_lines() for _ in range(haiku)], 3),
+        'table_rebuilt': haiku / best_time(lambda: [rebuilt() for _ in range(haiku)], 3),
+    }
+
+
+def bench_haiku_invent(nouns, tries=(1, 5, 10, 50), mem_cap=500, rounds=200, winners=5):
+    """
+    Time HaikuAgent.invent with batches of increasing size against one legacy generation, as one round costs: the
+    agent first memorizes *winners* new metaphors, so the line tables of their nouns are rebuilt.
+
+    :return: dict of seconds per round
+    """
+    lexicon = Lexicon(nouns)
+    agent = local_haiku_agent(mem_cap)
+    fill_memory(agent.memory, lexicon, mem_cap)
+    new_metaphors = [Metaphor(*lexicon.sample()) for _ in range(rounds * winners)]
+
+    def memorize(round_number):
+        for metaphor in new_metaphors[round_number * winners:(round_number + 1) * winners]:
+            agent.memory.memorize(metaphor)
+
+    def legacy(round_number):
+        memorize(round_number)
+        return Artifact(agent, legacy_haiku_lines(agent), domain=Haiku)
+
+    def invent(round_number):
+        memorize(round_number)
+        return agent.invent()
+
+    results = {'legacy_single': best_time(lambda: [legacy(i) for i in range(rounds)], 3) / rounds}
+    default_tries = HaikuAgent.INVENT_TRIES
+    for count in tries:
+        HaikuAgent.INVENT_TRIES = count
+        results['invent_{}'.format(count)] = best_time(lambda: [invent(i) for i in range(rounds)], 3) / rounds
+    HaikuAgent.INVENT_TRIES = default_tries
+    return results
+
+
+def bench_simulation(nouns, steps=100, runs=4):
+    """
+    Time the in-process :mod:'FastSimulation' loop with the agents of Main.py, and a batch of independent simulations
+    run with run_many().
+
+    :return: dict of seconds per step and seconds per simulation of *steps* steps
+    """
+    results = dict()
+    nouns, embeddings, fillers = simulation_inputs(nouns)
+    with quiet_environment():
+        env = FastSimulation.build_environment(nouns, embeddings, fillers, metaphor_winners=5)
+        start = time.perf_counter()
+        env.steps(steps)
+        results['local_step'] = (time.perf_counter() - start) / steps
+
+    start = time.perf_counter()
+    FastSimulation.run_many(nouns, embeddings, fillers, range(runs), steps, metaphor_winners=5)
+    results['run_many_{}'.format(runs)] = (time.perf_counter() - start) / runs
+    return results
+
+
+def checkpoint_environment(nouns, embeddings, fillers, lexicon, eviction, mem_cap=30):
+    """
+    A small :class:'LocalEnvironment' whose memories fill up within a few rounds, so that the eviction policy matters.
+    The HaikuAgents keep three times as many metaphors as the MetaphorAgents.
+    """
+    env = FastSimulation.LocalEnvironment(5)
+    for _ in range(20):
+        FastSimulation.local_agent(MetaphorAgent, env, nouns, embeddings, mem_cap=mem_cap, lexicon=lexicon,
+                                   eviction=eviction)
+    for _ in range(5):
+        FastSimulation.local_agent(HaikuAgent, env, fillers, mem_cap=mem_cap * 3, eviction=eviction)
+    return env
+
+
+def bench_checkpoint(nouns, steps=12, seed=1):
+    """
+    Time save_checkpoint() and load_checkpoint() for a seeded simulation run *steps* steps, for every eviction policy.
+
+    :return: dict per policy of seconds to save and to load
+    """
+    from Checkpoint import save_checkpoint, load_checkpoint
+
+    nouns, embeddings, fillers = simulation_inputs(nouns)
+    lexicon = Lexicon(nouns)
+    results = dict()
+    with quiet_environment(), tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'checkpoint.bin')
+        for policy in sorted(EVICTION_POLICIES):
+            random.seed(seed)
+            np.random.seed(seed)
+            env = checkpoint_environment(nouns, embeddings, fillers, lexicon, policy)
+            env.steps(steps)
+            results[policy] = {'save': best_time(lambda: save_checkpoint(env, file_name), 3),
+                               'load': best_time(lambda: load_checkpoint(file_name, restore_random=False), 3)}
+    return results
+
+
+def bench_sharded_simulation(nouns, agents=250, shards=(1, 2, 4), steps=10):
+    """
+    Time steps of a :class:'ShardedSimulation' with four in five agents MetaphorAgents, against the same agents in one
+    in-process :class:'LocalEnvironment'.
+
+    :return: dict of seconds per step for the local run and each shard count
+    """
+    results = dict()
+    nouns, embeddings, fillers = simulation_inputs(nouns)
+    with quiet_environment():
+        env = FastSimulation.build_environment(nouns, embeddings, fillers, agents - agents // 5, agents // 5)
+        # The first steps are cheaper, as the memories are still empty
+        env.steps(2)
+        start = time.perf_counter()
+        env.steps(steps)
+        results['local'] = (time.perf_counter() - start) / steps
+        for count in shards:
+            sim = ShardedSimulation(nouns, embeddings, fillers, count, agents - agents // 5, agents // 5)
+            sim.steps(2)
+            start = time.perf_counter()
+            sim.steps(steps)
+            results['shards_{}'.format(count)] = (time.perf_counter() - start) / steps
+            sim.close()
+    return results
+
+
+def _measure_load(statement):
+    """
+    Run a statement which loads a noun list into *nouns* in a fresh interpreter, and report the load time and the
+    growth of the resident set size.
+    """
+    script = """
+import json, os, sys, time
+sys.path.insert(0, {path!r})
+
+def rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+from Model_Classes import Noun
+from CompiledLexicon import CompiledLexicon
+before = rss()
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'rss_bytes': rss() - before}}))
+""".format(path=os.path.dirname(os.path.abspath(__file__)), statement=statement)
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def bench_lexicon_load(file_name='nouns_brown.txt', synthetic_sizes=(10000, 100000)):
+    """
+    Compare loading a noun list from the text format with loading it from the compiled format, both lazily and with
+    every noun built.  Each load runs in its own interpreter so the resident set sizes are comparable.
+
+    :return: dict of {'seconds', 'rss_bytes'} for each method and lexicon
+    """
+    directory = tempfile.mkdtemp()
+    sources = [(file_name, load_nouns(file_name))]
+    sources += [('synthetic_{}'.format(size), synthetic_nouns(size, per_noun=10)) for size in synthetic_sizes]
+    results = dict()
+    for name, nouns in sources:
+        text_file = os.path.join(directory, name + '.txt')
+        with open(text_file, 'w') as f:
+            for noun in nouns:
+                f.write(" ".join([noun.word, str(noun.syllables)]
+                                 + ["{} {}".format(adj.word, adj.syllables) for adj in noun.adjectives]) + "\n")
+        write_compiled_lexicon(text_file + '.lex', nouns)
+        results['text_' + name] = _measure_load(
+            "with open({!r}) as f:\n    nouns = [Noun.parse(line) for line in f.readlines()]".format(text_file))
+        results['compiled_lazy_' + name] = _measure_load("nouns = CompiledLexicon({!r})".format(text_file + '.lex'))
+        results['compiled_full_' + name] = _measure_load(
+            "nouns = CompiledLexicon({!r}).nouns()".format(text_file + '.lex'))
+    return results
+
+
+def bench_memory_footprint(nouns, agent_counts=(1000, 5000), mem_cap=100, pool=2500):
+    """
+    Measure the memory taken by agent memories.  Every agent memorizes *mem_cap* metaphors drawn from a shared pool
+    of *pool* winners, like agents memorizing the winners of a long simulation.  The memories either each have a
+    private :class:'MetaphorStore' or share one, as in an environment.
+
+    :return: dict with the bytes per metaphor object, and the bytes per agent and per memory entry for each agent count
+     and store setup
+    """
+    lexicon = Lexicon(nouns)
+    triples = [lexicon.sample() for _ in range(pool)]
+    results = dict()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    winners = [Metaphor(*triple) for triple in triples]
+    results['bytes_per_metaphor'] = (tracemalloc.get_traced_memory()[0] - before) / float(pool)
+    for setup in ['private', 'shared']:
+        for count in agent_counts:
+            before = tracemalloc.get_traced_memory()[0]
+            store = MetaphorStore()
+            memories = []
+            for _ in range(count):
+                memory = MetaphorMemory(mem_cap, store=store if setup == 'shared' else None)
+                for metaphor in random.sample(winners, mem_cap):
+                    memory.memorize(metaphor)
+                memories.append(memory)
+            used = tracemalloc.get_traced_memory()[0] - before
+            results['{}_bytes_per_agent_{}'.format(setup, count)] = used / float(count)
+            results['{}_bytes_per_entry_{}'.format(setup, count)] = used / float(count * mem_cap)
+            del memories, store
+    tracemalloc.stop()
+    return results
+
+
+def bench_memory_eviction(capacities=(100, 10000, 1000000), operations=20000):
+    """
+    Time memorize calls on a full memory for every eviction policy.  Every other call memorizes a new metaphor, which
+    forgets an old one.  The calls in between memorize a metaphor picked from the memory before the run, which is
+    mostly still there and counts as a use.
+
+    :return: dict of seconds per memorize for each policy and capacity
+    """
+    results = dict()
+    for capacity in capacities:
+        metaphors = distinct_metaphors(capacity + operations)
+        for policy in sorted(EVICTION_POLICIES):
+            memory = MetaphorMemory(capacity, policy)
+            for metaphor in metaphors[:capacity]:
+                memory.memorize(metaphor)
+            calls = []
+            for i in range(operations):
+                calls.append(metaphors[capacity + i])
+                calls.append(memory.get_random_metaphor())
+            start = time.perf_counter()
+            for metaphor in calls:
+                memory.memorize(metaphor)
+            results['{}_{}'.format(policy, capacity)] = (time.perf_counter() - start) / len(calls)
+            del memory
+        del metaphors
+    return results
+
+
+def bench_metaphor_agent(sizes=(1000, 10000), mem_cap=100, draws=200):
+    """
+    Time MetaphorAgent.generate, invent and eval_metaphor for an agent with a full memory, on synthetic lexicons of
+    increasing size.  The agent lives in a :class:'LocalEnvironment', so it is a complete agent.
+
+    :return: dict of seconds per call for each method and lexicon size
+    """
+    results = dict()
+    for size in sizes:
+        nouns = synthetic_nouns(size)
+        embeddings = NounEmbeddings.from_word2vec(StubWord2Vec(), [noun.word for noun in nouns])
+        agent = FastSimulation.local_agent(MetaphorAgent, FastSimulation.LocalEnvironment(), nouns, embeddings,
+                                           mem_cap=mem_cap)
+        fill_memory(agent.memory, agent.lexicon, mem_cap)
+        candidates = [Metaphor(*agent.lexicon.sample()) for _ in range(draws)]
+        results['generate_{}'.format(size)] = best_time(lambda: [agent.generate() for _ in range(draws)], 3) / draws
+        invents = max(1, draws // MetaphorAgent.INVENT_TRIES)
+        results['invent_{}'.format(size)] = best_time(lambda: [agent.invent() for _ in range(invents)], 3) / invents
+        results['eval_metaphor_{}'.format(size)] = best_time(
+            lambda: [agent.eval_metaphor(candidate) for candidate in candidates], 3) / draws
+    return results
+
+
+def bench_memory_forget(capacities=(100, 10000, 100000), operations=20000):
+    """
+    Time forgetting metaphors from a full memory, in random order, for every eviction policy.
+
+    :return: dict of seconds per forget for each policy and capacity
+    """
+    results = dict()
+    for capacity in capacities:
+        metaphors = distinct_metaphors(capacity)
+        for policy in sorted(EVICTION_POLICIES):
+            memory = MetaphorMemory(capacity, policy)
+            for metaphor in metaphors:
+                memory.memorize(metaphor)
+            calls = random.sample(metaphors, min(capacity, operations))
+            start = time.perf_counter()
+            for metaphor in calls:
+                memory.forget(metaphor)
+            results['{}_{}'.format(policy, capacity)] = (time.perf_counter() - start) / len(calls)
+            del memory
+    return results
+
+
+def bench_haiku_agent(capacities=(500, 5000), nouns=2000, lines=1000):
+    """
+    Time HaikuAgent.write_line with the nouns and adjectives of a topic, and HaikuAgent.evaluate, for memories of
+    increasing size filled from a synthetic lexicon.
+
+    :return: dict of seconds per line and per evaluation for each memory size
+    """
+    results = dict()
+    lexicon = Lexicon(synthetic_nouns(nouns))
+    for capacity in capacities:
+        agent = local_haiku_agent(capacity)
+        fill_memory(agent.memory, lexicon, capacity)
+        topics = [random.choice(agent.memory.nouns()) for _ in range(10)]
+        applicable = [agent.get_applicable(topic) for topic in topics]
+        artifacts = [agent.generate() for _ in range(lines // 10)]
+        results['write_line_{}'.format(capacity)] = best_time(
+            lambda: [agent.write_line(7, *words) for words in applicable for _ in range(lines // 10)], 3) / lines
+        results['evaluate_{}'.format(capacity)] = best_time(
+            lambda: [agent.evaluate(artifact) for artifact in artifacts], 3) / len(artifacts)
+    return results
+
+
+def bench_vote(nouns, agent_counts=(25, 250), steps=5):
+    """
+    Time the two phases of a simulation step, the agents acting and MetaHaikuEnvironment.vote, in a
+    :class:'LocalEnvironment' with four in five agents MetaphorAgents.
+
+    :return: dict of the best seconds per phase for each agent count
+    """
+    results = dict()
+    nouns, embeddings, fillers = simulation_inputs(nouns)
+    with quiet_environment():
+        for count in agent_counts:
+            env = FastSimulation.build_environment(nouns, embeddings, fillers, count - count // 5, count // 5)
+            env.steps(2)
+            act, vote = float('inf'), float('inf')
+            for _ in range(steps):
+                start = time.perf_counter()
+                env.act()
+                middle = time.perf_counter()
+                env.vote(env.age)
+                act, vote = min(act, middle - start), min(vote, time.perf_counter() - middle)
+            results['act_{}'.format(count)] = act
+            results['vote_{}'.format(count)] = vote
+    return results
+
+
+# The benchmarks run by run_suite(): name, title, function of the noun list, and whether larger results are better
+SUITE = [
+    ('generate', "MetaphorAgent.generate, {nouns} nouns (seconds per metaphor)", bench_generate, False),
+    ('similarity', "MetaphorAgent.eval_metaphor similarity, {nouns} nouns (seconds per pair)", bench_similarity, False),
+    ('invent', "MetaphorAgent.invent scoring, {nouns} nouns (seconds per invent)", bench_invent, False),
+    ('metaphor_agent', "MetaphorAgent on synthetic lexicons (seconds per call)",
+     lambda nouns: bench_metaphor_agent(), False),
+    ('filter_nouns', "filter_nouns on synthetic lexicons (seconds per call)", lambda nouns: bench_filter_nouns(), False),
+    ('lexicon_load', "Noun list loading (seconds, resident set growth in bytes)",
+     lambda nouns: bench_lexicon_load(), False),
+    ('memory_footprint', "Agent memory footprint (bytes)", bench_memory_footprint, False),
+    ('memory_eviction', "MetaphorMemory.memorize at capacity (seconds per call)",
+     lambda nouns: bench_memory_eviction(), False),
+    ('memory_forget', "MetaphorMemory.forget (seconds per call)", lambda nouns: bench_memory_forget(), False),
+    ('vote_aggregation', "MetaHaikuEnvironment.vote bookkeeping, agents x candidates (seconds per vote)",
+     lambda nouns: bench_vote_aggregation(), False),
+    ('vote', "Simulation step phases by agent count (seconds)", bench_vote, False),
+    ('vote_executors', "Vote evaluation backends (seconds per round)", bench_vote_executors, False),
+    ('haiku_agent', "HaikuAgent.write_line and evaluate (seconds per call)", lambda nouns: bench_haiku_agent(), False),
+    ('haiku_evaluate', "HaikuAgent.eval_haiku by memorized metaphors (seconds per haiku)",
+     lambda nouns: bench_haiku_evaluate(), False),
+    ('haiku_generate', "HaikuAgent.generate (haiku per second)", bench_haiku_generate, True),
+    ('haiku_invent', "HaikuAgent.invent with self-screening (seconds per round)", bench_haiku_invent, False),
+    ('simulation', "In-process simulation, 25 agents (seconds)", bench_simulation, False),
+    ('sharded_simulation', "Sharded simulation, 250 agents (seconds per step)", bench_sharded_simulation, False),
+    ('checkpoint', "Checkpoint save and load per eviction policy (seconds)", bench_checkpoint, False),
+    ('noun_extraction', "Noun extraction from the Brown categories (sentences per second)",
+     lambda nouns: bench_noun_extraction(), True),
+]
+
+
+def flatten(results, prefix=''):
+    """
+    Flatten nested result dicts, joining the keys with dots.
+    """
+    flat = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, '{}{}.'.format(prefix, key)))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def run_suite(nouns, names=None, verbose=True):
+    """
+    Run the benchmarks of SUITE.  Benchmarks which need missing nltk data are skipped.
+
+    :param nouns: the noun list for the benchmarks which take one
+    :param names: the names of the benchmarks to run, by default all of them
+    :param verbose (bool): print every result as it comes
+    :return: dict from benchmark name to a flat dict of its results
+    """
+    results = dict()
+    for name, title, bench, _ in SUITE:
+        if names is not None and name not in names:
+            continue
+        if verbose:
+            print(title.format(nouns=len(nouns)))
+        try:
+            results[name] = flatten(bench(nouns))
+        except LookupError:
+            if verbose:
+                print("  skipped, the nltk data is not installed")
+            continue
+        if verbose:
+            for key, value in results[name].items():
+                print("  {:<32}{:.3e}".format(key, value))
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Find the results which got worse than in a baseline by more than *tolerance*, relative to the baseline.  Only
+    results in both runs are compared.
+
+    :param results: run_suite() results
+    :param baseline: run_suite() results of an earlier version
+    :param tolerance (float): allowed relative change
+    :return: list of (benchmark, result, baseline value, new value) tuples
+    """
+    higher_is_better = {name: higher for name, _, _, higher in SUITE}
+    regressions = []
+    for name, values in results.items():
+        for key, value in values.items():
+            old = baseline.get(name, dict()).get(key)
+            if old is None:
+                continue
+            if higher_is_better.get(name, False):
+                worse = value < old * (1 - tolerance)
+            else:
+                worse = value > old * (1 + tolerance)
+            if worse:
+                regressions.append((name, key, old, value))
+    return regressions
+
+
+def environment_info():
+    """
+    Describe where the benchmarks ran, for the JSON output.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the benchmarks.")
+    parser.add_argument('--only', nargs='+', choices=[name for name, _, _, _ in SUITE], help="benchmarks to run")
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help="use a synthetic lexicon of this many nouns instead of nouns_brown.txt")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="report the results which got worse than in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative change for --compare")
+    args = parser.parse_args()
+
+    random.seed(0)
+    nouns = synthetic_nouns(args.synthetic) if args.synthetic > 0 else load_nouns()
+    results = run_suite(nouns, args.only)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment_info(), 'results': results}, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, key, old, value in regressions:
+            print("Regression in {} {}: {} -> {}".format(name, key, old, value))
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,331 @@
+"""
+Binary checkpoints of a whole simulation, to pause, resume or warm-start a run.
+
+A checkpoint holds everything the next rounds depend on:
+
+* the round counter and the number of metaphors accepted per round
+* the nouns of the MetaphorAgents with their adjectives, the vectors of their :class:'NounEmbeddings' and the fillers
+  of the HaikuAgents, so a resumed run reads neither the noun file nor the word2vec model and does not filter the nouns
+* every agent's memory: its metaphors, the state of its eviction policy and the order of its nouns
+* the accepted metaphors (*env.artifacts*) and winning haiku (*env.haikus*) with their creators and evaluations
+* the states of the random and numpy.random generators
+
+As in :func:'VoteExecutor.snapshot', each distinct (word, syllables) pair is stored once in a string table and
+everything else is integer arrays into it: a metaphor is three string ids, a memory an array of metaphor indexes.  The
+file is a short header followed by a pickle of the arrays.
+
+restore() rebuilds the simulation as a :class:'LocalEnvironment'.  The metaphors are given to the new store in the
+order they were added to the old one, and each memory is refilled with :meth:'MetaphorMemory.load', so the resumed
+run gives the same results as a run which was never stopped.  Checkpoints of a :class:'MetaHaikuEnvironment' can be
+taken for inspection, but restore() refuses them: the creamas agents act concurrently through their container, so a
+local run would not continue them.
+
+The environment saves a checkpoint at the end of the vote through its *checkpointer*::
+
+    env.checkpointer = Checkpointer(every=50)
+    ...
+    env = load_checkpoint(CHECKPOINT_FILE)
+    env.steps(100)
+"""
+
+import logging
+import os
+import pickle
+import random
+import struct
+import numpy as np
+from Model_Classes import Word, Noun, Metaphor, Haiku
+from MetaphorAgent import MetaphorAgent
+from HaikuAgent import HaikuAgent
+from Embeddings import NounEmbeddings
+from Lexicon import Lexicon
+from creamas import Artifact
+
+logger = logging.getLogger(__name__)
+
+# The default checkpoint file, next to the creamas logs
+CHECKPOINT_FILE = os.path.join('logs', 'checkpoint.bin')
+
+MAGIC = b'MHCP'
+VERSION = 1
+_HEADER = struct.Struct('<4sI')
+
+
+def _shared(agents, attribute, description):
+    values = [getattr(agent, attribute) for agent in agents]
+    assert all(value is values[0] for value in values), "the agents do not share {}".format(description)
+    return values[0] if values else None
+
+
+def _agent_class(agent):
+    # Local agents are saved as the agent class they were made from, see FastSimulation.local_class()
+    from FastSimulation import LocalAgent
+    cls = type(agent)
+    return cls.__bases__[0] if issubclass(cls, LocalAgent) else cls
+
+
+def snapshot(env):
+    """
+    Encode the state of a simulation, see the module documentation.
+
+    :param env: a :class:'LocalEnvironment' or :class:'MetaHaikuEnvironment'.  The MetaphorAgents must share one noun
+     list and one :class:'NounEmbeddings', and the HaikuAgents one filler list
+    :return: dict of arrays and plain values, see restore()
+    """
+    agents = env.get_agents(address=False)
+    metaphor_agents = [agent for agent in agents if isinstance(agent, MetaphorAgent)]
+    haiku_agents = [agent for agent in agents if isinstance(agent, HaikuAgent)]
+    nouns = _shared(metaphor_agents, 'nouns', 'a noun list')
+    embeddings = _shared(metaphor_agents, 'word2vec_model', 'embeddings')
+    fillers = _shared(haiku_agents, 'fillers', 'a filler list')
+    assert embeddings is None or isinstance(embeddings, NounEmbeddings), "the embeddings are not NounEmbeddings"
+
+    strings = dict()
+    names = dict()
+
+    def string_id(word):
+        return strings.setdefault((word.word, word.syllables), len(strings))
+
+    def name_id(name):
+        return names.setdefault(str(name), len(names))
+
+    from FastSimulation import LocalEnvironment
+    state = {'round': env.age, 'metaphor_winners': env.num_metaphors_accepted_per_round,
+             'environment': 'local' if isinstance(env, LocalEnvironment) else type(env).__name__}
+
+    if nouns is not None:
+        noun_ids = [string_id(noun) for noun in nouns]
+        adjective_offsets = np.cumsum([0] + [len(noun.adjectives) for noun in nouns], dtype=np.uint32)
+        adjective_ids = [string_id(adj) for noun in nouns for adj in noun.adjectives]
+        state['nouns'] = (np.array(noun_ids, dtype=np.uint32), adjective_offsets,
+                          np.array(adjective_ids, dtype=np.uint32))
+        state['embeddings'] = (embeddings.words, embeddings.vectors, embeddings.cache)
+    if fillers is not None:
+        state['fillers'] = np.array([string_id(word) for word in fillers], dtype=np.uint32)
+
+    # Metaphors are listed with their nouns in order, as equal metaphors may have them in either order.  The metaphors
+    # of the memories come first, in the order they were added to the store, see restore()
+    metaphors = dict()
+
+    def metaphor_index(metaphor):
+        triple = (string_id(metaphor.noun_1), string_id(metaphor.noun_2), string_id(metaphor.adjective))
+        return metaphors.setdefault(triple, len(metaphors))
+
+    store = env.metaphor_store
+    ids = [agent.memory.ids() for agent in agents]
+    for metaphor_id in sorted(set().union(*ids), key=store.sequence):
+        metaphor_index(store.metaphor(metaphor_id))
+    state['stored'] = len(metaphors)
+
+    memories = []
+    for agent, memory_ids in zip(agents, ids):
+        memory = agent.memory
+        positions = dict((metaphor_id, i) for i, metaphor_id in enumerate(memory_ids))
+        eviction_state = memory.eviction_state()
+        memories.append((_agent_class(agent), memory.capacity, memory.eviction,
+                         np.array([metaphor_index(store.metaphor(i)) for i in memory_ids], dtype=np.uint32),
+                         np.array([positions[i] for i, _ in eviction_state], dtype=np.uint32),
+                         np.array([count for _, count in eviction_state], dtype=np.uint32),
+                         np.array([string_id(noun) for noun in memory.nouns()], dtype=np.uint32),
+                         memory.evictions))
+    state['agents'] = memories
+
+    def encode_artifacts(artifacts):
+        offsets = np.cumsum([0] + [len(artifact.evals) for artifact in artifacts], dtype=np.uint32)
+        evaluators = [name_id(name) for artifact in artifacts for name in artifact.evals]
+        evals = [value for artifact in artifacts for value in artifact.evals.values()]
+        return (np.array([name_id(artifact.creator) for artifact in artifacts], dtype=np.uint32), offsets,
+                np.array(evaluators, dtype=np.uint32), np.array(evals, dtype=np.float64))
+
+    state['artifacts'] = (np.array([metaphor_index(artifact.obj) for artifact in env.artifacts], dtype=np.uint32),
+                          encode_artifacts(env.artifacts))
+    haikus = [artifact.obj for artifact in env.haikus]
+    lines = [line for haiku in haikus for line in (haiku.line_1, haiku.line_2, haiku.line_3)]
+    state['haikus'] = (np.array([string_id(haiku.topic) for haiku in haikus], dtype=np.uint32),
+                       np.array([len(line) for line in lines], dtype=np.uint8),
+                       np.array([string_id(word) for line in lines for word in line], dtype=np.uint32),
+                       np.array([isinstance(word, Noun) for line in lines for word in line], dtype=np.bool_),
+                       np.array([haiku.metaphors_used for haiku in haikus], dtype=np.uint32),
+                       np.array([haiku.guessed_by for haiku in haikus], dtype=np.uint32),
+                       encode_artifacts(env.haikus))
+
+    state['metaphors'] = np.array(list(metaphors), dtype=np.uint32).reshape(-1, 3)
+    state['strings'] = [word for word, _ in strings]
+    state['syllables'] = np.array([syllables for _, syllables in strings], dtype=np.uint8)
+    state['names'] = list(names)
+    state['random'] = random.getstate()
+    state['numpy_random'] = np.random.get_state()
+    return state
+
+
+def restore(state, vote_executor=None, restore_random=True):
+    """
+    Rebuild a simulation from a snapshot().
+
+    :param state (dict): the snapshot
+    :param vote_executor: the executor of the new environment, see :class:'LocalEnvironment'
+    :param restore_random (bool): set the random and numpy.random generators to their saved states
+    :return: a :class:'LocalEnvironment' which continues from the saved round
+    :raises ValueError: if the snapshot was not taken from a :class:'LocalEnvironment'
+    """
+    from FastSimulation import LocalEnvironment, local_agent
+
+    if state.get('environment', 'local') != 'local':
+        raise ValueError("the checkpoint was saved from a {} run, and only runs of a LocalEnvironment (Main.py --local) "
+                         "can be resumed".format(state['environment']))
+
+    strings = state['strings']
+    syllables = state['syllables']
+
+    def word(i):
+        return Word.interned(strings[i], int(syllables[i]))
+
+    nouns = None
+    noun_by_id = dict()
+    if 'nouns' in state:
+        noun_ids, adjective_offsets, adjective_ids = state['nouns']
+        nouns = [Noun(strings[i], int(syllables[i]), [word(j) for j in adjective_ids[start:end]])
+                 for i, start, end in zip(noun_ids, adjective_offsets[:-1], adjective_offsets[1:])]
+        noun_by_id = dict((int(i), noun) for i, noun in zip(noun_ids, nouns))
+        words, vectors, cache = state['embeddings']
+        embeddings = NounEmbeddings(words, vectors, cache=cache, normalized=True)
+        lexicon = Lexicon(nouns)
+    fillers = [word(i) for i in state['fillers']] if 'fillers' in state else None
+
+    def noun(i):
+        i = int(i)
+        if i not in noun_by_id:
+            noun_by_id[i] = Noun(strings[i], int(syllables[i]))
+        return noun_by_id[i]
+
+    table = [Metaphor(noun(n_1), noun(n_2), word(adj)) for n_1, n_2, adj in state['metaphors']]
+
+    env = LocalEnvironment(state['metaphor_winners'], vote_executor)
+    env.age = state['round']
+    # The store gets the memories' metaphors up front in the saved order, so it lists them in the same order as the
+    # store they were saved from.  The extra references are released once every memory holds its metaphors
+    store = env.metaphor_store
+    for metaphor in table[:state['stored']]:
+        store.retain(metaphor)
+    for cls, capacity, eviction, indexes, positions, counts, topics, evictions in state['agents']:
+        if issubclass(cls, MetaphorAgent):
+            agent = local_agent(cls, env, nouns, embeddings, mem_cap=capacity, lexicon=lexicon, eviction=eviction)
+        elif issubclass(cls, HaikuAgent):
+            agent = local_agent(cls, env, fillers, mem_cap=capacity, eviction=eviction)
+        else:
+            raise ValueError("cannot restore agents of class {}".format(cls.__name__))
+        agent.memory.load([table[i] for i in indexes], zip(positions.tolist(), counts.tolist()),
+                          [noun(i) for i in topics], evictions)
+    for metaphor in table[:state['stored']]:
+        store.release(store.id_of(metaphor))
+
+    names = state['names']
+
+    def decode_artifacts(objects, domain, encoded):
+        creators, offsets, evaluators, evals = encoded
+        artifacts = []
+        for obj, creator, start, end in zip(objects, creators, offsets[:-1], offsets[1:]):
+            artifact = Artifact(names[creator], obj, domain=domain)
+            for evaluator, value in zip(evaluators[start:end], evals[start:end]):
+                artifact.evals[names[evaluator]] = float(value)
+                artifact.framings[names[evaluator]] = None
+            artifacts.append(artifact)
+        return artifacts
+
+    indexes, encoded = state['artifacts']
+    env.artifacts = decode_artifacts([table[i] for i in indexes], Metaphor, encoded)
+
+    topics, lengths, word_ids, is_noun, metaphors_used, guessed_by, encoded = state['haikus']
+    line_words = [noun(i) if flag else word(i) for i, flag in zip(word_ids, is_noun)]
+    ends = np.cumsum(lengths)
+    lines = [line_words[end - length:end] for end, length in zip(ends.tolist(), lengths.tolist())]
+    haikus = []
+    for i, topic in enumerate(topics):
+        haiku = Haiku(noun(topic), lines[3 * i], lines[3 * i + 1], lines[3 * i + 2], int(metaphors_used[i]))
+        haiku.guessed_by = int(guessed_by[i])
+        haikus.append(haiku)
+    env.haikus = decode_artifacts(haikus, Haiku, encoded)
+
+    if restore_random:
+        random.setstate(state['random'])
+        np.random.set_state(state['numpy_random'])
+    return env
+
+
+def save_checkpoint(env, file_name=CHECKPOINT_FILE):
+    """
+    Write a snapshot() of a simulation.  The file is replaced only once the new checkpoint is complete, so a crash
+    while saving leaves the previous checkpoint.
+
+    :param env: the environment, see snapshot()
+    :param file_name (str): the file to write.  Its folder is created if needed
+    :return: the size of the checkpoint in bytes
+    """
+    folder = os.path.dirname(file_name)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    partial_file = file_name + '.partial'
+    with open(partial_file, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION))
+        pickle.dump(snapshot(env), f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = f.tell()
+    os.replace(partial_file, file_name)
+    return size
+
+
+def load_checkpoint(file_name=CHECKPOINT_FILE, vote_executor=None, restore_random=True):
+    """
+    Read a checkpoint written by save_checkpoint() and rebuild the simulation, see restore().
+
+    :return: a :class:'LocalEnvironment'
+    """
+    with open(file_name, 'rb') as f:
+        magic, version = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a checkpoint of version {}".format(file_name, VERSION))
+        state = pickle.load(f)
+    return restore(state, vote_executor, restore_random)
+
+
+class Checkpointer:
+    """
+    Saves a checkpoint every *every* rounds, see the module documentation.
+
+    Attributes:
+        enabled     False for DISABLED
+    """
+    enabled = True
+
+    def __init__(self, every=50, file_name=CHECKPOINT_FILE):
+        """
+        :param every (int): rounds between checkpoints
+        :param file_name (str): the checkpoint file, which is replaced by every new checkpoint.  To keep them all,
+         include '{round}' in the name, e.g. 'logs/checkpoint-{round}.bin'
+        """
+        self.every = every
+        self.file_name = file_name
+
+    def end_round(self, env, round_number):
+        """
+        Save a checkpoint if *round_number* is a multiple of *every*.
+
+        :param env: the environment
+        :param round_number (int): the round
+        """
+        if round_number % self.every == 0:
+            file_name = self.file_name.format(round=round_number)
+            size = save_checkpoint(env, file_name)
+            logger.info("Saved round %d to %s (%d bytes)", round_number, file_name, size)
+
+
+class DisabledCheckpointer:
+    """
+    A checkpointer which never saves.
+    """
+    enabled = False
+
+    def end_round(self, env, round_number):
+        pass
+
+
+DISABLED = DisabledCheckpointer()
@@ -0,0 +1,225 @@
+"""
+A compact binary format for noun lists, and a memory-mapped loader for it.
+
+The text format read by :meth:'Noun.parse' stores every adjective once per noun it describes, and the whole file has
+to be split and parsed on every load.  The compiled format stores each distinct (word, syllables) pair once in a
+string table and describes the nouns with integer arrays:
+
+* header: magic, version and the sizes of the sections below (little-endian uint32)
+* string offsets: uint32[strings + 1], the start of each string in the string data
+* syllables: uint8[strings]
+* nouns: uint32[nouns], the string id of each noun
+* adjective offsets: uint32[nouns + 1], CSR style offsets into the adjective ids
+* adjective ids: uint32[adjective references], the string ids of the adjectives of each noun in turn
+* string data: the UTF-8 encoded strings
+
+Sections are padded to multiples of 4 bytes so the arrays can be used directly from the memory map.
+"""
+
+import mmap
+import os
+import struct
+import numpy as np
+from scipy import sparse
+from Model_Classes import Word, Noun
+from Lexicon import filter_nouns
+
+MAGIC = b'MHLX'
+VERSION = 1
+_HEADER = struct.Struct('<4sIIIII')
+
+
+def _padding(size):
+    return (-size) % 4
+
+
+def write_compiled_lexicon(file_name, nouns):
+    """
+    Write a list of nouns in the compiled format.
+
+    :param file_name: the file to write
+    :param nouns: the nouns (describing adjectives included)
+    :type nouns: list of :class:'Noun'
+    """
+    string_ids = dict()
+    strings = []
+
+    def intern(word):
+        key = (word.word, word.syllables)
+        if key not in string_ids:
+            string_ids[key] = len(strings)
+            strings.append(key)
+        return string_ids[key]
+
+    noun_ids = []
+    adjective_offsets = [0]
+    adjective_ids = []
+    for noun in nouns:
+        noun_ids.append(intern(noun))
+        adjective_ids.extend(intern(adj) for adj in noun.adjectives)
+        adjective_offsets.append(len(adjective_ids))
+
+    encoded = [word.encode('utf8') for word, _ in strings]
+    string_offsets = np.zeros(len(strings) + 1, dtype='<u4')
+    string_offsets[1:] = np.cumsum([len(data) for data in encoded])
+    syllables = np.array([syllables for _, syllables in strings], dtype=np.uint8)
+
+    with open(file_name, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(strings), len(noun_ids), len(adjective_ids), int(string_offsets[-1])))
+        for array in [string_offsets, syllables, np.array(noun_ids, dtype='<u4'),
+                      np.array(adjective_offsets, dtype='<u4'), np.array(adjective_ids, dtype='<u4')]:
+            data = array.tobytes()
+            f.write(data + b'\0' * _padding(len(data)))
+        f.write(b''.join(encoded))
+
+
+def compile_text(text_file, compiled_file=None):
+    """
+    Convert a noun data file in the text format read by :meth:'Noun.parse' to the compiled format.
+
+    :param text_file: the text file
+    :param compiled_file: the file to write, by default *text_file* with '.lex' appended
+    :return: the name of the compiled file
+    """
+    compiled_file = compiled_file or text_file + '.lex'
+    with open(text_file, 'r') as f:
+        nouns = [Noun.parse(line) for line in f]
+    write_compiled_lexicon(compiled_file, nouns)
+    return compiled_file
+
+
+class CompiledLexicon:
+    """
+    A read-only, memory-mapped view of a compiled noun list.  It behaves like a list of :class:'Noun', but a noun is
+    only built the first time it is accessed.  Every distinct adjective is built once as a :class:'Word' and shared
+    by all nouns it describes.
+
+    The lexicon can be used as a context manager, which closes the memory map on exit.
+    """
+    def __init__(self, file_name):
+        """
+        :param file_name: a file written by write_compiled_lexicon()
+        """
+        self.file_name = file_name
+        with open(file_name, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_strings, n_nouns, n_references, n_bytes = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a compiled lexicon of version {}".format(file_name, VERSION))
+
+        offset = _HEADER.size
+
+        def section(dtype, count):
+            nonlocal offset
+            array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes + _padding(array.nbytes)
+            return array
+
+        self._string_offsets = section('<u4', n_strings + 1)
+        self._syllables = section(np.uint8, n_strings)
+        self._noun_ids = section('<u4', n_nouns)
+        self._adjective_offsets = section('<u4', n_nouns + 1)
+        self._adjective_ids = section('<u4', n_references)
+        self._string_data = offset
+
+        self._words = dict()
+        self._nouns = dict()
+
+    def __len__(self):
+        return len(self._noun_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i not in self._nouns:
+            string_id = int(self._noun_ids[i])
+            start, end = self._adjective_offsets[i], self._adjective_offsets[i + 1]
+            self._nouns[i] = Noun(self.string(string_id), int(self._syllables[string_id]),
+                                  [self.word(int(adj_id)) for adj_id in self._adjective_ids[start:end]])
+        return self._nouns[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def string(self, string_id):
+        """
+        Returns an entry of the string table.
+        """
+        start = self._string_data + int(self._string_offsets[string_id])
+        end = self._string_data + int(self._string_offsets[string_id + 1])
+        return self._mmap[start:end].decode('utf8')
+
+    def word(self, string_id):
+        """
+        Returns the shared :class:'Word' for an entry of the string table.
+        """
+        if string_id not in self._words:
+            self._words[string_id] = Word.interned(self.string(string_id), int(self._syllables[string_id]))
+        return self._words[string_id]
+
+    def nouns(self):
+        """
+        Returns all nouns as a list.  This builds every noun which has not been accessed yet.
+        """
+        return list(self)
+
+    def incidence_matrix(self):
+        """
+        Returns the noun x adjective incidence matrix straight from the adjective arrays, without building any nouns.
+        As in :func:'Lexicon.incidence_matrix', columns are labelled by adjective word in the order the words first
+        appear, so adjectives which only differ in their syllable count share a column.
+
+        :return: a tuple of the matrix (scipy.sparse CSR, int32) and the list of adjective words labelling its columns
+        """
+        string_ids, first = np.unique(self._adjective_ids, return_index=True)
+        columns = dict()
+        column_of = np.zeros(len(self._syllables), dtype=np.int32)
+        for string_id in string_ids[np.argsort(first, kind='stable')]:
+            column_of[string_id] = columns.setdefault(self.string(int(string_id)), len(columns))
+        matrix = sparse.csr_matrix((np.ones(len(self._adjective_ids), dtype=np.int32),
+                                    column_of[self._adjective_ids],
+                                    np.array(self._adjective_offsets, dtype=np.int64)),
+                                   shape=(len(self), len(columns)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix, list(columns.keys())
+
+    def close(self):
+        """
+        Release the memory map.  Nouns which were already built stay usable.
+        """
+        self._string_offsets = self._syllables = self._noun_ids = None
+        self._adjective_offsets = self._adjective_ids = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_nouns(file_name, filtered=False):
+    """
+    Load a noun list, preferring the compiled version of a text data file if there is an up to date one next to it.
+    The compiled file is closed again before returning.
+
+    :param file_name: a text data file, or a compiled file
+    :param filtered (bool): only return the nouns which share an adjective with another noun, see
+        :func:'Lexicon.filter_nouns'.  From a compiled file, the other nouns are never built
+    :return: list of :class:'Noun'
+    """
+    compiled_file = file_name if file_name.endswith('.lex') else file_name + '.lex'
+    if os.path.isfile(compiled_file) and (not os.path.isfile(file_name)
+                                          or os.path.getmtime(compiled_file) >= os.path.getmtime(file_name)):
+        with CompiledLexicon(compiled_file) as lexicon:
+            if filtered:
+                incidence, _ = lexicon.incidence_matrix()
+                return filter_nouns(lexicon, incidence)
+            return lexicon.nouns()
+    with open(file_name, 'r') as f:
+        nouns = [Noun.parse(line) for line in f.readlines()]
+    return filter_nouns(nouns) if filtered else nouns
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class NounEmbeddings:
+    """
+    The word2vec vectors of a noun vocabulary, L2-normalised once so that the similarity of two nouns is a plain dot
+    product.  One instance is meant to be shared by all MetaphorAgents in place of the full gensim model: it answers
+    the same *similarity(word_1, word_2)* question and adds a batched *similarities(pairs)* which scores many pairs in
+    one NumPy operation.
+
+    Similarities can optionally be cached:
+
+    * 'dense' computes the full vocabulary x vocabulary similarity matrix up front
+    * 'blocked' computes blocks of BLOCK_SIZE rows of that matrix the first time one of their nouns is looked up, and
+      keeps the MAX_BLOCKS most recently used blocks
+    * None computes every similarity from the vectors
+
+    Attributes:
+        DENSE_CACHE_LIMIT   The largest vocabulary for which cache='auto' chooses a dense cache.  Larger vocabularies are not cached
+
+        BLOCK_SIZE          The number of rows in one block of a blocked cache
+
+        MAX_BLOCKS          The most blocks a blocked cache keeps, at most MAX_BLOCKS * BLOCK_SIZE * vocabulary float32 values
+    """
+    DENSE_CACHE_LIMIT = 4096
+    BLOCK_SIZE = 256
+    MAX_BLOCKS = 16
+
+    def __init__(self, words, vectors, cache='auto', normalized=False):
+        """
+        :param words (list of str): the vocabulary
+        :param vectors (array): one vector per word.  Words without a vector can be given a zero vector, they have similarity 0 to everything
+        :param cache (str): 'auto', 'dense', 'blocked' or None
+        :param normalized (bool): the vectors are the *vectors* of another instance and are used as they are.  Normalising them again changes the last bits of many similarities
+        """
+        assert cache in ('auto', 'dense', 'blocked', None), "unknown cache type {}".format(cache)
+        self.words = list(words)
+        self._ids = dict((word, i) for i, word in enumerate(self.words))
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if normalized:
+            self.vectors = vectors
+        else:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            self.vectors = vectors / norms
+
+        if cache == 'auto':
+            cache = 'dense' if len(self.words) <= NounEmbeddings.DENSE_CACHE_LIMIT else None
+        self.cache = cache
+        self._dense = self.vectors.dot(self.vectors.T) if cache == 'dense' else None
+        self._blocks = OrderedDict()
+
+    @classmethod
+    def from_word2vec(cls, word2vec_model, words, cache='auto'):
+        """
+        Extract the vectors of the given words from a gensim word2vec model.
+
+        :param word2vec_model: the gensim model (or its KeyedVectors)
+        :param words (list of str): the vocabulary, usually the words of the lexicon's nouns
+        :param cache (str): see :class:'NounEmbeddings'
+        :return: the embeddings
+        """
+        wv = getattr(word2vec_model, 'wv', word2vec_model)
+        words = list(words)
+        vectors = np.zeros((len(words), wv.vector_size), dtype=np.float32)
+        for i, word in enumerate(words):
+            if word in wv:
+                vectors[i] = wv[word]
+        return cls(words, vectors, cache=cache)
+
+    def __len__(self):
+        return len(self.words)
+
+    def index(self, word):
+        """
+        Returns the row of a word (or a :class:'Word') in the embedding matrix.  Raises a KeyError for unknown words.
+        """
+        return self._ids[getattr(word, 'word', word)]
+
+    def _block(self, b):
+        if b in self._blocks:
+            self._blocks.move_to_end(b)
+        else:
+            if len(self._blocks) >= NounEmbeddings.MAX_BLOCKS:
+                self._blocks.popitem(last=False)
+            start = b * NounEmbeddings.BLOCK_SIZE
+            self._blocks[b] = self.vectors[start:start + NounEmbeddings.BLOCK_SIZE].dot(self.vectors.T)
+        return self._blocks[b]
+
+    def similarities_by_index(self, rows, cols):
+        """
+        Cosine similarities of many pairs given by their rows in the embedding matrix.
+
+        :param rows: array of first indexes
+        :param cols: array of second indexes, the same length as *rows*
+        :return: float32 array of similarities
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        if self._dense is not None:
+            return self._dense[rows, cols]
+        if self.cache == 'blocked':
+            result = np.empty(len(rows), dtype=np.float32)
+            blocks = rows // NounEmbeddings.BLOCK_SIZE
+            for b in np.unique(blocks):
+                mask = blocks == b
+                result[mask] = self._block(b)[rows[mask] - b * NounEmbeddings.BLOCK_SIZE, cols[mask]]
+            return result
+        return np.einsum('ij,ij->i', self.vectors[rows], self.vectors[cols])
+
+    def similarities(self, pairs):
+        """
+        Cosine similarities of many pairs of words in one operation.
+
+        :param pairs: iterable of (word_1, word_2) tuples.  Words may be strings or :class:'Word' objects
+        :return: float32 array of similarities, in the order of *pairs*
+        """
+        pairs = list(pairs)
+        rows = [self.index(pair[0]) for pair in pairs]
+        cols = [self.index(pair[1]) for pair in pairs]
+        return self.similarities_by_index(rows, cols)
+
+    def similarity(self, word_1, word_2):
+        """
+        Cosine similarity of two words, as returned by gensim's *similarity*.
+        """
+        return self.similarities_by_index([self.index(word_1)], [self.index(word_2)])[0]
@@ -0,0 +1,291 @@
+"""
+An in-process simulation loop for the metaphor and haiku agents.
+
+:class:'MetaHaikuEnvironment' is a creamas environment, so every run binds a TCP port and the agents act through the
+aiomas container, although all agents live in one process.  Here the same agent classes run in a plain
+:class:'LocalEnvironment' instead: every step, each agent acts in turn and then the environment votes, with no
+socket, container or event loop.  The voting is the one of :class:'MetaHaikuEnvironment'.
+
+Agents are created with :func:'local_agent', which uses a subclass of the agent class whose creamas base does not
+register the agent with a container.  As nothing is shared between simulations but the read-only nouns and
+embeddings, run_many() runs many independent simulations in a pool of worker processes.
+"""
+
+import os
+import random
+import logging
+import numpy as np
+from creamas import CreativeAgent
+from MetaphorAgent import MetaphorAgent
+from HaikuAgent import HaikuAgent
+from MetaHaikuEnvironment import MetaHaikuEnvironment
+from MetaphorMemory import MetaphorStore
+from VoteExecutor import SerialExecutor
+from Metrics import DISABLED
+import MemoryProfile
+import Checkpoint
+from Lexicon import Lexicon
+
+
+class LocalAgent(CreativeAgent):
+    """
+    Stands in for the creamas base of an agent class.  It keeps the state creamas agents have, but the agent is
+    registered with a :class:'LocalEnvironment' instead of an aiomas container.
+    """
+    def __init__(self, environment, resources=0, name=None, log_folder=None, log_level=logging.DEBUG):
+        self._env = environment
+        self._max_res = resources
+        self._cur_res = resources
+        self._A = []
+        self._D = {}
+        self._connections = {}
+        self._logger = None
+        self._addr = environment.register(self)
+        self._name = name if type(name) is str and len(name) > 0 else self._addr
+
+    @property
+    def addr(self):
+        return self._addr
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+
+    def __str__(self):
+        return self._name
+
+    __repr__ = __str__
+
+
+class LocalMetaphorAgent(MetaphorAgent, LocalAgent):
+    pass
+
+
+class LocalHaikuAgent(HaikuAgent, LocalAgent):
+    pass
+
+
+_LOCAL_CLASSES = {
+    MetaphorAgent: LocalMetaphorAgent,
+    HaikuAgent: LocalHaikuAgent,
+}
+
+
+def local_class(cls):
+    """
+    The local version of an agent class, see local_agent().  The classes of the repository are defined in this module
+    so they can be pickled; other classes are created on first use.
+
+    :param cls: a subclass of CreativeAgent
+    :return: a subclass of *cls* and :class:'LocalAgent'
+    """
+    if cls not in _LOCAL_CLASSES:
+        _LOCAL_CLASSES[cls] = type('Local' + cls.__name__, (cls, LocalAgent), {})
+    return _LOCAL_CLASSES[cls]
+
+
+def local_agent(cls, env, *args, **kwargs):
+    """
+    Create an agent of class *cls* in a :class:'LocalEnvironment'.  The agent's own __init__ runs as usual, but its
+    call to the creamas constructor ends in :class:'LocalAgent'.
+
+    :param cls: the agent class, e.g. :class:'MetaphorAgent'
+    :param env (:class:'LocalEnvironment'): the environment
+    :return: the agent, an instance of *cls*
+    """
+    return local_class(cls)(env, *args, **kwargs)
+
+
+def run_coroutine(coroutine):
+    """
+    Run a coroutine which never suspends, such as the agents' act(), without an event loop.
+
+    :return: the return value of the coroutine
+    :raises RuntimeError: if the coroutine awaits something which does not complete at once
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("the coroutine suspended; agents which await other agents need a creamas Simulation")
+
+
+class LocalEnvironment:
+    """
+    The parts of :class:'MetaHaikuEnvironment' the agents and the vote use, without the creamas container.
+
+    Attributes:
+        artifacts       The accepted metaphors, oldest first
+
+        haikus          The winning haiku of every step, oldest first
+
+        age             The number of steps run
+
+        shard           The index of this environment among the shards of a :class:'ShardedSimulation', or None
+    """
+    def __init__(self, metaphor_winners=1, vote_executor=None, shard=None):
+        """
+        :param metaphor_winners (int): the number of metaphors accepted every step
+        :param vote_executor: runs the agents' evaluations, see :mod:'VoteExecutor'.  By default a :class:'SerialExecutor'
+        :param shard (int): the index of the shard, which is part of the agent addresses so that agents of different
+            shards have different names
+        """
+        self.num_metaphors_accepted_per_round = metaphor_winners
+        self.shard = shard
+        self.haikus = []
+        self.artifacts = []
+        self.age = 0
+        self.metaphor_store = MetaphorStore()
+        self.vote_executor = vote_executor if vote_executor is not None else SerialExecutor()
+        self.metrics = DISABLED
+        self.memory_profile = MemoryProfile.DISABLED
+        self.artifact_sink = None
+        self.checkpointer = Checkpoint.DISABLED
+        self._agents = []
+        self._candidates = []
+
+    vote = MetaHaikuEnvironment.vote
+    choose_winners = MetaHaikuEnvironment.choose_winners
+
+    def register(self, agent):
+        """
+        Add an agent, called by :class:'LocalAgent'.
+
+        :return: the address of the agent
+        """
+        self._agents.append(agent)
+        if self.shard is not None:
+            return 'local://{}/{}'.format(self.shard, len(self._agents) - 1)
+        return 'local://{}'.format(len(self._agents) - 1)
+
+    def get_agents(self, address=True, agent_cls=None):
+        """
+        :param address (bool): return the addresses of the agents instead of the agents
+        :param agent_cls: only return agents of this class
+        :return: list of agents in the order they were created
+        """
+        agents = [agent for agent in self._agents if agent_cls is None or isinstance(agent, agent_cls)]
+        return [agent.addr for agent in agents] if address else agents
+
+    def add_candidate(self, artifact):
+        self._candidates.append(artifact)
+
+    def clear_candidates(self):
+        self._candidates = []
+
+    @property
+    def candidates(self):
+        return self._candidates
+
+    def add_artifact(self, artifact):
+        self.artifacts.append(artifact)
+
+    def act(self):
+        """
+        Have every agent act once, in the order they were created.
+        """
+        self.age += 1
+        for agent in self._agents:
+            run_coroutine(agent.act())
+
+    def step(self):
+        """
+        Run one simulation step: every agent acts, then the environment votes.
+        """
+        self.act()
+        self.vote(self.age)
+
+    def steps(self, n):
+        """
+        Run *n* simulation steps.
+        """
+        for _ in range(n):
+            self.step()
+
+    def close(self):
+        self.vote_executor.close()
+        self.metrics.close()
+        self.memory_profile.close()
+        if self.artifact_sink is not None:
+            self.artifact_sink.close()
+
+
+def build_environment(nouns, embeddings, fillers, metaphor_agents=20, haiku_agents=5, metaphor_winners=5,
+                      lexicon=None, vote_executor=None, shard=None):
+    """
+    Set up a :class:'LocalEnvironment' the way Main does.
+
+    :param nouns (list of :class:'Noun'): the nouns of the MetaphorAgents
+    :param embeddings (:class:'NounEmbeddings'): the noun similarities of the MetaphorAgents
+    :param fillers (list of :class:'Word'): the filler words of the HaikuAgents
+    :param metaphor_agents (int): number of MetaphorAgents
+    :param haiku_agents (int): number of HaikuAgents
+    :param metaphor_winners (int): the number of metaphors accepted every step
+    :param lexicon (:class:'Lexicon'): index over *nouns*, built if not given
+    :param shard (int): the index of the shard the environment runs, see :class:'LocalEnvironment'
+    :return: the environment
+    """
+    env = LocalEnvironment(metaphor_winners, vote_executor, shard)
+    lexicon = lexicon if lexicon is not None else Lexicon(nouns)
+    for i in range(0, metaphor_agents):
+        local_agent(MetaphorAgent, env, nouns, embeddings, lexicon=lexicon)
+    for i in range(0, haiku_agents):
+        local_agent(HaikuAgent, env, fillers)
+    return env
+
+
+# The nouns, embeddings and fillers of a worker process, set once when the worker starts
+_worker_setup = None
+
+
+def _init_worker(nouns, embeddings, fillers, quiet):
+    global _worker_setup
+    _worker_setup = (nouns, embeddings, fillers, Lexicon(nouns))
+    if quiet:
+        logging.getLogger('MetaHaikuEnvironment').setLevel(logging.WARNING)
+
+
+def simulate(seed, steps, **kwargs):
+    """
+    Run one simulation in a worker process started by run_many().
+
+    :param seed (int): seed of the random and numpy.random generators
+    :param steps (int): number of steps
+    :param kwargs: the agent counts, see build_environment()
+    :return: a tuple of the accepted metaphors and the winning haiku, as strings
+    """
+    nouns, embeddings, fillers, lexicon = _worker_setup
+    random.seed(seed)
+    np.random.seed(seed)
+    env = build_environment(nouns, embeddings, fillers, lexicon=lexicon, **kwargs)
+    env.steps(steps)
+    env.close()
+    return [str(artifact.obj) for artifact in env.artifacts], [str(haiku.obj) for haiku in env.haikus]
+
+
+def _simulate(args):
+    seed, steps, kwargs = args
+    return simulate(seed, steps, **kwargs)
+
+
+def run_many(nouns, embeddings, fillers, seeds, steps=500, processes=None, quiet=True, **kwargs):
+    """
+    Run one independent simulation per seed in a pool of worker processes.  The nouns and embeddings are sent to each
+    worker once.
+
+    :param seeds (list of int): the seed of every simulation
+    :param steps (int): number of steps of every simulation
+    :param processes (int): number of worker processes, by default one per core
+    :param quiet (bool): do not log every winner in the workers
+    :param kwargs: the agent counts, see build_environment()
+    :return: list of simulate() results, in the order of *seeds*
+    """
+    from multiprocessing import Pool
+    processes = processes or os.cpu_count() or 1
+    with Pool(processes, initializer=_init_worker, initargs=(nouns, embeddings, fillers, quiet)) as pool:
+        return pool.map(_simulate, [(seed, steps, kwargs) for seed in seeds], chunksize=1)
@@ -1,7 +1,165 @@
 from creamas import CreativeAgent, Artifact
-from Model_Classes import Haiku
+from Model_Classes import Noun, Haiku
 from MetaphorMemory import MetaphorMemory
+import bisect
 import random
+import numpy as np
+
+
+class WordGroup:
+    """
+    A list of words grouped by syllable count, so that a :class:'LineTable' can take them without going through every
+    word.  A :class:'HaikuAgent' groups its fillers once and reuses them in the table of every topic.
+
+    Attributes:
+        buckets    dict of syllable count to the words with that many syllables, in the order of the list
+    """
+    def __init__(self, words, max_length=7):
+        """
+        :param words (list of :class:'Word'): the words
+        :param max_length (int): words with fewer than 1 or more than *max_length* syllables are left out
+        """
+        self._count = len(words)
+        self._max_length = max_length
+        self._weights = dict()
+        self.buckets = dict()
+        for word in words:
+            if 1 <= word.syllables <= max_length:
+                self.buckets.setdefault(word.syllables, []).append(word)
+
+    def __len__(self):
+        """
+        The number of words in the list, including those left out of the buckets.
+        """
+        return self._count
+
+    def weights(self, share):
+        """
+        The weights of the buckets when each word has weight *share*.
+
+        :return: list of the weight per syllable count, from 0 to max_length
+        """
+        if share not in self._weights:
+            weights = [0.0] * (self._max_length + 1)
+            for syllables, bucket in self.buckets.items():
+                weights[syllables] = share * len(bucket)
+            self._weights[share] = weights
+        return self._weights[share]
+
+
+class LineTable:
+    """
+    The words a :class:'HaikuAgent' can write about one topic, grouped by syllable count, for building lines with an
+    exact syllable count in one pass.
+
+    Each word is drawn as in the original rejection loop: first a group (nouns, adjectives or fillers) with the group's
+    weight, then a word of that group uniformly.  The table sums these probabilities per syllable count and counts,
+    for every line length, the weighted number of ways to reach it (a dynamic program over syllable counts).  A line is
+    then built slot by slot: the syllables of the next word are drawn in proportion to their weight times the ways to
+    finish the line, and the word is drawn from the groups' words with that many syllables.  Lines come out with the
+    distribution of the original process, conditioned on landing exactly on the length, instead of being cut and padded
+    with fillers.
+
+    Groups given as a :class:'WordGroup' are used as they are, and tables with the same weights per syllable count share
+    their ways, so building one for a topic costs little more than going through the topic's few words.
+    """
+    def __init__(self, groups, max_length=7, shapes=None):
+        """
+        :param groups: list of (weight, words) tuples, where words is a list of :class:'Word' or a :class:'WordGroup'.
+            Words with fewer than 1 or more than *max_length* syllables are left out
+        :param max_length (int): the longest line which will be asked for
+        :param shapes (dict): if given, the counts of ways of earlier tables by their weights per syllable count, which
+            this table reuses and adds to
+        """
+        total = float(sum(weight for weight, words in groups if len(words) > 0))
+        weights = [0.0] * (max_length + 1)
+        # Per syllable count the words of the lists with the weight of each, and the groups with the weight of their words
+        self._words = dict()
+        self._groups = []
+        for weight, words in groups:
+            if len(words) == 0:
+                continue
+            share = weight / total / len(words)
+            if isinstance(words, WordGroup):
+                self._groups.append((share, words.buckets))
+                group_weights = words.weights(share)
+                for syllables in range(1, min(max_length, len(group_weights) - 1) + 1):
+                    weights[syllables] += group_weights[syllables]
+            else:
+                for word in words:
+                    if 1 <= word.syllables <= max_length:
+                        self._words.setdefault(word.syllables, []).append((share, word))
+                        weights[word.syllables] += share
+        self._weights = weights
+
+        # The ways and steps only depend on the weights, so tables with the same weights can share them
+        key = tuple(weights)
+        steps = shapes.get(key) if shapes is not None else None
+        if steps is None:
+            steps = LineTable._steps(weights, max_length)
+            if shapes is not None:
+                shapes[key] = steps
+        self._line_steps = steps
+
+    @staticmethod
+    def _steps(weights, max_length):
+        """
+        :return: per remaining length, the syllable counts the next word can have and their cumulative weights
+        """
+        sizes = [syllables for syllables in range(1, max_length + 1) if weights[syllables] > 0]
+        ways = [1.0] + [0.0] * max_length
+        steps = [None]
+        for length in range(1, max_length + 1):
+            step_sizes, cumulative = [], []
+            for syllables in sizes:
+                if syllables > length:
+                    break
+                if ways[length - syllables] > 0:
+                    ways[length] += weights[syllables] * ways[length - syllables]
+                    step_sizes.append(syllables)
+                    cumulative.append(ways[length])
+            steps.append((step_sizes, cumulative) if step_sizes else None)
+        return steps
+
+    def line(self, length):
+        """
+        Build a line with exactly *length* syllables.
+
+        :return: list of :class:'Word', or None if no combination of the words has that many syllables
+        """
+        steps, weights, table_words, groups = self._line_steps, self._weights, self._words, self._groups
+        draw, bisect_right = random.random, bisect.bisect
+        line = []
+        while length > 0:
+            step = steps[length]
+            if step is None:
+                return None
+            sizes, cumulative = step
+            syllables = sizes[bisect_right(cumulative, draw() * cumulative[-1])] if len(sizes) > 1 else sizes[0]
+            line.append(self._word(syllables, draw() * weights[syllables], table_words, groups))
+            length -= syllables
+        return line
+
+    @staticmethod
+    def _word(syllables, target, table_words, groups):
+        """
+        The word with *syllables* syllables at weight *target*, going through the words of the lists, then the groups.
+        """
+        word = None
+        for share, word in table_words.get(syllables, ()):
+            if target < share:
+                return word
+            target -= share
+        for share, buckets in groups:
+            bucket = buckets.get(syllables)
+            if bucket:
+                span = share * len(bucket)
+                if target < span:
+                    return bucket[min(int(target / share), len(bucket) - 1)]
+                target -= span
+                word = bucket[-1]
+        # Only reached through rounding, at the very end of the weight
+        return word
 
 
 class HaikuAgent(CreativeAgent):
@@ -12,34 +170,86 @@ class HaikuAgent(CreativeAgent):
         GUESS_SCORE_WEIGHT    The weight given to the guess-ability of a haiku when evaluating that haiku
 
         WORD_VARIETY_WEIGHT   The weight given to the word variety of a haiku when evaluating that haiku
+
+        NOUN_WEIGHT           The weight of picking a noun for the next word of a line
+
+        ADJECTIVE_WEIGHT      The weight of picking an adjective for the next word of a line
+
+        FILLER_WEIGHT         The weight of picking a filler word for the next word of a line
+
+        INVENT_TRIES          The number of haiku to generate about the same topic before submitting the best as a candidate
     """
 
-    def __init__(self, env, fillers, mem_cap=500):
+    def __init__(self, env, fillers, mem_cap=500, eviction='random'):
         """
         :param env (Environment): the creamas environment the agent will operate in
         :param fillers (list of :class:'Word'): a list of filler words which can appear in any haiku
         :param mem_cap (int): the number of metaphors the agent will keep in its memory before it starts forgetting them at random
+        :param eviction (str): which metaphor to forget when the memory is full, see :class:'MetaphorMemory'
         """
         super().__init__(env)
         self.fillers = fillers
-        self.memory = MetaphorMemory(mem_cap)
+        self.memory = MetaphorMemory(mem_cap, eviction, store=getattr(env, 'metaphor_store', None))
+        self._filler_group = WordGroup(fillers)
+        self._line_tables = dict()
+        self._line_shapes = dict()
+        self.invent_tries = 0
 
     GUESS_SCORE_WEIGHT = 1
     WORD_VARIETY_WEIGHT = 1
 
+    NOUN_WEIGHT = 1
+    ADJECTIVE_WEIGHT = 1
+    FILLER_WEIGHT = 1
+
+    INVENT_TRIES = 1
+
     async def act(self):
         """
-        Each simulation round, the HaikuAgent memorizes the metaphor winners from last round, then generates a
+        Each simulation round, the HaikuAgent memorizes the metaphor winners from last round, then invents a
         new :class:'Haiku' and enters it as a candidate.
         """
+        metrics = self.env.metrics
+        start = metrics.clock()
         if len(self.env.artifacts) > 0:
             # memorize the most recent artifact.  Agents will distinguish themselves once they start forgetting
             for winner in self.env.artifacts[(-self.env.num_metaphors_accepted_per_round - 1):-1]:
                 self.memory.memorize(winner.obj)
 
-        haiku = self.generate()
+        invent_start = metrics.clock()
+        haiku = self.invent()
+        metrics.record('haiku_invent', invent_start)
+        metrics.count('haiku_invent_tries', self.invent_tries)
         if haiku is not None:
             self.env.add_candidate(haiku)
+        metrics.record('haiku_act', start)
+
+    def invent(self):
+        """
+        Generates INVENT_TRIES haiku about one topic and returns the one the agent itself rates best with
+        eval_haikus().  Rating does not change the haiku or the memory.  With one try this is just generate().  The
+        number of haiku actually generated is left in invent_tries.
+
+        A batch builds the :class:'LineTable' of the topic once and draws every haiku from it, which pays off from a
+        few tries on.  A single haiku is cheaper to write with write_line().
+
+        :return: an Artifact with the best :class:'Haiku', or None if the memory is empty
+        """
+        if HaikuAgent.INVENT_TRIES <= 1:
+            haiku = self.generate()
+            self.invent_tries = 0 if haiku is None else 1
+            return haiku
+        known_topics = self.memory.nouns()
+        if len(known_topics) == 0:
+            self.invent_tries = 0
+            return None
+        topic = random.choice(known_topics)
+        table, applicable = self.line_table(topic)
+        haikus = [Haiku(topic, self._table_line(table, 5), self._table_line(table, 7), self._table_line(table, 5),
+                        applicable) for _ in range(HaikuAgent.INVENT_TRIES)]
+        self.invent_tries = len(haikus)
+        best = int(np.argmax(self.eval_haikus(haikus)))
+        return Artifact(self, haikus[best], domain=Haiku)
 
     def generate(self):
         """
@@ -51,21 +261,56 @@ class HaikuAgent(CreativeAgent):
 
         :return: a new :class:'Haiku'
         """
-        known_topics = self.memory.metaphor_lookup.keys()
+        known_topics = self.memory.nouns()
         if len(known_topics) == 0:
             return None
-        topic = random.choice(list(known_topics))
+        topic = random.choice(known_topics)
         nouns, adjectives = self.get_applicable(topic)
         line_1 = self.write_line(5, nouns, adjectives)
         line_2 = self.write_line(7, nouns, adjectives)
         line_3 = self.write_line(5, nouns, adjectives)
         return Artifact(self, Haiku(topic, line_1, line_2, line_3, max(len(nouns), len(adjectives))), domain=Haiku)
 
+    def line_table(self, topic):
+        """
+        The :class:'LineTable' of a topic, used by batches of invent().  A table is kept until a metaphor with the topic
+        is memorized or forgotten, see MetaphorMemory.noun_version, and tables share their filler words and counts of
+        ways.
+
+        :param topic: the topic noun
+        :return: a tuple of the table and the number of metaphors used (the longer of the noun and adjective lists)
+        """
+        version = self.memory.noun_version(topic)
+        cached = self._line_tables.get(topic)
+        if cached is not None and cached[2] == version:
+            return cached[0], cached[1]
+
+        if len(self._line_tables) >= 2 * self.memory.capacity + 16:
+            # A memory holds at most two nouns per metaphor, so drop the tables of the topics changed or forgotten since
+            self._line_tables = dict((noun, entry) for noun, entry in self._line_tables.items()
+                                     if entry[2] == self.memory.noun_version(noun))
+        if len(self._line_shapes) >= 4096:
+            self._line_shapes = dict()
+        nouns, adjectives = self.get_applicable(topic)
+        table = LineTable([(HaikuAgent.NOUN_WEIGHT, nouns), (HaikuAgent.ADJECTIVE_WEIGHT, adjectives),
+                           (HaikuAgent.FILLER_WEIGHT, self._filler_group)], shapes=self._line_shapes)
+        applicable = max(len(nouns), len(adjectives))
+        self._line_tables[topic] = (table, applicable, version)
+        return table, applicable
+
+    def _table_line(self, table, length):
+        line = table.line(length)
+        if line is None:
+            # No combination of the words fits, so pad with fillers as write_line() does
+            line = [random.choice(self.fillers) for _ in range(length)]
+        return line
+
     def write_line(self, length, nouns, adjectives):
         """
         Generates a line of text with the desired syllable count using the given nouns and adjectives.  The process is:
 
-        * randomly select whether the next word will be filler (1/5 chance), noun (2/5), or adjective (2/5)
+        * randomly select whether the next word will be a noun, an adjective or a filler word, with the chances given
+          by the class weights
         * randomly select the specific word from the appropriate list and add it to the line.  Update the syllable count.
         * if the syllable count is greater than the desired amount, delete the last word and add filler words until the count is correct
         * else repeat
@@ -78,22 +323,24 @@ class HaikuAgent(CreativeAgent):
         :type adjectives: list of :class:'Word'
         :return: a line of text with the appropriate number of syllables
         """
+        total = float(HaikuAgent.NOUN_WEIGHT + HaikuAgent.ADJECTIVE_WEIGHT + HaikuAgent.FILLER_WEIGHT)
+        noun_limit = HaikuAgent.NOUN_WEIGHT / total
+        adjective_limit = (HaikuAgent.NOUN_WEIGHT + HaikuAgent.ADJECTIVE_WEIGHT) / total
         line = []
         sylla_count = 0
         while sylla_count < length:
-            choice = random.randint(0, 5)
-            if choice <= 1:
-                line += [random.choice(nouns)]
-            elif choice <= 3:
-                line += [random.choice(adjectives)]
+            choice = random.random()
+            if choice < noun_limit:
+                line.append(random.choice(nouns))
+            elif choice < adjective_limit:
+                line.append(random.choice(adjectives))
             else:
-                line += [random.choice(self.fillers)]
+                line.append(random.choice(self.fillers))
             sylla_count += line[-1].syllables
         if sylla_count > length:
-            sylla_count -= line[-1].syllables
-            line = line[:-1]
+            sylla_count -= line.pop().syllables
         while sylla_count < length:
-            line += [random.choice(self.fillers)]
+            line.append(random.choice(self.fillers))
             sylla_count += 1
         return line
 
@@ -106,68 +353,137 @@ class HaikuAgent(CreativeAgent):
         :type topic: :class:'Noun'
         :return: a tuple containing the lists of applicable nouns and adjectives
         """
-        if len(self.memory.metaphor_lookup) == 0:
-            return [], []
-        applicable_nouns = list(self.memory.metaphor_lookup[topic].keys())
-        applicable_adjectives = []
-        for noun in applicable_nouns:
-            applicable_adjectives += [meta.adjective for meta in self.memory.metaphor_lookup[topic][noun]]
+        metaphors = self.memory.metaphors_with(topic)
+        applicable_nouns = list(dict.fromkeys([meta.noun_2 if meta.noun_1 == topic else meta.noun_1 for meta in metaphors]))
+        applicable_adjectives = [meta.adjective for meta in metaphors]
         return applicable_nouns, applicable_adjectives
 
     def evaluate(self, artifact):
         """
-        Evaluate a :class:'Haiku' by computing guess and word variety scores and returning their weighted sum.
+        Evaluate a :class:'Haiku' with eval_haiku().  If the topic is the agent's first guess, the haiku's *guessed_by*
+        count is increased.
+
+        :param artifact: the artifact to be evaluated.  The domain should be :class:'Haiku'.
+        :return: A tuple containing the score for the artifact and a boolean indicating whether the first guess was correct for framing.
+        """
+        score, guessed = self.eval_haiku(artifact.obj)
+        if guessed:
+            artifact.obj.guessed_by += 1
+        return score, guessed
+
+    def eval_haiku(self, haiku):
+        """
+        Evaluate a :class:'Haiku' by computing guess and word variety scores and returning their weighted sum.  This
+        only reads the agent's memory and does not change the haiku.
 
         Word variety is calculated as (unique words / total words)
 
         Guesses are created by searching the metaphor memory for nouns which share a metaphor with nouns in the :class:'Haiku' and making a list.
         For adjectives, all nouns for which there is a metaphor in memory using that adjective are added to the list.  If a noun is added
         multiple times during the noun and adjective search, it gets a higher score.  The top 3 scores are the guesses.
+        Candidates are found through the memory's noun index, and their adjectives are looked up in the counts of the
+        haiku's words, so the cost depends on the number of candidates rather than on the memory size.
 
         Guess score is 1.0 for a first guess,  0.4 for a second guess, and 0.1 for a third guess.
 
         Weights for the guess score and word variety score are class attributes of HaikuAgent.
 
-        :param artifact: the artifact to be evaluated.  The domain should be :class:'Haiku'.
-        :return: A tuple containing the score for the artifact and a boolean indicating whether the first guess was correct for framing.
+        :param haiku: the haiku to be evaluated
+        :type haiku: :class:'Haiku'
+        :return: A tuple containing the score for the haiku and a boolean indicating whether the first guess was correct.
         """
-        haiku = artifact.obj
         haiku_content = haiku.line_1 + haiku.line_2 + haiku.line_3
 
         word_variety_score = len(set(haiku_content)) / float(len(haiku_content))
+        guess_score = self._guess_score(haiku_content, haiku.topic, self.memory.metaphors_with)
 
-        candidate_metaphors = []
-        for word in haiku_content:
-            if word in self.memory.metaphor_lookup.keys():
-                for other_noun in self.memory.metaphor_lookup[word]:
-                    for metaphor in self.memory.metaphor_lookup[word][other_noun]:
-                        candidate_metaphors += [metaphor]
+        return guess_score * HaikuAgent.GUESS_SCORE_WEIGHT + word_variety_score * HaikuAgent.WORD_VARIETY_WEIGHT, guess_score > 0.6
 
-        candidate_scores = dict([(candidate, 1) for candidate in candidate_metaphors])
+    @staticmethod
+    def _guess_score(haiku_content, topic, metaphors_with):
+        # Count the nouns and the other words of the haiku
+        noun_counts = dict()
+        word_counts = dict()
         for word in haiku_content:
-            for metaphor in candidate_metaphors:
-                if word == metaphor.adjective:
-                    candidate_scores[metaphor] += 1
+            counts = noun_counts if isinstance(word, Noun) else word_counts
+            counts[word] = counts.get(word, 0) + 1
+
+        # Every metaphor with a noun of the haiku is a candidate, once for each time its nouns appear.  Each candidate
+        # adds 1 to the score of its noun_2, and 1 more for each of its occurrences times each time its adjective
+        # appears in the haiku
+        occurrences = dict()
+        for noun, count in noun_counts.items():
+            for metaphor in metaphors_with(noun):
+                occurrences[metaphor] = occurrences.get(metaphor, 0) + count
 
         topic_scores = dict()
-        for cand in candidate_scores.keys():
-            if cand.noun_2 not in topic_scores.keys():
-                topic_scores[cand.noun_2] = 0
-            topic_scores[cand.noun_2] += candidate_scores[cand]
+        for metaphor, count in occurrences.items():
+            topic_scores[metaphor.noun_2] = (topic_scores.get(metaphor.noun_2, 0) + 1
+                                             + count * word_counts.get(metaphor.adjective, 0))
 
         if len(topic_scores) == 0:
-            guess_score = 0
-        else:
-            guesses = sorted(topic_scores, key=topic_scores.get, reverse=True)[0:3]
-            if haiku.topic == guesses[0]:
-                guess_score = 10
-                artifact.obj.guessed_by += 1
-            elif len(guesses) > 1 and haiku.topic == guesses[1]:
-                guess_score = 4
-            elif len(guesses) > 2 and haiku.topic == guesses[2]:
-                guess_score = 1
-            else:
-                guess_score = 0
-        guess_score /= 10
+            return 0.0
+        guesses = sorted(topic_scores, key=topic_scores.get, reverse=True)[0:3]
+        if topic == guesses[0]:
+            return 1.0
+        elif len(guesses) > 1 and topic == guesses[1]:
+            return 0.4
+        elif len(guesses) > 2 and topic == guesses[2]:
+            return 0.1
+        return 0.0
+
+    def eval_haikus(self, haikus):
+        """
+        Evaluate many haiku as eval_haiku() does, in one pass.  Word variety is computed over arrays of word codes for
+        all haiku at once, and the metaphors of each noun are only looked up once for the whole batch.
+
+        :param haikus: the haiku to be evaluated
+        :type haikus: list of :class:'Haiku'
+        :return: float array with the score of each haiku
+        """
+        contents = [haiku.line_1 + haiku.line_2 + haiku.line_3 for haiku in haikus]
+        lengths = np.array([len(content) for content in contents])
+        # A noun equals any noun with the same word, other words also need the same syllable count
+        codes = np.array([(word.id << 6) | (32 if isinstance(word, Noun) else word.syllables & 31)
+                          for content in contents for word in content], dtype=np.int64)
+        rows = np.repeat(np.arange(len(haikus)), lengths)
+        distinct = np.unique(np.stack([rows, codes]), axis=1)
+        word_variety = np.bincount(distinct[0], minlength=len(haikus)) / lengths
+
+        lookups = dict()
 
-        return guess_score * HaikuAgent.GUESS_SCORE_WEIGHT + word_variety_score * HaikuAgent.WORD_VARIETY_WEIGHT, guess_score > 0.6
\ No newline at end of file
+        def metaphors_with(noun):
+            if noun not in lookups:
+                lookups[noun] = self.memory.metaphors_with(noun)
+            return lookups[noun]
+
+        guess = np.array([self._guess_score(content, haiku.topic, metaphors_with)
+                          for content, haiku in zip(contents, haikus)])
+        return guess * HaikuAgent.GUESS_SCORE_WEIGHT + word_variety * HaikuAgent.WORD_VARIETY_WEIGHT
+
+    def score_batch(self, artifacts):
+        """
+        Evaluate many artifacts with eval_haiku(), without counting the guesses on the haiku.  Use this to evaluate
+        outside the environment's thread, then add the guesses up in one place.
+
+        :param artifacts: the artifacts to be evaluated
+        :return: a tuple of a float array with the score of each artifact and a bool array telling which topics were guessed
+        """
+        scores = np.zeros(len(artifacts))
+        guessed = np.zeros(len(artifacts), dtype=bool)
+        for i, artifact in enumerate(artifacts):
+            scores[i], guessed[i] = self.eval_haiku(artifact.obj)
+        return scores, guessed
+
+    def evaluate_batch(self, artifacts):
+        """
+        Evaluate many artifacts at once.  The scores and guess counts are the same as evaluate() gives.
+
+        :param artifacts: the artifacts to be evaluated
+        :return: float array with the evaluation score of each artifact
+        """
+        scores, guessed = self.score_batch(artifacts)
+        for artifact, hit in zip(artifacts, guessed):
+            if hit:
+                artifact.obj.guessed_by += 1
+        return scores
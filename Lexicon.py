@@ -0,0 +1,257 @@
+import random
+import numpy as np
+from scipy import sparse
+
+
+class AliasTable:
+    """
+    Walker's alias method for drawing from a fixed discrete distribution in constant time.  Building the table is linear
+    in the number of outcomes, after which every draw costs one random index and one random float.
+    """
+    def __init__(self, weights):
+        """
+        :param weights: non-negative weights of the outcomes.  At least one weight must be positive.
+        :type weights: list of float
+        """
+        n = len(weights)
+        total = float(sum(weights))
+        assert n > 0 and total > 0, "weights must contain a positive value"
+
+        self._prob = [0.0] * n
+        self._alias = list(range(n))
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Whatever is left over is only off from 1 by rounding error
+        for i in small + large:
+            self._prob[i] = 1.0
+
+    def __len__(self):
+        return len(self._prob)
+
+    def sample(self):
+        """
+        Draw one outcome.
+
+        :return: the index of the drawn outcome
+        """
+        i = random.randrange(len(self._prob))
+        return i if random.random() < self._prob[i] else self._alias[i]
+
+
+_LEGENDRE_NODES, _LEGENDRE_WEIGHTS = np.polynomial.legendre.leggauss(12)
+
+
+def _quadrature(scale):
+    # Gauss-Legendre rule on [0, 1], on intervals which halve in width towards 0 down to a fraction of 1 / *scale*.
+    # The integrand of first_acceptance_weights() decays like exp(-scale * t), so that is where its mass is
+    smallest = 1e-3 / max(scale, 1.0)
+    edges = np.concatenate([[0.0], np.geomspace(smallest, 1.0, int(np.ceil(np.log2(1 / smallest))) + 1)])
+    half_widths = np.diff(edges)[:, None] / 2
+    nodes = ((edges[:-1, None] + edges[1:, None]) / 2 + half_widths * _LEGENDRE_NODES).ravel()
+    return nodes, (half_widths * _LEGENDRE_WEIGHTS).ravel()
+
+
+def first_acceptance_weights(probabilities, chunk=1024):
+    """
+    The distribution of the first accepted item, when the items are visited in a uniformly random order and each is
+    accepted on its own with its probability.  Giving every item a uniform arrival time t, item i comes first if it is
+    accepted and every item arriving before it is not:
+
+        w_i = p_i * integral from 0 to 1 of prod over j != i of (1 - p_j t) dt
+
+    The integral is computed with a Gauss-Legendre rule.  The weights are conditional on some item being accepted,
+    so they are only defined up to a factor.
+
+    :param probabilities: the acceptance probability of each item, at most 1
+    :param chunk (int): items handled at once, which bounds the memory used to *chunk* times the quadrature nodes
+    :return: float array of weights
+    """
+    p = np.asarray(probabilities, dtype=np.float64)
+    if len(p) == 1:
+        return p.copy()
+    t, quadrature_weights = _quadrature(p.sum())
+    log_all = np.zeros(len(t))
+    for start in range(0, len(p), chunk):
+        log_all += np.log1p(-np.outer(p[start:start + chunk], t)).sum(axis=0)
+    weights = np.empty(len(p))
+    for start in range(0, len(p), chunk):
+        log_others = log_all - np.log1p(-np.outer(p[start:start + chunk], t))
+        weights[start:start + chunk] = p[start:start + chunk] * np.exp(log_others).dot(quadrature_weights)
+    return weights
+
+
+class Lexicon:
+    """
+    An index over a list of nouns which is built once and shared by all agents using that list.  It maps every adjective
+    to the nouns it describes, which is enough to find all metaphors (pairs of nouns with a shared adjective) without
+    searching the noun list.
+
+    Metaphors are drawn following the original search in MetaphorAgent.generate, which walked the nouns in random
+    order, and for each noun walked all nouns in the same order, accepting each shared adjective with probability 0.5.
+    A noun with *k* shared adjectives in total finds a metaphor on its turn with probability p = 1 - 0.5^k, so the first
+    noun is the first one in a random order whose turn succeeds.  See first_acceptance_weights().
+
+    * the first noun is drawn with the first-acceptance weights of the probabilities 1 - 0.5^k, where k counts its
+      shared adjectives over all partners.  This is the distribution of the search, given that it finds a metaphor
+    * the second noun is drawn from the partners of the first with the first-acceptance weights of the probabilities
+      1 - 0.5^s, where s is the number of adjectives the pair shares.  This treats the partners as if they were in a
+      uniformly random order.  In the search they are not quite: the nouns placed before the first noun all failed
+      their turns, so partners which often fail tend to come earlier.  The difference is small, and Benchmarks.bench_generate()
+      measures it
+    * the adjective is drawn uniformly from the adjectives the pair shares, which is exact
+
+    Each step uses an :class:'AliasTable', so a draw takes constant time.  The partner table of a noun is only built
+    the first time that noun is drawn.
+    """
+    def __init__(self, nouns):
+        """
+        :param nouns: the nouns (describing adjectives included) to index
+        :type nouns: list of :class:'Noun'
+        """
+        self.nouns = list(nouns)
+        self._noun_ids = dict((noun.word, i) for i, noun in enumerate(self.nouns))
+
+        # adjective word -> ids of the nouns it describes, and per noun the adjective objects keyed by word
+        self._adjective_nouns = dict()
+        self._noun_adjectives = []
+        for i, noun in enumerate(self.nouns):
+            adjectives = dict()
+            for adj in noun.adjectives:
+                if adj.word not in adjectives:
+                    adjectives[adj.word] = adj
+                    self._adjective_nouns.setdefault(adj.word, []).append(i)
+            self._noun_adjectives.append(adjectives)
+
+        # The number of (partner, adjective) combinations of a noun is the sum of the other nouns each adjective describes
+        weights = []
+        self._sources = []
+        for i, adjectives in enumerate(self._noun_adjectives):
+            shared = sum(len(self._adjective_nouns[word]) - 1 for word in adjectives)
+            if shared > 0:
+                self._sources.append(i)
+                weights.append(1 - 0.5 ** shared)
+        self._source_table = AliasTable(first_acceptance_weights(weights)) if weights else None
+        self._partner_tables = dict()
+
+    def __len__(self):
+        return len(self.nouns)
+
+    def noun_id(self, noun):
+        """
+        Returns the position of a noun in *self.nouns*, or None if the lexicon does not contain it.
+
+        :param noun: the noun (or its word) to look up
+        """
+        return self._noun_ids.get(getattr(noun, 'word', noun))
+
+    def adjective_nouns(self, adjective):
+        """
+        Returns the ids of the nouns described by the given adjective.
+
+        :param adjective: the adjective (or its word) to look up
+        :return: list of noun ids, empty if the adjective is unknown
+        """
+        return self._adjective_nouns.get(getattr(adjective, 'word', adjective), [])
+
+    def partners(self, noun_id):
+        """
+        Returns the nouns sharing at least one adjective with the given noun, along with the shared adjective words.
+
+        :param noun_id: the id of the noun
+        :type noun_id: int
+        :return: a tuple of the partner ids, the list of shared adjective words for each partner and an
+         :class:'AliasTable' over the partners (None if the noun has no partners)
+        """
+        if noun_id not in self._partner_tables:
+            shared = dict()
+            for word in self._noun_adjectives[noun_id]:
+                for other in self._adjective_nouns[word]:
+                    if other != noun_id:
+                        shared.setdefault(other, []).append(word)
+            partner_ids = list(shared.keys())
+            shared_words = list(shared.values())
+            table = (AliasTable(first_acceptance_weights([1 - 0.5 ** len(words) for words in shared_words]))
+                     if partner_ids else None)
+            self._partner_tables[noun_id] = (partner_ids, shared_words, table)
+        return self._partner_tables[noun_id]
+
+    def sample(self):
+        """
+        Draw a random (noun_1, noun_2, adjective) triple where both nouns are described by the adjective.
+
+        :return: the triple, or None if no two nouns in the lexicon share an adjective
+        """
+        if self._source_table is None:
+            return None
+        noun_1 = self._sources[self._source_table.sample()]
+        partner_ids, shared_words, table = self.partners(noun_1)
+        j = table.sample()
+        word = random.choice(shared_words[j])
+        return self.nouns[noun_1], self.nouns[partner_ids[j]], self._noun_adjectives[noun_1][word]
+
+
+def incidence_matrix(nouns):
+    """
+    Build the noun x adjective incidence matrix of a noun list.  Entry (i, j) is 1 if adjective j describes noun i.
+    Adjectives are identified by their word.
+
+    :param nouns: the nouns (describing adjectives included)
+    :type nouns: list of :class:'Noun'
+    :return: a tuple of the matrix (scipy.sparse CSR, int32) and the list of adjective words labelling its columns
+    """
+    adjective_ids = dict()
+    indptr = [0]
+    indices = []
+    for noun in nouns:
+        for adj in noun.adjectives:
+            indices.append(adjective_ids.setdefault(adj.word, len(adjective_ids)))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                               shape=(len(nouns), len(adjective_ids)))
+    # A noun may list the same adjective twice
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, list(adjective_ids.keys())
+
+
+def shared_adjective_counts(nouns, incidence=None):
+    """
+    Count the adjectives shared by every pair of nouns with a sparse matrix product.  The diagonal holds the number of
+    distinct adjectives of each noun.
+
+    :param nouns: the nouns (describing adjectives included)
+    :param incidence: the incidence matrix of *nouns*, if it has already been built
+    :return: noun x noun scipy.sparse CSR matrix of shared adjective counts
+    """
+    if incidence is None:
+        incidence, _ = incidence_matrix(nouns)
+    return incidence.dot(incidence.T).tocsr()
+
+
+def filter_nouns(nouns, incidence=None):
+    """
+    Filter out nouns which has no other noun with a common adjective.  A noun has a partner exactly when one of its
+    adjectives describes at least two nouns, so this takes one pass over the incidence matrix instead of comparing
+    every pair of nouns.
+
+    :param nouns: the list of nouns, or a :class:'CompiledLexicon', of which only the kept nouns are built
+    :param incidence: the incidence matrix of *nouns*, if it has already been built
+    :return: the filtered list of nouns, in their original order
+    """
+    if incidence is None:
+        incidence, _ = incidence_matrix(nouns)
+    shared = (np.asarray(incidence.sum(axis=0)).ravel() >= 2).astype(np.int32)
+    has_partner = incidence.dot(shared) > 0
+    return [nouns[int(i)] for i in np.flatnonzero(has_partner)]
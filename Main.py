@@ -1,9 +1,20 @@
 from creamas import Simulation
-from Model_Classes import Word, Noun
+from Model_Classes import Word
 from MetaphorAgent import MetaphorAgent
 from HaikuAgent import HaikuAgent
 from gensim.models import word2vec
 from MetaHaikuEnvironment import MetaHaikuEnvironment
+from Lexicon import Lexicon
+from Embeddings import NounEmbeddings
+from CompiledLexicon import load_nouns
+from FastSimulation import build_environment, run_many
+from ShardedSimulation import ShardedSimulation
+from Metrics import Metrics, METRICS_FILE
+from MemoryProfile import MemoryProfiler, PROFILE_FILE
+from ArtifactSink import ArtifactSink, ARTIFACTS_FILE
+from Checkpoint import Checkpointer, load_checkpoint, CHECKPOINT_FILE
+from VoteExecutor import EXECUTORS
+import argparse
 import os
 
 NUMBER_METAPHOR_AGENTS = 20
@@ -11,28 +22,63 @@ NUMBER_HAIKU_AGENTS = 5
 FILE_NAME = '/nouns_brown.txt'
 
 
-def filter_nouns(nouns):
+def _configure(env, args):
     """
-    Filter out nouns which has no other noun with a common adjective
+    Set up the vote executor, metrics, memory profiler, artifact sink and checkpointer of an environment or a
+    :class:'ShardedSimulation' as asked on the command line.  The options a run does not support are rejected when the
+    arguments are parsed.
 
-    :param nouns: the list of nouns
-    :return: the filtered list of nouns
+    :param env: the environment
+    :param args: the parsed command line
     """
+    if args.executor != 'serial':
+        env.vote_executor = EXECUTORS[args.executor]()
+    if args.metrics:
+        env.metrics = Metrics(args.metrics)
+    if args.memory_profile > 0:
+        env.memory_profile = MemoryProfiler(args.memory_profile)
+    if args.artifacts:
+        env.artifact_sink = ArtifactSink(args.artifacts)
+    if args.checkpoint > 0:
+        env.checkpointer = Checkpointer(args.checkpoint, args.checkpoint_file)
 
-    matched = []
-    for noun in nouns:
-        matched_this = False
-        for other_noun in nouns:
-            if matched_this:
-                break
-            for adj in other_noun.adjectives:
-                if adj in noun.adjectives:
-                    matched += [noun]
-                    matched_this = True
-                    break
-    return matched
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the metaphor and haiku agents.")
+    parser.add_argument('--steps', type=int, default=500, help="number of simulation steps")
+    parser.add_argument('--local', action='store_true',
+                        help="run in-process with FastSimulation instead of the creamas environment")
+    parser.add_argument('--runs', type=int, default=1,
+                        help="number of independent in-process simulations, run in parallel (implies --local)")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="spread the agents of one simulation over this many worker processes")
+    parser.add_argument('--metrics', nargs='?', const=METRICS_FILE, default=None,
+                        help="write per-round timings and counters to this file, {} by default".format(METRICS_FILE))
+    parser.add_argument('--memory-profile', type=int, default=0, metavar='ROUNDS',
+                        help="report the memory used every this many rounds to {}".format(PROFILE_FILE))
+    parser.add_argument('--artifacts', nargs='?', const=ARTIFACTS_FILE, default=None,
+                        help="record the winners to this file instead of the log, {} by default".format(ARTIFACTS_FILE))
+    parser.add_argument('--checkpoint', type=int, default=0, metavar='ROUNDS',
+                        help="save the simulation every this many rounds to --checkpoint-file")
+    parser.add_argument('--checkpoint-file', default=CHECKPOINT_FILE,
+                        help="the checkpoint file, {} by default".format(CHECKPOINT_FILE))
+    parser.add_argument('--resume', metavar='FILE', default=None,
+                        help="continue a checkpoint in-process until --steps rounds are done")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes for --runs, one per core by default")
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), default='serial',
+                        help="how the votes evaluate the agents, see VoteExecutor.  With hundreds of agents, 'process' "
+                             "evaluates them in worker processes")
+    args = parser.parse_args()
+    # Only a single in-process run can be resumed from its checkpoints, see Checkpoint.restore()
+    single_local = args.resume is not None or (args.runs <= 1 and args.shards == 0 and args.local)
+    if args.checkpoint > 0 and not single_local:
+        parser.error("--checkpoint needs a single in-process run, --local or --resume")
+    # The shards run in their own processes, which do not profile their memory and evaluate their own agents
+    if args.shards > 0 and args.resume is None and args.runs <= 1 and args.memory_profile > 0:
+        parser.error("--memory-profile cannot be used with --shards")
+    if args.executor != 'serial' and args.resume is None and (args.runs > 1 or args.shards > 0):
+        parser.error("--executor cannot be used with --runs or --shards")
+
     fillers = [
         Word('is', 1),
         Word('and', 1),
@@ -51,26 +97,60 @@ if __name__ == "__main__":
         Word('like', 1),
     ]
 
-    with open(os.getcwd() + FILE_NAME, 'r') as f:
-        lines = f.readlines()
-    nouns = [Noun.parse(line) for line in lines]
-
-    word2vec_model = word2vec.Word2Vec.load(os.getcwd() + FILE_NAME + ".word2vec")
+    # A checkpoint holds the nouns, embeddings and fillers, so a resumed run loads nothing else
+    if args.resume is None:
+        # Uses the compiled lexicon written by NounListGenerator if there is one, otherwise parses the text file
+        # Only the nouns which share an adjective with another noun are kept (and, from a compiled file, built)
+        nouns = load_nouns(os.getcwd() + FILE_NAME, filtered=True)
 
-    nouns = filter_nouns(nouns)
-    for noun in nouns[0:200]:
-        print(noun.full_string())
+        word2vec_model = word2vec.Word2Vec.load(os.getcwd() + FILE_NAME + ".word2vec")
 
-    env = MetaHaikuEnvironment.create(('localhost', 5555))
-    env.num_metaphors_accepted_per_round = 5
+        for noun in nouns[0:200]:
+            print(noun.full_string())
 
-    for i in range(0, 20):
-        MetaphorAgent(env, nouns, word2vec_model)
-    for i in range(0, 5):
-        HaikuAgent(env, fillers)
+        # The agents only need the vectors of the nouns, so the full model does not have to stay loaded
+        embeddings = NounEmbeddings.from_word2vec(word2vec_model, [noun.word for noun in nouns])
+        del word2vec_model
 
-    sim = Simulation(env, log_folder='logs', callback=env.vote)
-    sim.async_steps(500)
-    sim.end()
+    if args.resume is not None:
+        env = load_checkpoint(args.resume)
+        _configure(env, args)
+        env.steps(max(args.steps - env.age, 0))
+        env.close()
+    elif args.runs > 1:
+        results = run_many(nouns, embeddings, fillers, range(args.runs), args.steps, args.processes,
+                           metaphor_agents=NUMBER_METAPHOR_AGENTS, haiku_agents=NUMBER_HAIKU_AGENTS, metaphor_winners=5)
+        for seed, (metaphors, haikus) in enumerate(results):
+            print("Run {}: {} metaphors, {} haiku".format(seed, len(metaphors), len(haikus)))
+            if len(haikus) > 0:
+                print(haikus[-1])
+    elif args.shards > 0:
+        sim = ShardedSimulation(nouns, embeddings, fillers, args.shards, NUMBER_METAPHOR_AGENTS, NUMBER_HAIKU_AGENTS,
+                                metaphor_winners=5)
+        _configure(sim, args)
+        sim.steps(args.steps)
+        sim.close()
+    elif args.local:
+        env = build_environment(nouns, embeddings, fillers, NUMBER_METAPHOR_AGENTS, NUMBER_HAIKU_AGENTS, metaphor_winners=5)
+        _configure(env, args)
+        env.steps(args.steps)
+        env.close()
+    else:
+        env = MetaHaikuEnvironment.create(('localhost', 5555))
+        env.num_metaphors_accepted_per_round = 5
+        _configure(env, args)
 
+        lexicon = Lexicon(nouns)
+        for i in range(0, NUMBER_METAPHOR_AGENTS):
+            MetaphorAgent(env, nouns, embeddings, lexicon=lexicon)
+        for i in range(0, NUMBER_HAIKU_AGENTS):
+            HaikuAgent(env, fillers)
 
+        sim = Simulation(env, log_folder='logs', callback=env.vote)
+        sim.async_steps(args.steps)
+        sim.end()
+        env.vote_executor.close()
+        env.metrics.close()
+        env.memory_profile.close()
+        if env.artifact_sink is not None:
+            env.artifact_sink.close()
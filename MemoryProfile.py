@@ -0,0 +1,298 @@
+"""
+Opt-in accounting of the memory used by a simulation.
+
+Every *every* rounds, a :class:'MemoryProfiler' measures the state of the environment and its agents and appends one
+JSON line to its file:
+
+* the deep size of each agent type: bytes per agent, bytes of its :class:'MetaphorMemory' and bytes per memory entry
+* the shared :class:'MetaphorStore', *env.artifacts* and *env.haikus*, in bytes and bytes per item
+* the shared noun list and the other state the agents share, counted once
+* the memory traced by tracemalloc, and the source lines which allocated the most since the last report
+
+Sizes are estimated with deep_size(), which follows containers and object attributes.  Objects the agents share (the
+nouns, the lexicon, the embeddings, the store) are measured once and left out of the per-agent sizes, so the
+per-agent numbers are what each additional agent costs.
+
+Values which grew in each of the last *window* reports are listed under *growing* and logged as a warning.  Agent
+memories stop growing at their capacity, so the usual suspects are the artifacts and haiku lists, which keep every
+winner.  estimate_bytes() projects a report to other agent counts and run lengths.
+
+The profiler is used like :mod:'Metrics'::
+
+    env.memory_profile = MemoryProfiler(every=50)
+"""
+
+import json
+import logging
+import os
+import sys
+import tracemalloc
+from array import array
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The default report file, next to the creamas logs
+PROFILE_FILE = os.path.join('logs', 'memory.jsonl')
+
+_ATOMIC = (str, bytes, int, float, complex, bool, type(None))
+_SKIPPED = ('module', 'function', 'builtin_function_or_method', 'method', 'method-wrapper', 'wrapper_descriptor')
+
+
+def deep_size(obj, exclude=frozenset(), seen=None):
+    """
+    Estimate the bytes used by an object and everything it refers to through containers, attributes and slots.
+    Classes, functions and modules are not counted.
+
+    :param obj: the object
+    :param exclude: ids of objects referred to by *obj* which are not counted or followed
+    :param seen (set): ids of objects already counted, which is updated.  Sharing it between calls counts every
+     object once
+    :return: the size in bytes
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        key = id(item)
+        if key in seen or key in exclude and item is not obj:
+            continue
+        seen.add(key)
+        if isinstance(item, type) or type(item).__name__ in _SKIPPED:
+            continue
+        size += sys.getsizeof(item)
+        if isinstance(item, _ATOMIC) or isinstance(item, array):
+            continue
+        if isinstance(item, np.ndarray):
+            if item.base is not None:
+                stack.append(item.base)
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        if hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+        for cls in type(item).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if slot.startswith('__') and not slot.endswith('__'):
+                    slot = '_{}{}'.format(cls.__name__.lstrip('_'), slot)
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return size
+
+
+def shared_state(env, agents):
+    """
+    The objects which are not owned by one agent: the environment, its store, and the agent attributes which refer to
+    the same object in more than one agent (the nouns, lexicon, embeddings, fillers, container...).
+
+    :return: list of (name, object) pairs, each object listed once
+    """
+    shared = [('env', env)]
+    store = getattr(env, 'metaphor_store', None)
+    if store is not None:
+        shared.append(('store', store))
+    owners = dict()
+    for agent in agents:
+        for name, value in vars(agent).items():
+            if not isinstance(value, _ATOMIC):
+                owners.setdefault(id(value), (name, value, set()))[2].add(id(agent))
+    listed = set(id(value) for _, value in shared)
+    for name, value, owned_by in owners.values():
+        if len(owned_by) > 1 and id(value) not in listed:
+            shared.append((name.lstrip('_'), value))
+            listed.add(id(value))
+    return shared
+
+
+def estimate_bytes(report, agents, rounds):
+    """
+    Project a report to a simulation of another size: the shared state and the store, plus the agents, plus the
+    artifacts and haiku accepted over *rounds* rounds.  The agents are assumed to be as full as in the report, and the
+    store as large.
+
+    :param report (dict): a report written by :class:'MemoryProfiler'
+    :param agents (dict): number of agents for each agent type name in the report, e.g. {'MetaphorAgent': 1000}
+    :param rounds (int): the number of rounds
+    :return: the estimate in bytes
+    """
+    total = report['shared']['bytes'] + report.get('store', dict()).get('bytes', 0)
+    for name, count in agents.items():
+        total += count * report['agents'][name]['bytes_per_agent']
+    for key in ('artifacts', 'haikus'):
+        items_per_round = report[key]['count'] / float(max(report['round'], 1))
+        total += rounds * items_per_round * report[key]['bytes_per_item']
+    return int(total)
+
+
+class MemoryProfiler:
+    """
+    Writes a memory report every *every* rounds, see the module documentation.  Starts tracemalloc if it is not
+    tracing yet, which slows the simulation down several times while the profiler is open.  The shared state is
+    measured in the first report, which takes a few seconds with the Brown lexicon while tracing.
+
+    Attributes:
+        enabled     False for DISABLED
+    """
+    enabled = True
+
+    def __init__(self, every=50, file_name=PROFILE_FILE, window=3, top=5, trace=True):
+        """
+        :param every (int): rounds between reports
+        :param file_name (str): the JSON lines file to append the reports to.  Its folder is created if needed
+        :param window (int): a value is reported as growing if it grew in this many reports in a row
+        :param top (int): number of source lines listed from the tracemalloc snapshot
+        :param trace (bool): start tracemalloc.  Without it, only the deep sizes are reported, which is much faster
+        """
+        self.every = every
+        self.file_name = file_name
+        self.window = window
+        self.top = top
+        # The last *window* reports
+        self.reports = []
+        self._started_tracing = trace and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._lines = dict()
+        self._static = None
+        self._file = None
+
+    def end_round(self, env, round_number):
+        """
+        Write a report if *round_number* is a multiple of *every*.
+
+        :param env: the environment
+        :param round_number (int): the round
+        """
+        if round_number % self.every == 0:
+            self.report(env, round_number)
+
+    def report(self, env, round_number):
+        """
+        Measure the environment and its agents and write a report.
+
+        :return: the report, a dict
+        """
+        get_agents = getattr(env, 'get_agents', None)
+        agents = get_agents(address=False) if get_agents is not None else []
+        shared = shared_state(env, agents)
+        exclude = set(id(agent) for agent in agents)
+        exclude.update(id(value) for _, value in shared)
+
+        report = {'round': round_number, 'agents': dict()}
+        if tracemalloc.is_tracing():
+            # Only the size per source line is kept between reports, comparing whole snapshots takes much longer
+            current, peak = tracemalloc.get_traced_memory()
+            lines = dict((str(stat.traceback[0]), stat.size)
+                         for stat in tracemalloc.take_snapshot().statistics('lineno'))
+            growth = sorted(((size - self._lines.get(line, 0), line) for line, size in lines.items()), reverse=True)
+            report['traced'] = {
+                'current': current,
+                'peak': peak,
+                'top': [{'line': line, 'bytes': lines[line], 'growth': diff} for diff, line in growth[:self.top]],
+            }
+            self._lines = lines
+
+        # The nouns, lexicon and embeddings do not change during a run, so they are only measured once.  Everything
+        # reachable from them is left out of the other sizes
+        static = [(name, value) for name, value in shared if name not in ('env', 'store')]
+        key = tuple(id(value) for _, value in static)
+        if self._static is None or self._static[0] != key:
+            seen = set()
+            self._static = (key, dict((name, deep_size(value, exclude, seen)) for name, value in static), seen)
+        _, shared_sizes, static_seen = self._static
+        exclude.update(static_seen)
+        report['shared'] = {'bytes': sum(shared_sizes.values()), 'parts': dict(shared_sizes)}
+
+        store = getattr(env, 'metaphor_store', None)
+        if store is not None:
+            store_seen = set()
+            size = deep_size(store, exclude, store_seen)
+            exclude.update(store_seen)
+            report['store'] = {'count': len(store), 'bytes': size, 'bytes_per_item': size / float(max(len(store), 1))}
+
+        by_type = dict()
+        for agent in agents:
+            by_type.setdefault(type(agent).__name__, []).append(agent)
+        for name, members in by_type.items():
+            total = sum(deep_size(agent, exclude) for agent in members)
+            memories = [agent.memory for agent in members if hasattr(agent, 'memory')]
+            memory_bytes = sum(deep_size(memory, exclude) for memory in memories)
+            entries = sum(memory.count for memory in memories)
+            report['agents'][name] = {
+                'count': len(members),
+                'bytes_per_agent': total / float(len(members)),
+                'memory_bytes_per_agent': memory_bytes / float(len(members)),
+                'bytes_per_entry': memory_bytes / float(entries) if entries else 0.0,
+            }
+
+        for key in ('artifacts', 'haikus'):
+            items = getattr(env, key, [])
+            size = deep_size(items, exclude)
+            report[key] = {'count': len(items), 'bytes': size, 'bytes_per_item': size / float(max(len(items), 1))}
+
+        report['growing'] = self._growing(report)
+        for key in report['growing']:
+            logger.warning("Memory of %s grew in each of the last %d reports", key, self.window)
+        self.reports = self.reports[-self.window:] + [report]
+        self._write(report)
+        return report
+
+    @staticmethod
+    def _tracked(report):
+        values = {'shared': report['shared']['bytes']}
+        for name, sizes in report['agents'].items():
+            values['agents.' + name] = sizes['bytes_per_agent']
+        for key in ('store', 'artifacts', 'haikus'):
+            if key in report:
+                values[key] = report[key]['bytes']
+        if 'traced' in report:
+            values['traced'] = report['traced']['current']
+        return values
+
+    def _growing(self, report):
+        history = [self._tracked(old) for old in self.reports[-self.window:]] + [self._tracked(report)]
+        if len(history) <= self.window:
+            return []
+        growing = []
+        for key, value in history[-1].items():
+            series = [values.get(key) for values in history]
+            if None not in series and all(later > earlier for earlier, later in zip(series, series[1:])):
+                growing.append(key)
+        return sorted(growing)
+
+    def _write(self, report):
+        if self._file is None:
+            folder = os.path.dirname(self.file_name)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            self._file = open(self.file_name, 'a', encoding='utf8')
+        self._file.write(json.dumps(report) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+class DisabledProfiler:
+    """
+    A profiler which never reports.
+    """
+    enabled = False
+
+    def end_round(self, env, round_number):
+        pass
+
+    def close(self):
+        pass
+
+
+DISABLED = DisabledProfiler()
@@ -2,22 +2,74 @@ from creamas import Environment
 from Model_Classes import Metaphor, Haiku
 from MetaphorAgent import MetaphorAgent
 from HaikuAgent import HaikuAgent
+from MetaphorMemory import MetaphorStore
+from VoteExecutor import SerialExecutor
+from Metrics import DISABLED, memory_sizes
+import MemoryProfile
+import Checkpoint
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.DEBUG)
 
 
+def mean_scores(scores):
+    """
+    The average evaluation of each candidate.  Rows are summed one after another, as the per-vote sums used to be.
+
+    :param scores: agents x candidates array, see :func:'VoteExecutor.score_matrix'
+    :return: float array with the score of each candidate
+    """
+    if len(scores) == 0:
+        return np.zeros(scores.shape[1])
+    return (scores / len(scores)).sum(axis=0)
+
+
+def top_k(scores, k):
+    """
+    The indexes of the k highest scores, highest first.  Equal scores keep their order, as in a stable sort, but only
+    the candidates which can make the top k are sorted.
+
+    :param scores: float array
+    :param k (int): the number of indexes to return
+    :return: int array of at most k indexes
+    """
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < len(scores):
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        chosen = np.concatenate([above, ties])
+    else:
+        chosen = np.arange(len(scores))
+    return chosen[np.argsort(-scores[chosen], kind='stable')]
+
+
 class MetaHaikuEnvironment(Environment):
     """
     This class is a type of Environment which can handle both metaphor and haiku agents and objects.  Both types of artifacts
     can be candidates in the same round, and only the corresponding agents should vote on them.
+
+    The environment owns the :class:'MetaphorStore' all agent memories keep their metaphors in, so a metaphor memorized
+    by many agents is only stored once.  The agents' evaluations are run by *vote_executor*, see :mod:'VoteExecutor'.
+    The environment and the agents report timings and counters to *metrics*, see :mod:'Metrics', and
+    *memory_profile* can report the memory used, see :mod:'MemoryProfile'.  The winners are written to the log, or
+    as records to *artifact_sink* if it is set, see :mod:'ArtifactSink'.  *checkpointer* can save the whole simulation
+    at the end of the vote, see :mod:'Checkpoint'.
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.num_metaphors_accepted_per_round = kwargs.get('metaphor_winners') or 1
         self.haikus = []
+        self.metaphor_store = MetaphorStore()
+        self.vote_executor = SerialExecutor()
+        self.metrics = DISABLED
+        self.memory_profile = MemoryProfile.DISABLED
+        self.artifact_sink = None
+        self.checkpointer = Checkpoint.DISABLED
 
     def vote(self, age):
         """
@@ -26,13 +78,14 @@ class MetaHaikuEnvironment(Environment):
 
         * Separate candidates into metaphors and haiku
         * Separate agents in MetaphorAgents and HaikuAgents
-        * Have each agent evaluate each candidate of its type.  Give each candidate a score which is the average of these
-        evaluations
+        * Have each agent evaluate each candidate of its type, filling an agents x candidates score matrix.  Give each
+        candidate a score which is the average of its column
         * Apply the 50% score penalty to haiku which are guessed by 90% or more of the HaikuAgents
         * Choose the top *self.num_metaphors_accepted_per_round* scoring metaphors as winners.  Add them to the environment
         artifacts and print them to the log.
         * Choose the top scoring haiku and add it to *self.haikus*.  Print it, along with some meta-information about it
         (the number of metaphor agents which guessed it correctly and the number of metaphors used to create it)
+        * With an *artifact_sink*, the winners are recorded there instead of printed
 
         :param age: Does nothing.  Required due to inheritance.
         """
@@ -40,42 +93,70 @@ class MetaHaikuEnvironment(Environment):
         metaphor_candidates = [cand for cand in self._candidates if cand.domain() == Metaphor]
         haiku_candidates = [cand for cand in self._candidates if cand.domain() == Haiku]
 
-        metaphor_scores = dict()
-        haiku_scores = dict()
-
-        for metaphor in metaphor_candidates:
-            metaphor_scores[metaphor] = 0
-        for haiku in haiku_candidates:
-            haiku_scores[haiku] = 0
-
         agents = self.get_agents(address=False)
         metaphor_agents = [agent for agent in agents if isinstance(agent, MetaphorAgent)]
         haiku_agents = [agent for agent in agents if isinstance(agent, HaikuAgent)]
 
-        for a in metaphor_agents:
-            votes = a.vote(candidates=metaphor_candidates)
-            for vote in votes:
-                metaphor_scores[vote[0]] += vote[1] / len(metaphor_agents)
-        for a in haiku_agents:
-            votes = a.vote(candidates=haiku_candidates)
-            for vote in votes:
-                haiku_scores[vote[0]] += vote[1] / len(haiku_agents)
+        metrics = self.metrics
+        metrics.count('metaphor_candidates', len(metaphor_candidates))
+        metrics.count('haiku_candidates', len(haiku_candidates))
+        start = metrics.clock()
+        metaphor_scores, _ = self.vote_executor.evaluate(metaphor_agents, metaphor_candidates)
+        metrics.record('vote_metaphors', start)
+        start = metrics.clock()
+        haiku_scores, guesses = self.vote_executor.evaluate(haiku_agents, haiku_candidates)
+        metrics.record('vote_haiku', start)
+        start = metrics.clock()
+        self.choose_winners(metaphor_candidates, metaphor_scores, haiku_candidates, haiku_scores, guesses)
+        metrics.record('choose_winners', start)
+
+        self.clear_candidates()
+        if metrics.enabled:
+            metrics.end_round(age, stored_metaphors=len(self.metaphor_store), **memory_sizes(agents))
+        self.memory_profile.end_round(self, age)
+        self.checkpointer.end_round(self, age)
+
+    def choose_winners(self, metaphor_candidates, metaphor_scores, haiku_candidates, haiku_scores, guesses):
+        """
+        The second half of vote(): average the evaluations, apply the guess penalty and accept the winners.  Used on
+        its own by :class:'ShardedSimulation', which collects the evaluations from its shards.
+
+        :param metaphor_candidates: the metaphor candidates
+        :param metaphor_scores: MetaphorAgents x metaphor candidates array of evaluations
+        :param haiku_candidates: the haiku candidates
+        :param haiku_scores: HaikuAgents x haiku candidates array of evaluations
+        :param guesses: int array with the number of HaikuAgents which guessed the topic of each haiku candidate
+        """
+        haiku_agents = len(haiku_scores)
+        metaphor_scores = mean_scores(metaphor_scores)
+        haiku_scores = mean_scores(haiku_scores)
+        for haiku, count in zip(haiku_candidates, guesses):
+            haiku.obj.guessed_by += int(count)
 
         # Penalty for being easily guessable by everyone
-        for haiku, score in haiku_scores.items():
-            if haiku.obj.guessed_by > 0.9 * len(haiku_agents):
-                haiku_scores[haiku] /= 2
+        guessed_by = np.array([haiku.obj.guessed_by for haiku in haiku_candidates], dtype=np.float64)
+        haiku_scores[guessed_by > 0.9 * haiku_agents] /= 2
 
+        sink = self.artifact_sink
         if len(metaphor_candidates) >= self.num_metaphors_accepted_per_round:
-            winning_metaphors = sorted(metaphor_scores, key=metaphor_scores.get, reverse=True)[0:self.num_metaphors_accepted_per_round]
-            for metaphor in winning_metaphors:
+            for rank, i in enumerate(top_k(metaphor_scores, self.num_metaphors_accepted_per_round)):
+                metaphor = metaphor_candidates[i]
                 self.add_artifact(metaphor)
-                logger.info(str(metaphor.obj))
+                start = self.metrics.clock()
+                if sink is not None:
+                    sink.add_metaphor(self.age, metaphor, metaphor_scores[i], rank)
+                else:
+                    logger.info(str(metaphor.obj))
+                self.metrics.record('log', start)
 
         if len(haiku_candidates) >= 1:
-            winning_haiku = sorted(haiku_scores, key=haiku_scores.get, reverse=True)[0]
+            best = int(np.argmax(haiku_scores))
+            winning_haiku = haiku_candidates[best]
             self.haikus.append(winning_haiku)
-            logger.info(str(winning_haiku.obj))
-            logger.info(winning_haiku.obj.get_str_metadata())
-
-        self.clear_candidates()
+            start = self.metrics.clock()
+            if sink is not None:
+                sink.add_haiku(self.age, winning_haiku, haiku_scores[best])
+            else:
+                logger.info(str(winning_haiku.obj))
+                logger.info(winning_haiku.obj.get_str_metadata())
+            self.metrics.record('log', start)
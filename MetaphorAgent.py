@@ -1,8 +1,8 @@
 from creamas import CreativeAgent, Artifact
 from MetaphorMemory import MetaphorMemory
 from Model_Classes import Metaphor
-from gensim.models import word2vec
-import random
+from Lexicon import Lexicon
+import numpy as np
 
 
 class MetaphorAgent(CreativeAgent):
@@ -20,16 +20,21 @@ class MetaphorAgent(CreativeAgent):
 
         INVENT_TRIES                The number of metaphors to generate and evaluate before submitting the best as a candidate
     """
-    def __init__(self, env, nouns, word2vec_model, mem_cap=100):
+    def __init__(self, env, nouns, word2vec_model, mem_cap=100, lexicon=None, eviction='random'):
         """
         :param env (Environment): the creamas environment the agent will operate in
         :param nouns (list of :class:'Noun'): a list of nouns (describing adjectives included) to draw metaphors from
+        :param word2vec_model (:class:'NounEmbeddings'): the noun similarities shared by all agents.  A gensim word2vec model also works, but every agent then queries the full model
         :param mem_cap (int): the number of metaphors the agent will keep in its memory before it starts forgetting them at random
+        :param lexicon (:class:'Lexicon'): an index over *nouns*.  Agents sharing a noun list should share one lexicon, otherwise each agent builds its own
+        :param eviction (str): which metaphor to forget when the memory is full, see :class:'MetaphorMemory'
         """
         super().__init__(env)
         self.nouns = nouns
+        self.lexicon = lexicon if lexicon is not None else Lexicon(nouns)
         self.word2vec_model = word2vec_model
-        self.memory = MetaphorMemory(mem_cap)
+        self.memory = MetaphorMemory(mem_cap, eviction, store=getattr(env, 'metaphor_store', None))
+        self.invent_tries = 0
 
     SHARED_SCORE_EVAL_WEIGHT = 1
     NOUN_SCORE_EVAL_WEIGHT = 0
@@ -43,56 +48,59 @@ class MetaphorAgent(CreativeAgent):
         Each simulation round, the MetaphorAgent memorizes the metaphor winners from last round, then invents a
         new :class:'Metaphor' and enters it as a candidate.
         """
+        metrics = self.env.metrics
+        start = metrics.clock()
         if len(self.env.artifacts) > 0:
             # memorize the most recent artifact.  Agents will distinguish themselves once they start forgetting
             for winner in self.env.artifacts[(-self.env.num_metaphors_accepted_per_round - 1):-1]:
                 self.memory.memorize(winner.obj)
 
+        invent_start = metrics.clock()
         metaphor = self.invent()
+        metrics.record('metaphor_invent', invent_start)
+        metrics.count('metaphor_invent_tries', self.invent_tries)
         if metaphor is not None:
             self.env.add_candidate(metaphor)
             self.memory.memorize(metaphor.obj)
+        metrics.record('metaphor_act', start)
 
     def invent(self):
         """
-        Generates INVENT_TRIES new metaphors and evaluates them, then returns the one with the best
-        evaluation.
+        Generates INVENT_TRIES new metaphors and evaluates them in one batch with eval_metaphors(), then returns the one
+        with the best evaluation.  Ties go to the earliest candidate.  The number of candidates actually generated is
+        left in invent_tries.
 
-        :return: the metaphor with the best evaluation
+        :return: the metaphor with the best evaluation, or None if no metaphor could be generated
         """
-        best_score = -1
-        best_metaphor = None
-        for i in range(0, MetaphorAgent.INVENT_TRIES):
-            candidate = self.generate()
-            if candidate is None:
-                continue
-            score = self.eval_metaphor(candidate.obj)
-            if score > best_score:
-                best_metaphor = candidate
-                best_score = score
-        best_metaphor.add_eval(self, best_score)
-        return best_metaphor
+        candidates = [self.generate() for i in range(0, MetaphorAgent.INVENT_TRIES)]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+        self.invent_tries = len(candidates)
+        if len(candidates) == 0:
+            return None
+        scores = self.eval_metaphors([candidate.obj for candidate in candidates])
+        best = int(np.argmax(scores))
+        candidates[best].add_eval(self, scores[best])
+        return candidates[best]
 
     def generate(self):
         """
-        Generate a new metaphor by a very simple method:
+        Generate a new metaphor by drawing two nouns with a shared adjective from the lexicon.  The draw follows the
+        acceptance rule of the original search, which:
 
-        * shuffle the lists of nouns and adjectives
-        * repeatedly pick a noun, then pick another noun, then check if they have any adjectives in common
-        * if an adjective is found in common, with probability 0.5 create a metaphor using these two nouns and that adjective.  With probability 0.5 continue searching.
-        * if no adjective in common is found, pick a new noun (without replacement)
+        * shuffled the lists of nouns and adjectives
+        * repeatedly picked a noun, then picked another noun, then checked if they have any adjectives in common
+        * if an adjective was found in common, with probability 0.5 created a metaphor using these two nouns and that adjective.  With probability 0.5 continued searching.
+        * if no adjective in common was found, picked a new noun (without replacement)
 
-        :return: an Artifact with the Metaphor as its object and :class:'Metaphor' as its domain
+        See :class:'Lexicon' for how this is done in constant time.
+
+        :return: an Artifact with the Metaphor as its object and :class:'Metaphor' as its domain, or None if no two nouns share an adjective
         """
-        random.shuffle(self.nouns)
-        for noun_1 in self.nouns:
-            for noun_2 in self.nouns:
-                if noun_1.word != noun_2.word:
-                    for adj in noun_1.get_adjectives():
-                        if adj.word in [adj2.word for adj2 in noun_2.get_adjectives()]:
-                            if random.randint(0, 1) == 1:
-                                return Artifact(self, Metaphor(noun_1, noun_2, adj), domain=Metaphor)
-        return None
+        triple = self.lexicon.sample()
+        if triple is None:
+            return None
+        noun_1, noun_2, adj = triple
+        return Artifact(self, Metaphor(noun_1, noun_2, adj), domain=Metaphor)
 
     def evaluate(self, artifact):
         """
@@ -106,6 +114,30 @@ class MetaphorAgent(CreativeAgent):
             return self.eval_metaphor(artifact.obj), None
         return -1, None
 
+    def evaluate_batch(self, artifacts):
+        """
+        Evaluate many artifacts at once.  The scores are the same as evaluate() gives, but the metaphors are scored in
+        one call to eval_metaphors().
+
+        :param artifacts: the artifacts to be evaluated
+        :return: float array with the evaluation score of each artifact
+        """
+        scores = np.full(len(artifacts), -1.0)
+        positions = [i for i, artifact in enumerate(artifacts) if isinstance(artifact.obj, Metaphor)]
+        if positions:
+            scores[positions] = self.eval_metaphors([artifacts[i].obj for i in positions])
+        return scores
+
+    def score_batch(self, artifacts):
+        """
+        Evaluate many artifacts, see evaluate_batch().  Metaphor evaluation has no side effects, so this is the same
+        apart from the guesses, which are always False.  See :meth:'HaikuAgent.score_batch'.
+
+        :param artifacts: the artifacts to be evaluated
+        :return: a tuple of a float array with the score of each artifact and a bool array of guesses
+        """
+        return self.evaluate_batch(artifacts), np.zeros(len(artifacts), dtype=bool)
+
     def count_noun_metaphors(self, noun, shared_noun):
         """
         Count the appearances of a noun in the metaphor memory.  Also count the number of metaphors which have the same other noun as the one given.
@@ -116,14 +148,7 @@ class MetaphorAgent(CreativeAgent):
         :type shared_noun: :class:'Noun'
         :return: a tuple including the metaphor counts for the single noun and for both nouns
         """
-        shared_count = 0
-        count = 0
-        if noun in self.memory.metaphor_lookup.keys():
-            for other_noun, metaphor_list in self.memory.metaphor_lookup[noun].items():
-                if other_noun == shared_noun:
-                    shared_count += len(metaphor_list)
-                count += len(metaphor_list)
-        return count, shared_count
+        return self.memory.noun_count(noun), self.memory.pair_count(noun, shared_noun)
 
     def eval_metaphor(self, metaphor):
         """
@@ -143,21 +168,39 @@ class MetaphorAgent(CreativeAgent):
         :param metaphor: The metaphor to be evaluated
         :return: The evaluation score for the metaphor
         """
+        return self.eval_metaphors([metaphor])[0]
+
+    def eval_metaphors(self, metaphors):
+        """
+        Evaluate a list of metaphors in one pass.  Each score is computed exactly as described in eval_metaphor(), but
+        the w2v similarities are looked up in one batch and the weighted sum is taken over arrays.
 
-        w2v_score = self.word2vec_model.similarity(metaphor.noun_1.word, metaphor.noun_2.word)
+        :param metaphors: the metaphors to be evaluated
+        :type metaphors: list of :class:'Metaphor'
+        :return: array with the evaluation score of each metaphor
+        """
+        pairs = [(metaphor.noun_1.word, metaphor.noun_2.word) for metaphor in metaphors]
+        if hasattr(self.word2vec_model, 'similarities'):
+            w2v_scores = np.asarray(self.word2vec_model.similarities(pairs), dtype=np.float64)
+        else:
+            w2v_scores = np.array([self.word2vec_model.similarity(word_1, word_2) for word_1, word_2 in pairs],
+                                  dtype=np.float64)
 
         # Metaphors we've seen before exactly are completelty uninteresting
-        if self.memory.contains(metaphor):
-            return 0
+        seen = np.array([self.memory.contains(metaphor) for metaphor in metaphors], dtype=bool)
 
-        noun1_count, shared_count = self.count_noun_metaphors(metaphor.noun_1, metaphor.noun_2)
-        noun2_count, _ = self.count_noun_metaphors(metaphor.noun_2, metaphor.noun_1)
-        adj_count = self.memory.adjective_counts.get(metaphor.adjective) or 0
         total_count = float(self.memory.count)
 
         # If there are no other metaphors in memory, we can only rely on the w2v score
         if total_count == 0:
-            return w2v_score
+            return np.where(seen, 0.0, w2v_scores)
+
+        noun1_count = np.array([self.memory.noun_count(metaphor.noun_1) for metaphor in metaphors], dtype=np.float64)
+        noun2_count = np.array([self.memory.noun_count(metaphor.noun_2) for metaphor in metaphors], dtype=np.float64)
+        shared_count = np.array([self.memory.pair_count(metaphor.noun_1, metaphor.noun_2) for metaphor in metaphors],
+                                dtype=np.float64)
+        adj_count = np.array([self.memory.adjective_counts.get(metaphor.adjective) or 0 for metaphor in metaphors],
+                             dtype=np.float64)
 
         noun1_score = 1 - (noun1_count / total_count)
         noun2_score = 1 - (noun2_count / total_count)
@@ -168,10 +211,10 @@ class MetaphorAgent(CreativeAgent):
                      + (MetaphorAgent.NOUN_SCORE_EVAL_WEIGHT * noun1_score)
                      + (MetaphorAgent.NOUN_SCORE_EVAL_WEIGHT * noun2_score)
                      + (MetaphorAgent.ADJ_SCORE_EVAL_WEIGHT * adj_score)
-                     + (MetaphorAgent.W2V_CLOSENESS_EVAL_WEIGHT * w2v_score))
+                     + (MetaphorAgent.W2V_CLOSENESS_EVAL_WEIGHT * w2v_scores))
         denominator = (MetaphorAgent.SHARED_SCORE_EVAL_WEIGHT
                        + (2 * MetaphorAgent.NOUN_SCORE_EVAL_WEIGHT)
                        + MetaphorAgent.ADJ_SCORE_EVAL_WEIGHT
                        + MetaphorAgent.W2V_CLOSENESS_EVAL_WEIGHT)
 
-        return (nominator / denominator)
+        return np.where(seen, 0.0, nominator / denominator)
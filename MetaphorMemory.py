@@ -1,31 +1,328 @@
+from array import array
+from collections import OrderedDict
+from Model_Classes import Metaphor, METAPHOR_KEY_BITS
 import random
 
 
+class RandomEviction:
+    """
+    Forget a random metaphor.  This is the original behaviour of the memory.
+    """
+    def add(self, key):
+        pass
+
+    def touch(self, key):
+        pass
+
+    def remove(self, key):
+        pass
+
+    def victim(self, memory):
+        return memory.random_id()
+
+    def state(self):
+        return []
+
+    def load(self, state):
+        pass
+
+
+class AgeEviction:
+    """
+    Forget the metaphor which was memorized first.
+    """
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def add(self, key):
+        self._order[key] = None
+
+    def touch(self, key):
+        pass
+
+    def remove(self, key):
+        del self._order[key]
+
+    def victim(self, memory):
+        return next(iter(self._order))
+
+    def state(self):
+        """
+        Returns the keys as (key, count) pairs, next victim first.  See load().
+        """
+        return [(key, 1) for key in self._order]
+
+    def load(self, state):
+        """
+        Replace the order of the keys with one returned by state().
+        """
+        self._order = OrderedDict((key, None) for key, _ in state)
+
+
+class LRUEviction(AgeEviction):
+    """
+    Forget the metaphor which was least recently memorized.  Memorizing a metaphor which is already in the memory
+    counts as a use.
+    """
+    def touch(self, key):
+        self._order.move_to_end(key)
+
+
+class LFUEviction:
+    """
+    Forget the metaphor which was memorized the fewest times.  Ties go to the one which reached that count first.
+    Metaphors are kept in buckets by count, so every operation takes constant (amortized) time.
+    """
+    def __init__(self):
+        self._counts = dict()
+        self._buckets = dict()
+        self._min_count = 0
+
+    def add(self, key):
+        self._counts[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+        self._min_count = 1
+
+    def touch(self, key):
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min_count == count:
+                self._min_count = count + 1
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def remove(self, key):
+        count = self._counts.pop(key)
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+
+    def victim(self, memory):
+        while self._min_count not in self._buckets:
+            self._min_count += 1
+        return next(iter(self._buckets[self._min_count]))
+
+    def state(self):
+        """
+        Returns the keys with their counts as (key, count) pairs, by count and then in the order they reached it.
+        """
+        return [(key, count) for count in sorted(self._buckets) for key in self._buckets[count]]
+
+    def load(self, state):
+        """
+        Replace the counts with ones returned by state().
+        """
+        self._counts = dict()
+        self._buckets = dict()
+        for key, count in state:
+            self._counts[key] = count
+            self._buckets.setdefault(count, OrderedDict())[key] = None
+        self._min_count = min(self._buckets) if self._buckets else 0
+
+
+class MetaphorStore:
+    """
+    The metaphors memorized by the agents of one environment.  Each distinct metaphor is stored once under a small
+    integer id, and the store keeps the indexes agents need to query their memories: by noun and by noun pair.
+    Agent memories (see :class:'MetaphorMemory') only hold ids into the store.
+
+    The store counts the memories holding each metaphor.  A metaphor no memory holds any more is dropped and its id is
+    reused, so the store is bounded by the union of the agents' memories.
+    """
+    def __init__(self):
+        self._metaphors = []
+        self._refcounts = []
+        self._sequence = []
+        self._added = 0
+        self._ids = dict()
+        self._free = []
+        self._by_noun = dict()
+        self._by_pair = dict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def size(self):
+        """
+        One more than the largest id in use, i.e. the length of an array indexed by id.
+        """
+        return len(self._metaphors)
+
+    def id_of(self, metaphor):
+        """
+        Returns the id of a metaphor (or an equal one), or None if no memory holds it.
+        """
+        return self._ids.get(metaphor.key)
+
+    def metaphor(self, metaphor_id):
+        """
+        Returns the metaphor stored under an id.
+        """
+        return self._metaphors[metaphor_id]
+
+    def sequence(self, metaphor_id):
+        """
+        Returns the number of metaphors added to the store before the one stored under an id.  The indexes list
+        metaphors in this order, so a store which is given the metaphors in this order answers queries in the same order.
+        """
+        return self._sequence[metaphor_id]
+
+    def retain(self, metaphor):
+        """
+        Register one more memory holding the metaphor, adding the metaphor to the store if it is new.
+
+        :return: the id of the metaphor
+        """
+        metaphor_id = self._ids.get(metaphor.key)
+        if metaphor_id is None:
+            if self._free:
+                metaphor_id = self._free.pop()
+                self._metaphors[metaphor_id] = metaphor
+                self._refcounts[metaphor_id] = 0
+                self._sequence[metaphor_id] = self._added
+            else:
+                metaphor_id = len(self._metaphors)
+                self._metaphors.append(metaphor)
+                self._refcounts.append(0)
+                self._sequence.append(self._added)
+            self._added += 1
+            self._ids[metaphor.key] = metaphor_id
+            for noun in (metaphor.noun_1, metaphor.noun_2):
+                self._by_noun.setdefault(noun, dict())[metaphor_id] = None
+            self._by_pair.setdefault(metaphor.key >> METAPHOR_KEY_BITS, dict())[metaphor_id] = None
+        self._refcounts[metaphor_id] += 1
+        return metaphor_id
+
+    def release(self, metaphor_id):
+        """
+        Register one memory less holding the metaphor.  The metaphor is dropped when no memory holds it.
+        """
+        self._refcounts[metaphor_id] -= 1
+        if self._refcounts[metaphor_id] > 0:
+            return
+        metaphor = self._metaphors[metaphor_id]
+        del self._ids[metaphor.key]
+        for noun in (metaphor.noun_1, metaphor.noun_2):
+            self._remove_from_index(self._by_noun, noun, metaphor_id)
+        self._remove_from_index(self._by_pair, metaphor.key >> METAPHOR_KEY_BITS, metaphor_id)
+        self._metaphors[metaphor_id] = None
+        self._free.append(metaphor_id)
+
+    @staticmethod
+    def _remove_from_index(index, key, metaphor_id):
+        ids = index[key]
+        ids.pop(metaphor_id, None)
+        if not ids:
+            del index[key]
+
+    def noun_ids(self, noun):
+        """
+        Returns the ids of the stored metaphors which include the noun.  Only :class:'Noun' objects match.
+        """
+        return self._by_noun.get(noun, ())
+
+    def pair_ids(self, noun_1, noun_2):
+        """
+        Returns the ids of the stored metaphors which link the two nouns, in either order.
+        """
+        return self._by_pair.get(Metaphor.make_key(noun_1.id, noun_2.id, 0) >> METAPHOR_KEY_BITS, ())
+
+
+EVICTION_POLICIES = {
+    'random': RandomEviction,
+    'age': AgeEviction,
+    'lru': LRUEviction,
+    'lfu': LFUEviction,
+}
+
+
 class MetaphorMemory:
     """
     This class represents an agent's memory of metaphors it has encountered.
+
+    The metaphors themselves live in a :class:'MetaphorStore' shared by all agents of an environment.  The memory only
+    holds an array of store ids, with an index from each id to its position.  Forgetting a metaphor moves the last id
+    into its place, so memorizing, forgetting and picking a random metaphor all take constant time.  Which metaphor is
+    forgotten when the memory is full depends on the eviction policy, see EVICTION_POLICIES.
+
+    Queries by noun go through the store's indexes and are filtered by membership.  The memory keeps its own counts
+    per noun and per adjective.
     """
-    def __init__(self, capacity):
+    def __init__(self, capacity, eviction='random', store=None):
+        """
+        :param capacity (int): the maximum number of metaphors
+        :param eviction (str): the eviction policy, one of 'random', 'age', 'lru' or 'lfu'
+        :param store (:class:'MetaphorStore'): the store shared with other memories.  By default the memory gets a store of its own
+        """
         assert type(capacity) is int, "capacity is not an integer"
+        assert eviction in EVICTION_POLICIES, "unknown eviction policy {}".format(eviction)
         self._capacity = capacity
-        self._count = 0
-        self._metaphors = dict()
+        self._eviction = EVICTION_POLICIES[eviction]()
+        self._store = store if store is not None else MetaphorStore()
+        self._entries = array('I')
+        self._positions = dict()
+        self._noun_counts = dict()
+        self._noun_versions = dict()
         self._adjective_counts = dict()
+        self._version = 0
+        self._evictions = 0
 
     @property
     def capacity(self):
         """
         Returns the maximum number of metaphors which can be stored in the memory.  If new metaphors are memorized while
-        at capacity, a random old metaphor will be forgotten.
+        at capacity, an old metaphor chosen by the eviction policy will be forgotten.
         """
         return self._capacity
 
+    @property
+    def eviction(self):
+        """
+        The name of the eviction policy, see EVICTION_POLICIES.
+        """
+        return next(name for name, cls in EVICTION_POLICIES.items() if type(self._eviction) is cls)
+
     @property
     def count(self):
         """
         The number of metaphors currently memorized.
         """
-        return self._count
+        return len(self._entries)
+
+    @property
+    def version(self):
+        """
+        A number which changes whenever a metaphor is memorized or forgotten, for caching results derived from the
+        memory.
+        """
+        return self._version
+
+    def noun_version(self, noun):
+        """
+        The version of the memory when a metaphor with the noun was last memorized or forgotten, or None if no
+        memorized metaphor includes the noun.  Results derived from the metaphors with a noun, like the words
+        HaikuAgent writes about a topic, stay valid while this does not change.
+        """
+        return self._noun_versions.get(noun)
+
+    @property
+    def evictions(self):
+        """
+        The number of metaphors forgotten to make room for new ones.
+        """
+        return self._evictions
+
+    @property
+    def store(self):
+        """
+        The :class:'MetaphorStore' holding the metaphors.
+        """
+        return self._store
 
     @property
     def adjective_counts(self):
@@ -38,80 +335,165 @@ class MetaphorMemory:
     @property
     def metaphor_lookup(self):
         """
-        Returns the metaphor memory.  The structure allows two nouns to be used in either order as
+        Returns the metaphor memory as a nested dict.  The structure allows two nouns to be used in either order as
         keys to return a list of metaphors which link those two nouns.
+
+        The dict is built on every call.  Use nouns(), metaphors_with(), noun_count() and pair_count() to query the
+        memory instead.
+        """
+        lookup = dict()
+        for metaphor in self:
+            lookup.setdefault(metaphor.noun_1, dict()).setdefault(metaphor.noun_2, []).append(metaphor)
+            lookup.setdefault(metaphor.noun_2, dict()).setdefault(metaphor.noun_1, []).append(metaphor)
+        return lookup
+
+    def __iter__(self):
+        for metaphor_id in self._entries:
+            yield self._store.metaphor(metaphor_id)
+
+    def ids(self):
+        """
+        Returns the store ids of the memorized metaphors as a copy of the memory's array.
+        """
+        return array('I', self._entries)
+
+    def nouns(self):
+        """
+        Returns the nouns which appear in at least one memorized metaphor.
+        """
+        return list(self._noun_counts.keys())
+
+    def noun_count(self, noun):
+        """
+        Returns the number of memorized metaphors which include the noun.
+        """
+        return self._noun_counts.get(noun, 0)
+
+    def pair_count(self, noun_1, noun_2):
+        """
+        Returns the number of memorized metaphors which link the two nouns, in either order.
         """
-        return self._metaphors
+        positions = self._positions
+        return sum(1 for metaphor_id in self._store.pair_ids(noun_1, noun_2) if metaphor_id in positions)
+
+    def metaphors_with(self, noun):
+        """
+        Returns the memorized metaphors which include the noun.  Only :class:'Noun' objects match.
+        """
+        if noun not in self._noun_counts:
+            return []
+        positions = self._positions
+        store = self._store
+        return [store.metaphor(metaphor_id) for metaphor_id in store.noun_ids(noun) if metaphor_id in positions]
 
     def contains(self, metaphor):
         """
         A method to check whether a metaphor is in the memory already.  Note that metaphor equality is determined by
-        having the same nouns and adjective, not by object id.  The order of the nouns may also be reversed.
+        having the same nouns and adjective, not by object id.  The order of the nouns may also be reversed.  This is a
+        lookup of the metaphor's canonical key.
 
         :param metaphor: The metaphor to check for.
         :return: True if the memory contains that metaphor, false otherwise.
         """
-        if metaphor.noun_1 not in self._metaphors.keys():
-            return False
-
-        if metaphor.noun_2 not in self._metaphors[metaphor.noun_1].keys():
-            return False
+        return self._store.id_of(metaphor) in self._positions
 
-        if metaphor not in self._metaphors[metaphor.noun_1][metaphor.noun_2]:
-            return False
-
-        return True
+    def random_id(self):
+        """
+        Returns the store id of a random metaphor from the memory.
+        """
+        return self._entries[random.randrange(len(self._entries))]
 
     def get_random_metaphor(self):
         """
         Returns a random metaphor from the memory.
         """
-        noun_from = random.choice(list(self._metaphors.keys()))
-        noun_to = random.choice(list(self._metaphors[noun_from].keys()))
-        return random.choice(self._metaphors[noun_from][noun_to])
+        return self._store.metaphor(self.random_id())
 
     def forget(self, metaphor):
         """
-        Removes the given metaphor from the memory.  Will throw a KeyNotFoundException if that metaphor does not
+        Removes the given metaphor from the memory.  Will throw a KeyError if that metaphor does not
         exist in the memory.
 
         :param metaphor: The metaphor to remove
         """
-        self._metaphors[metaphor.noun_1][metaphor.noun_2].remove(metaphor)
-        self._metaphors[metaphor.noun_2][metaphor.noun_1].remove(metaphor)
-        # if the list is empty remove the key
-        if not self._metaphors[metaphor.noun_1][metaphor.noun_2]:
-            del self._metaphors[metaphor.noun_1][metaphor.noun_2]
-            del self._metaphors[metaphor.noun_2][metaphor.noun_1]
-        if len(self._metaphors[metaphor.noun_1]) == 0:
-            del self._metaphors[metaphor.noun_1]
-        if len(self._metaphors[metaphor.noun_2]) == 0:
-            del self._metaphors[metaphor.noun_2]
-        self._adjective_counts[metaphor.adjective] -= 1
+        metaphor_id = self._store.id_of(metaphor)
+        if metaphor_id not in self._positions:
+            raise KeyError(str(metaphor))
+        self._forget_id(metaphor_id)
+
+    def _forget_id(self, metaphor_id):
+        self._version += 1
+        position = self._positions.pop(metaphor_id)
+        last = self._entries.pop()
+        if last != metaphor_id:
+            self._entries[position] = last
+            self._positions[last] = position
+        self._eviction.remove(metaphor_id)
+
+        stored = self._store.metaphor(metaphor_id)
+        for noun in (stored.noun_1, stored.noun_2):
+            self._noun_counts[noun] -= 1
+            self._noun_versions[noun] = self._version
+            if self._noun_counts[noun] == 0:
+                del self._noun_counts[noun]
+                del self._noun_versions[noun]
+        self._adjective_counts[stored.adjective] -= 1
+        self._store.release(metaphor_id)
 
     def memorize(self, metaphor):
         """
-        Adds a metaphor to the memory.  If the memory is at capacity before this is called, a random metaphor will be
-        forgotten first.
+        Adds a metaphor to the memory.  If the memory is at capacity before this is called, a metaphor chosen by the
+        eviction policy will be forgotten first.  Memorizing a metaphor which is already in the memory only counts as a
+        use of it for the policy.
         """
-        if self.contains(metaphor):
+        metaphor_id = self._store.id_of(metaphor)
+        if metaphor_id in self._positions:
+            self._eviction.touch(metaphor_id)
             return
 
-        self._count += 1
-        if self._count > self._capacity:
-            to_remove = self.get_random_metaphor()
-            self.forget(to_remove)
+        if len(self._entries) >= self._capacity:
+            self._evictions += 1
+            self._forget_id(self._eviction.victim(self))
+
+        metaphor_id = self._store.retain(metaphor)
+        self._version += 1
+        self._positions[metaphor_id] = len(self._entries)
+        self._entries.append(metaphor_id)
+        self._eviction.add(metaphor_id)
+
+        stored = self._store.metaphor(metaphor_id)
+        for noun in (stored.noun_1, stored.noun_2):
+            self._noun_counts[noun] = self._noun_counts.get(noun, 0) + 1
+            self._noun_versions[noun] = self._version
+
+        if stored.adjective not in self._adjective_counts.keys():
+            self._adjective_counts[stored.adjective] = 0
+        self._adjective_counts[stored.adjective] += 1
 
-        def __insert_metaphor_one_way(noun_from, noun_to, metaphor_obj):
-            if noun_from not in self._metaphors.keys():
-                self._metaphors[noun_from] = dict()
-            if noun_to not in self._metaphors[noun_from].keys():
-                self._metaphors[noun_from][noun_to] = []
-            self._metaphors[noun_from][noun_to] += [metaphor_obj]
+    def eviction_state(self):
+        """
+        Returns the state of the eviction policy as (store id, use count) pairs, next victim first.  The counts are
+        only kept by 'lfu', and 'random' has no state.
+        """
+        return self._eviction.state()
 
-        __insert_metaphor_one_way(metaphor.noun_1, metaphor.noun_2, metaphor)
-        __insert_metaphor_one_way(metaphor.noun_2, metaphor.noun_1, metaphor)
+    def load(self, metaphors, eviction_state=(), nouns=None, evictions=0):
+        """
+        Fill an empty memory with saved contents, so that it behaves as the memory they were saved from, see
+        :mod:'Checkpoint'.
 
-        if metaphor.adjective not in self._adjective_counts.keys():
-            self._adjective_counts[metaphor.adjective] = 0
-        self._adjective_counts[metaphor.adjective] += 1
+        :param metaphors: the metaphors in the order of ids()
+        :param eviction_state: eviction_state() of the saved memory, with positions in *metaphors* in place of store ids
+        :param nouns: the saved nouns() in their order, which decides the topics HaikuAgents draw
+        :param evictions (int): the saved number of evictions
+        """
+        assert self.count == 0, "the memory is not empty"
+        assert len(metaphors) <= self._capacity, "more metaphors than the capacity"
+        for metaphor in metaphors:
+            self.memorize(metaphor)
+        self._eviction.load([(self._entries[position], count) for position, count in eviction_state])
+        if nouns is not None:
+            counts = self._noun_counts
+            assert len(nouns) == len(counts), "the nouns do not match the metaphors"
+            self._noun_counts = dict((noun, counts[noun]) for noun in nouns)
+        self._evictions = evictions
@@ -0,0 +1,156 @@
+"""
+Per-round instrumentation of the simulation.
+
+The environment and the agents report to the *metrics* attribute of the environment.  By default it is DISABLED,
+whose methods do nothing, so the instrumentation costs a few empty calls per agent and round.  To collect metrics,
+set it to a :class:'Metrics' before running the simulation::
+
+    env.metrics = Metrics('logs/metrics.jsonl')
+
+Every round, :meth:'MetaHaikuEnvironment.vote' ends the round with end_round(), which writes one JSON line with the
+wall time of the round, the seconds and calls of every timed phase, the counters, and the sizes of the agents'
+memories.  Timed phases:
+
+* metaphor_act, haiku_act: the agents' act(), including the phases below
+* metaphor_invent, haiku_invent: inventing the candidate
+* vote_metaphors, vote_haiku: the agents' evaluations of the candidates, run by the environment's vote_executor
+* choose_winners: averaging the evaluations and accepting the winners, including logging
+* log: writing the winners to the log
+
+:class:'ShardedSimulation' times shard_act and shard_score, the round trips to its worker processes, instead of the
+agents' phases.
+"""
+
+import json
+import os
+import time
+
+# The default metrics file, next to the creamas logs
+METRICS_FILE = os.path.join('logs', 'metrics.jsonl')
+
+
+class Metrics:
+    """
+    Collects the timings and counters of a round and writes them as one JSON line when the round ends.
+
+    Attributes:
+        enabled     False for DISABLED, so callers can skip preparing values nobody records
+    """
+    enabled = True
+
+    def __init__(self, file_name=METRICS_FILE):
+        """
+        :param file_name (str): the JSON lines file to append the rounds to.  Its folder is created if needed
+        """
+        self.file_name = file_name
+        self._file = None
+        self._seconds = dict()
+        self._calls = dict()
+        self._counts = dict()
+        self._round_start = time.perf_counter()
+
+    @staticmethod
+    def clock():
+        """
+        Returns the start time of a phase, to be passed to record().
+        """
+        return time.perf_counter()
+
+    def record(self, phase, start):
+        """
+        Add the time since *start* to a phase of the current round.
+
+        :param phase (str): the name of the phase
+        :param start (float): the value of clock() when the phase started
+        """
+        self._seconds[phase] = self._seconds.get(phase, 0.0) + time.perf_counter() - start
+        self._calls[phase] = self._calls.get(phase, 0) + 1
+
+    def count(self, name, n=1):
+        """
+        Add *n* to a counter of the current round.
+        """
+        self._counts[name] = self._counts.get(name, 0) + n
+
+    def end_round(self, round_number, **values):
+        """
+        Write the current round and start the next one.
+
+        :param round_number (int): the round, usually the age of the environment
+        :param values: other values of the round, e.g. memory sizes
+        """
+        now = time.perf_counter()
+        line = {
+            'round': round_number,
+            'seconds': now - self._round_start,
+            'phases': {phase: {'seconds': seconds, 'calls': self._calls[phase]}
+                       for phase, seconds in self._seconds.items()},
+            'counts': self._counts,
+        }
+        line.update(values)
+        if self._file is None:
+            folder = os.path.dirname(self.file_name)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            self._file = open(self.file_name, 'a', encoding='utf8')
+        self._file.write(json.dumps(line) + '\n')
+        self._seconds = dict()
+        self._calls = dict()
+        self._counts = dict()
+        self._round_start = time.perf_counter()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DisabledMetrics:
+    """
+    Metrics which are not collected.  Every method does nothing.
+    """
+    enabled = False
+
+    @staticmethod
+    def clock():
+        return 0.0
+
+    def record(self, phase, start):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def end_round(self, round_number, **values):
+        pass
+
+    def close(self):
+        pass
+
+
+DISABLED = DisabledMetrics()
+
+
+def memory_sizes(agents):
+    """
+    Summarize the memories of the agents for end_round().
+
+    :return: dict with the total and largest number of memorized metaphors, and the number of evictions since the
+     agents were created
+    """
+    counts = [agent.memory.count for agent in agents]
+    return {
+        'memorized': sum(counts),
+        'memorized_max': max(counts) if counts else 0,
+        'evictions': sum(agent.memory.evictions for agent in agents),
+    }
+
+
+def read_metrics(file_name=METRICS_FILE):
+    """
+    Read a metrics file written by :class:'Metrics'.
+
+    :return: list of dicts, one per round
+    """
+    with open(file_name, 'r', encoding='utf8') as f:
+        return [json.loads(line) for line in f if line.strip()]
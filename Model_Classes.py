@@ -1,23 +1,64 @@
 import random
 
+# Every distinct word string gets a small integer id the first time it is seen.  Ids are only meaningful within one
+# process, which is why the model classes pickle themselves by their words.
+_word_ids = dict()
+_interned_words = dict()
+
+# Number of bits per word id in a metaphor key
+METAPHOR_KEY_BITS = 32
+
+
+def word_id(word):
+    """
+    Returns the integer id of a word string, assigning a new one if the word has not been seen before.
+
+    :param word: the word
+    :type word: str
+    :return: the id
+    """
+    i = _word_ids.get(word)
+    if i is None:
+        i = _word_ids[word] = len(_word_ids)
+    return i
+
 
 class Word:
     """
     Represents a word (either a noun or adjective).  We defined our own class for this instead of just using strings
-    because it needed to include the syllable count.
+    because it needed to include the syllable count.  The word string is also interned to an integer *id*, which is
+    used for hashing and comparisons.
     """
+    __slots__ = ('word', 'syllables', 'id')
+
     def __init__(self, word, syllables):
         self.word = word
         self.syllables = syllables
+        self.id = word_id(word)
+
+    @staticmethod
+    def interned(word, syllables):
+        """
+        Returns a shared Word instance for the given word and syllable count, creating it on first use.  Use this for
+        words which appear many times, like the adjectives in a data file.
+        """
+        key = (word, syllables)
+        instance = _interned_words.get(key)
+        if instance is None:
+            instance = _interned_words[key] = Word(word, syllables)
+        return instance
 
     def __eq__(self, other):
-        return isinstance(other, Word) and other.word == self.word and other.syllables == self.syllables
+        return isinstance(other, Word) and other.id == self.id and other.syllables == self.syllables
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.word, self.syllables))
+        return self.id
+
+    def __reduce__(self):
+        return Word, (self.word, self.syllables)
 
     def __str__(self):
         return self.word
@@ -27,6 +68,8 @@ class Noun(Word):
     """
     Derived from word.  Adds a list of describing adjectives.
     """
+    __slots__ = ('adjectives',)
+
     def __init__(self, word, syllables, adjectives=None):
         super().__init__(word, syllables)
         self.adjectives = adjectives or []
@@ -51,13 +94,16 @@ class Noun(Word):
         return self.adjectives
 
     def __eq__(self, other):
-        return isinstance(other, Noun) and other.word == self.word
+        return isinstance(other, Noun) and other.id == self.id
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.word, self.syllables))
+        return self.id
+
+    def __reduce__(self):
+        return Noun, (self.word, self.syllables, self.adjectives)
 
     def __str__(self):
         return str(self.word)
@@ -88,7 +134,7 @@ class Noun(Word):
 
         parts = parts[2:]
         while len(parts) > 0:
-            noun.add_adjectives(Word(parts[0], int(parts[1])))
+            noun.add_adjectives(Word.interned(parts[0], int(parts[1])))
             parts = parts[2:]
         return noun
 
@@ -96,27 +142,38 @@ class Noun(Word):
 class Metaphor:
     """
     This class represents a metaphor, as created by a MetaphorAgent.  It relates two nouns by a shared adjective.
+
+    Metaphors which only differ in the order of their nouns are equal.  Each metaphor has an integer *key* built from
+    the word ids of its nouns (in ascending order) and its adjective, so equal metaphors have equal keys.
     """
+    __slots__ = ('noun_1', 'noun_2', 'adjective', 'key')
+
     def __init__(self, noun_1, noun_2, adjective):
         self.noun_1 = noun_1
         self.noun_2 = noun_2
         self.adjective = adjective
+        self.key = Metaphor.make_key(noun_1.id, noun_2.id, adjective.id)
 
-    def __eq__(self, other):
-        if not isinstance(other, Metaphor):
-            return False
-
-        if (self.noun_1 == other.noun_1 and self.noun_2 == other.noun_2) \
-            or (self.noun_1 == other.noun_2 and self.noun_2 == other.noun_1):
-            return self.adjective == other.adjective
+    @staticmethod
+    def make_key(noun_1_id, noun_2_id, adjective_id):
+        """
+        Returns the canonical key of a metaphor from the word ids of its nouns and adjective.
+        """
+        if noun_1_id > noun_2_id:
+            noun_1_id, noun_2_id = noun_2_id, noun_1_id
+        return (((noun_1_id << METAPHOR_KEY_BITS) | noun_2_id) << METAPHOR_KEY_BITS) | adjective_id
 
-        return False
+    def __eq__(self, other):
+        return isinstance(other, Metaphor) and other.key == self.key
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.noun_1, self.noun_2, self.adjective))
+        return hash(self.key)
+
+    def __reduce__(self):
+        return Metaphor, (self.noun_1, self.noun_2, self.adjective)
 
     def __str__(self):
         an = 'an' if self.noun_2.word[0] in ['a', 'e', 'i', 'o', 'u'] else 'a'
@@ -130,6 +187,8 @@ class Haiku:
     The syllable counts of the words in each line should add up to 5 for the first line, 7 for the second, and 5 again
     for the third.
     """
+    __slots__ = ('topic', 'line_1', 'line_2', 'line_3', 'guessed_by', 'metaphors_used')
+
     def __init__(self, topic, line_1, line_2, line_3, metaphors_used):
         self.topic = topic
         self.line_1 = line_1
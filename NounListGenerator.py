@@ -4,140 +4,447 @@ This module gets inspiring set texts and outputs nouns with related adjectives.
 Gutenberg and Brown corpora are currently supported. The module also generates word2vec model for inspiring set.
 """
 
+import hashlib
+import itertools
+import json
 import os
 import re
+from collections import deque
 import nltk
-from nltk.corpus import cmudict
 from gensim.models import word2vec
 from nltk.corpus import brown
+from CompiledLexicon import compile_text
+from Syllables import SyllableCounter
 
 # TODO: comment these out once you have them
 nltk.download('averaged_perceptron_tagger')
 nltk.download('cmudict')
 nltk.download('brown')
 
-d = cmudict.dict()
+# The syllable table is built from cmudict by write_lexicon()
+syllables = SyllableCounter()
 
 def nsyl(word):
-    """Syllable count"""
-    # TODO - may work wrong
-    return [len(list(y for y in x if str.isdigit(y[-1]))) for x in d[word.lower()]][0]
+    """Syllable count, estimated for words which are not in cmudict"""
+    return syllables.count(word)
+
+# Project Gutenberg bloat around the text (this is not exact, but easy)
+GUTENBERG_START = r'\*\*\* START OF THIS PROJECT GUTENBERG EBOOK .+ \*\*\*'
+GUTENBERG_END = "End of the Project Gutenberg"
+# How far into a file to look for the start marker
+HEADER_WINDOW = 1 << 20
+# Characters read at a time
+CHUNK_SIZE = 1 << 16
+# A sentence longer than this is passed on as it is
+MAX_SENTENCE = 1 << 16
 
-def get_file(file_name = 'alice.txt', url='http://www.gutenberg.org/cache/epub/19033/pg19033.txt'):
-    """Getting file from Gutenberg"""
-    file_raw = None
 
+def download(file_name, url, chunk_size=CHUNK_SIZE):
+    """Download a text file from url in chunks, unless it already exists"""
     if not os.path.isfile(file_name):
         from urllib import request
-        response = request.urlopen(url)
-        file_raw = response.read().decode('utf8')
-        with open(file_name, 'w', encoding='utf8') as f:
-            f.write(file_raw)
-    else:
-        with open(file_name, 'r', encoding='utf8') as f:
-            file_raw = f.read()
-
-    # Remove the start and end bloat from Project Gutenberg (this is not exact, but
-    # easy).
-    pattern = r'\*\*\* START OF THIS PROJECT GUTENBERG EBOOK .+ \*\*\*'
-    end = "End of the Project Gutenberg"
-    start_match = re.search(pattern, file_raw)
-    if start_match:
-        start_index = start_match.span()[1] + 1
-    else:
-        start_index = 0
-    end_index = file_raw.rfind(end)
-    file = file_raw[start_index:end_index]
-
-    return file
-
-nouns = {}
-
-
-def parse_sentence(sentence):
-    """Get nouns with adjectives from sentence"""
-    global nouns
-
-    pattern = "NP: {<DT>?<JJ>*<NN>}"
-    # define a tag pattern of an NP chunk
-    NPChunker = nltk.RegexpParser(pattern)
-    # create a chunk parser
-    result = NPChunker.parse(sentence)
-    for np in result:
-        if type(np) is nltk.Tree and np.label() == 'NP':
-            # print(np)
-            noun = None
-            adjectives = []
-            for pos in np:
-                if pos[1] == 'NN':
-                    noun = pos[0]
-                if pos[1] == 'JJ':
-                    adjectives.append(pos[0])
-
-            if noun is not None and len(adjectives) > 0:
-                if noun not in nouns:
-                    nouns[noun] = adjectives
-                else:
-                    for adj in adjectives:
-                        if not adj in nouns[noun]:
-                            nouns[noun].append(adj)
-
-
-def process_sentences(sentences, tokenize=True):
-    """Loop sentences and process them"""
-    for sentence in sentences:
-        if tokenize:
-            text = nltk.tokenize.word_tokenize(sentence)
+        import codecs
+        decoder = codecs.getincrementaldecoder('utf8')()
+        with request.urlopen(url) as response, open(file_name, 'w', encoding='utf8') as f:
+            for data in iter(lambda: response.read(chunk_size), b''):
+                f.write(decoder.decode(data))
+            f.write(decoder.decode(b'', final=True))
+
+
+def read_chunks(file_name, url=None, chunk_size=CHUNK_SIZE):
+    """Read a text file in chunks.  If the file is missing it is downloaded from url first, also in chunks"""
+    download(file_name, url, chunk_size)
+    with open(file_name, 'r', encoding='utf8') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+
+
+def strip_gutenberg(chunks):
+    """
+    Remove the Project Gutenberg header and footer from a stream of text chunks.  The text is passed on as it
+    arrives, except for anything after an end marker, which is held back until either a later end marker shows up or
+    the stream ends.  The start marker is only looked for in the first HEADER_WINDOW characters.
+    """
+    chunks = iter(chunks)
+    head = ''
+    for chunk in chunks:
+        head += chunk
+        # only search complete lines, the marker must not be cut off by the end of a chunk
+        start_match = re.search(GUTENBERG_START, head[:head.rfind('\n') + 1])
+        if start_match:
+            head = head[start_match.span()[1] + 1:]
+            break
+        if len(head) > HEADER_WINDOW:
+            break
+
+    pending = head
+    for chunk in itertools.chain([''], chunks):
+        pending += chunk
+        end_index = pending.rfind(GUTENBERG_END)
+        if end_index >= 0:
+            ready, pending = pending[:end_index], pending[end_index:]
         else:
-            text = sentence
-        sentence_pos_tagged = nltk.pos_tag(text)
+            # keep enough to find a marker which is cut off by the end of the chunk
+            keep = len(GUTENBERG_END) - 1
+            ready, pending = pending[:-keep], pending[-keep:]
+        if ready:
+            yield ready
+    if not pending.startswith(GUTENBERG_END):
+        yield pending
+
+
+def iter_file(file_name='alice.txt', url='http://www.gutenberg.org/cache/epub/19033/pg19033.txt'):
+    """Stream a file from Gutenberg in chunks, without the header and footer"""
+    return strip_gutenberg(read_chunks(file_name, url))
+
+
+def iter_sentences(chunks):
+    """
+    Split a stream of text chunks into sentences.  The last sentence found in the text so far may be incomplete, so it
+    is carried over to the next chunk.
+    """
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        sentences = nltk.tokenize.sent_tokenize(buffer)
+        if len(sentences) > 1:
+            last_start = buffer.rfind(sentences[-1])
+            if last_start > 0:
+                for sentence in sentences[:-1]:
+                    yield sentence
+                buffer = buffer[last_start:]
+                continue
+        if len(buffer) >= MAX_SENTENCE:
+            for sentence in sentences:
+                yield sentence
+            buffer = ''
+    for sentence in nltk.tokenize.sent_tokenize(buffer):
+        yield sentence
+
+
+class CorpusSentences:
+    """
+    The tokenized sentences of a Gutenberg file.  Iterating streams the file again each time, so this can be given to
+    word2vec (which needs several passes) as well as to process_sentences(..., tokenize=False) without holding the
+    corpus in memory.
+    """
+    def __init__(self, file_name, url=None):
+        self.file_name = file_name
+        self.url = url
+
+    def __iter__(self):
+        for sentence in iter_sentences(iter_file(self.file_name, self.url)):
+            yield nltk.tokenize.word_tokenize(sentence)
+
+
+def get_file(file_name = 'alice.txt', url='http://www.gutenberg.org/cache/epub/19033/pg19033.txt'):
+    """Getting file from Gutenberg, as one string.  Use iter_file() to stream it instead"""
+    return ''.join(iter_file(file_name, url))
+
+# The Brown corpus categories used as the inspiring set
+BROWN_CATEGORIES = ['adventure', 'belles_lettres', 'editorial', 'fiction', 'government', 'hobbies', 'humor', 'learned',
+                    'lore', 'mystery', 'news', 'religion', 'reviews', 'romance', 'science_fiction']
+
+# Tag pattern of an NP chunk: optional determiner, any number of adjectives and a singular noun
+NP_PATTERN = "NP: {<DT>?<JJ>*<NN>}"
+# Sentences tagged in one call to the tagger
+TAG_BATCH = 1000
+
+
+def parse_sentence(sentence, nouns, seen=None):
+    """
+    Get nouns with adjectives from sentence, adding them to the nouns dict (noun -> list of adjectives).
+
+    Every NP_PATTERN chunk ends in its only NN, and the adjectives it collects are the unbroken run of JJ tags
+    right before that NN (the optional DT adds nothing).  So instead of running nltk.RegexpParser, the tags are scanned
+    once, which gives the same chunks.
+
+    :param sentence: list of (word, tag) tuples
+    :param nouns (dict): the dict to add to
+    :param seen (dict): noun -> set of the adjectives in nouns[noun], kept between calls to avoid searching the lists
+    """
+    if seen is None:
+        seen = dict((noun, set(adjectives)) for noun, adjectives in nouns.items())
+    adjectives = []
+    for word, tag in sentence:
+        if tag == 'JJ':
+            adjectives.append(word)
+            continue
+        if tag == 'NN' and adjectives:
+            if word not in nouns:
+                nouns[word] = adjectives
+                seen[word] = set(adjectives)
+            else:
+                known = seen[word]
+                for adj in adjectives:
+                    if adj not in known:
+                        known.add(adj)
+                        nouns[word].append(adj)
+        adjectives = []
+
+
+def process_sentences(sentences, tokenize=True, nouns=None):
+    """Loop sentences and process them in batches, returns the dict of nouns with their adjectives"""
+    if nouns is None:
+        nouns = {}
+    seen = dict((noun, set(adjectives)) for noun, adjectives in nouns.items())
+    for batch in chunk_sentences(sentences, TAG_BATCH):
+        if tokenize:
+            batch = [nltk.tokenize.word_tokenize(sentence) for sentence in batch]
         # a simple sentence with POS tags
         # sentence = [("the", "DT"), ("little", "JJ"), ("yellow", "JJ"), ("dog", "NN"), ("barked", "VBD"), ("at", "IN"), ("the", "DT"), ("cat", "NN")]
-        parse_sentence(sentence_pos_tagged)
-        # pass
+        for sentence_pos_tagged in nltk.pos_tag_sents(batch):
+            parse_sentence(sentence_pos_tagged, nouns, seen)
+    return nouns
+
+
+def merge_nouns(partials, nouns=None):
+    """
+    Merge noun -> adjectives dicts in the given order.  Merging the results of consecutive chunks of sentences gives
+    the same dict, in the same order, as processing all the sentences in one go.
+    """
+    if nouns is None:
+        nouns = {}
+    seen = dict((noun, set(adjectives)) for noun, adjectives in nouns.items())
+    for partial in partials:
+        for noun, adjectives in partial.items():
+            if noun not in nouns:
+                nouns[noun] = list(adjectives)
+                seen[noun] = set(adjectives)
+            else:
+                known = seen[noun]
+                for adj in adjectives:
+                    if adj not in known:
+                        known.add(adj)
+                        nouns[noun].append(adj)
+    return nouns
+
+
+def chunk_sentences(sentences, chunk_size):
+    """Split an iterable of sentences into lists of at most chunk_size sentences"""
+    chunk = []
+    for sentence in sentences:
+        chunk.append(sentence)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _process_chunk(args):
+    sentences, tokenize = args
+    return process_sentences(sentences, tokenize=tokenize)
+
+
+def process_sentences_parallel(sentences, tokenize=True, processes=None, chunk_size=2000, nouns=None):
+    """
+    Process sentences in a pool of worker processes.  The sentences are split into chunks, every worker returns the
+    noun -> adjectives dict of its chunk and the dicts are merged in chunk order, so the result is identical to
+    process_sentences().
+
+    :param sentences: iterable of sentences (strings, or token lists if tokenize is False)
+    :param processes: number of worker processes, by default one per core
+    :param chunk_size: number of sentences per chunk
+    :param nouns: a dict to merge the results into, by default a new one
+    :return: the dict of nouns with their adjectives
+    """
+    from multiprocessing import Pool
+
+    # Only a few chunks are in flight at a time, so sentences can be streamed from a file of any size
+    window = 2 * (processes or os.cpu_count() or 1)
+
+    def partials():
+        pending = deque()
+        with Pool(processes) as pool:
+            for chunk in chunk_sentences(sentences, chunk_size):
+                pending.append(pool.apply_async(_process_chunk, ((chunk, tokenize),)))
+                if len(pending) >= window:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    return merge_nouns(partials(), nouns)
+
+
+# Where the noun dicts of processed corpora and the word2vec models are kept, keyed by content hash
+CACHE_DIR = 'lexicon_cache'
+
+
+def corpus_hash(file_name):
+    """Hash of a corpus file's content and the chunk pattern, the two things its noun dict depends on"""
+    sha = hashlib.sha256(NP_PATTERN.encode('utf8'))
+    with open(file_name, 'rb') as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def _write_json(file_name, data):
+    # Write to a temporary file first, so an interrupted build never leaves a broken cache entry
+    with open(file_name + '.tmp', 'w', encoding='utf8') as f:
+        json.dump(data, f)
+    os.replace(file_name + '.tmp', file_name)
+
+
+def corpus_nouns(file_name, url=None, cache_dir=CACHE_DIR, processes=None):
+    """
+    The noun dict of one Gutenberg file.  It is read from the cache if the file has been processed before with the
+    same content and chunk pattern, and computed and cached otherwise.
+    """
+    download(file_name, url)
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, corpus_hash(file_name) + '.json')
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'r', encoding='utf8') as f:
+            return json.load(f)
+    nouns = process_sentences_parallel(CorpusSentences(file_name, url), tokenize=False, processes=processes)
+    _write_json(cache_file, nouns)
+    return nouns
+
+
+class CombinedSentences:
+    """The sentences of several corpora one after another, re-iterable like :class:'CorpusSentences'"""
+    def __init__(self, corpora):
+        self.corpora = corpora
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.corpora)
+
+
+def _cached_subset(hashes, cache_dir):
+    # The cached model trained on the most of the given corpora and on no others, as (model file, corpus hashes)
+    wanted = set(hashes)
+    best = None
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.word2vec.json'):
+            continue
+        model_file = os.path.join(cache_dir, name[:-len('.json')])
+        with open(os.path.join(cache_dir, name), 'r', encoding='utf8') as f:
+            trained = json.load(f)
+        if set(trained) < wanted and os.path.isfile(model_file) and (best is None or len(trained) > len(best[1])):
+            best = (model_file, trained)
+    return best
+
+
+def corpora_model(corpora, cache_dir=CACHE_DIR, incremental=True):
+    """
+    The word2vec model of the given (file_name, url) corpora together, cached under the hashes of the files.
+
+    When there is no model of exactly these files, the cached model of the largest subset of them is trained further
+    on the other files only, with build_vocab(update=True) and train().  Adding a book then reads and trains on that
+    book alone instead of all of them.  The result is not the model training on all the files at once would give:
+    the earlier books are not trained on again, a new word has to reach min_count within the books it is added with,
+    and the model depends on the order the books were added in.  With *incremental* False, or when no subset is
+    cached, the model is trained from scratch.
+
+    :param corpora: list of (file_name, url) tuples
+    :param incremental (bool): extend a cached model of some of the corpora
+    :return: the model
+    """
+    hashes = []
+    for file_name, url in corpora:
+        download(file_name, url)
+        hashes.append(corpus_hash(file_name))
+    sha = hashlib.sha256()
+    for corpus in hashes:
+        sha.update(corpus.encode('ascii'))
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, sha.hexdigest() + '.word2vec')
+    if os.path.isfile(cache_file):
+        return word2vec.Word2Vec.load(cache_file)
+    base = _cached_subset(hashes, cache_dir) if incremental else None
+    if base is None:
+        model = word2vec.Word2Vec(CombinedSentences([CorpusSentences(file_name, url) for file_name, url in corpora]))
+    else:
+        model = word2vec.Word2Vec.load(base[0])
+        trained = set(base[1])
+        added = CombinedSentences([CorpusSentences(file_name, url)
+                                   for (file_name, url), corpus in zip(corpora, hashes) if corpus not in trained])
+        model.build_vocab(added, update=True)
+        model.train(added, total_examples=model.corpus_count, epochs=model.epochs)
+    model.save(cache_file)
+    # The corpora of every cached model, to find the one to extend
+    _write_json(cache_file + '.json', hashes)
+    return model
+
+
+def build_lexicon(corpora, file_name, cache_dir=CACHE_DIR, processes=None):
+    """
+    Build the noun data file (and its word2vec model and compiled copy) of several Gutenberg files.  Only files which
+    are not in the cache are processed; the cached noun dicts are merged in the given order.
+
+    :param corpora: list of (file_name, url) tuples
+    :param file_name: the noun data file to write
+    :return: the merged noun dict and the word2vec model
+    """
+    nouns = merge_nouns(corpus_nouns(corpus, url, cache_dir, processes) for corpus, url in corpora)
+    model = corpora_model(corpora, cache_dir)
+    model.save(file_name + ".word2vec")
+    write_lexicon(file_name, nouns, model)
+    return nouns, model
+
+
+def write_lexicon(file_name, nouns, model):
+    """
+    Write the noun data file and its compiled copy.  The syllable table is built from cmudict first, so the counts
+    always come from the installed dictionary and never from a table left over from an earlier build.
+
+    :param file_name: the noun data file to write
+    :param nouns: the noun dict
+    :param model: the word2vec model of the corpora
+    """
+    syllables.build()
+    with open(file_name, 'w') as f:
+        for line in lexicon_lines(nouns, model):
+            f.write(line + "\n")
+    # Compiled copy of the same list for fast loading in Main.py
+    compile_text(file_name)
+
+
+def lexicon_lines(nouns, model):
+    """Yield the lines of the noun data file, for nouns with more than 2 adjectives which word2vec knows"""
+    vocab = getattr(model, 'wv', model)
+    for noun in nouns.keys():
+        if (len(nouns[noun]) > 2) and noun in vocab:
+            # filter nouns with more than 2 adjectives
+            line = noun + " " + str(nsyl(noun))
+            for adj in nouns[noun]:
+                line += " " + adj + " " + str(nsyl(adj))
+            yield line
 
 
 if __name__ == "__main__":
 
     file_name = 'nouns_brown.txt'
 
-    # Get all files
-    # alice = get_file()
-    # looking_glass = get_file('looking_glass.txt','http://www.gutenberg.org/files/12/12-0.txt')
-    # dickens = get_file('dickens.txt', "https://www.gutenberg.org/files/580/580-0.txt")
-    dorian = get_file('dorian_gray.txt', "http://www.gutenberg.org/cache/epub/174/pg174.txt")
+    # Get all files, streamed sentence by sentence
+    # alice = CorpusSentences('alice.txt', 'http://www.gutenberg.org/cache/epub/19033/pg19033.txt')
+    # looking_glass = CorpusSentences('looking_glass.txt','http://www.gutenberg.org/files/12/12-0.txt')
+    # dickens = CorpusSentences('dickens.txt', "https://www.gutenberg.org/files/580/580-0.txt")
+    # dorian = CorpusSentences('dorian_gray.txt', "http://www.gutenberg.org/cache/epub/174/pg174.txt")
 
     # Process all files
-    #sentences = nltk.tokenize.sent_tokenize(dorian)
+    # sentences = dorian
 
     # get texts from brown corpus
-    sentences = brown.sents(categories=['adventure', 'belles_lettres', 'editorial', 'fiction', 'government', 'hobbies',
-        'humor', 'learned', 'lore', 'mystery', 'news', 'religion', 'reviews', 'romance',
-        'science_fiction'])
+    sentences = brown.sents(categories=BROWN_CATEGORIES)
 
     # print(sentences[0])
-    process_sentences(sentences, tokenize=False)
+    nouns = process_sentences_parallel(sentences, tokenize=False)
     model = word2vec.Word2Vec(sentences)
     model.save(file_name + ".word2vec")
     # model_org = word2vec.Word2Vec.load_word2vec_format('vectors.bin', binary=True)
-    # sentences = nltk.tokenize.sent_tokenize(alice)
-    # process_sentences(sentences)
-    # sentences = nltk.tokenize.sent_tokenize(looking_glass)
-    # process_sentences(sentences)
+    # process_sentences_parallel(alice, tokenize=False, nouns=nouns)
+    # process_sentences_parallel(looking_glass, tokenize=False, nouns=nouns)
     # # TODO: may be Dickens is not for haikus
-    # sentences = nltk.tokenize.sent_tokenize(dickens)
-    # process_sentences(sentences)
+    # process_sentences_parallel(dickens, tokenize=False, nouns=nouns)
 
-    # Write the file with nouns and adjectives out
-    with open(file_name, 'w') as f:
-        for noun in nouns.keys():
-            try:
-                if (len(nouns[noun]) > 2) and noun in model.vocab.keys():
-                    # filter nouns with more than 2 adjectives
-                    line = noun + " " + str(nsyl(noun))
-                    for adj in nouns[noun]:
-                        line += " " + adj + " " + str(nsyl(adj))
-                    f.write(line + "\n")
-            except:
-                continue
+    # Write the file with nouns and adjectives out, line by line, and its compiled copy
+    write_lexicon(file_name, nouns, model)
 
+    # Gutenberg files can be combined instead; only the files which changed since the last build are processed again
+    # build_lexicon([('alice.txt', 'http://www.gutenberg.org/cache/epub/19033/pg19033.txt'),
+    #                ('looking_glass.txt', 'http://www.gutenberg.org/files/12/12-0.txt'),
+    #                ('dorian_gray.txt', "http://www.gutenberg.org/cache/epub/174/pg174.txt")],
+    #               'nouns_experimental.txt')
@@ -0,0 +1,161 @@
+"""
+A simulation whose agents are spread over several worker processes.
+
+Each worker process (a shard) holds a :class:'LocalEnvironment' with its share of the MetaphorAgents and
+HaikuAgents.  Its agents are named 'local://<shard>/<n>', so the creators of the candidates of different shards
+stay distinct.  A step takes two round trips from the coordinator, :class:'ShardedSimulation', to every shard:
+
+* *act*: the shard appends the metaphors accepted in the previous step to its own *artifacts*, so the agents
+  memorize the winners from *env.artifacts* as before, and every agent acts.  The shard returns its candidates.
+* *score*: the coordinator sends every shard the objects of all candidates, and each shard returns the score rows of
+  its agents and the number of its HaikuAgents which guessed each haiku.
+
+The coordinator stacks the rows into the agents x candidates matrices of :meth:'MetaHaikuEnvironment.vote' and
+picks the winners with :meth:'MetaHaikuEnvironment.choose_winners'.  Commands are sent to all shards before any reply
+is read, so the shards work in parallel.  The coordinator's *metrics* time the two round trips (shard_act and
+shard_score) and the choice of the winners, see :mod:'Metrics'.
+"""
+
+import os
+import random
+import numpy as np
+from multiprocessing import Pipe, Process
+from Model_Classes import Metaphor, Haiku
+from MetaphorAgent import MetaphorAgent
+from HaikuAgent import HaikuAgent
+from MetaHaikuEnvironment import MetaHaikuEnvironment
+from VoteExecutor import Candidate
+from FastSimulation import build_environment
+from Metrics import DISABLED
+
+
+def _shard(connection, index, nouns, embeddings, fillers, metaphor_agents, haiku_agents, metaphor_winners, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents, haiku_agents, metaphor_winners, shard=index)
+    agents = env.get_agents(address=False)
+    voters = ([agent for agent in agents if isinstance(agent, MetaphorAgent)],
+              [agent for agent in agents if isinstance(agent, HaikuAgent)])
+    while True:
+        command, payload = connection.recv()
+        if command == 'act':
+            env.artifacts.extend(payload)
+            env.act()
+            connection.send(env.candidates)
+            env.clear_candidates()
+        elif command == 'score':
+            metaphor_scores, _ = env.vote_executor.evaluate(voters[0], [Candidate(obj) for obj in payload[0]])
+            haiku_scores, guesses = env.vote_executor.evaluate(voters[1], [Candidate(obj) for obj in payload[1]])
+            connection.send((metaphor_scores, haiku_scores, guesses))
+        elif command == 'close':
+            env.close()
+            connection.close()
+            return
+
+
+class ShardedSimulation:
+    """
+    Runs the agents of one simulation in several worker processes, see the module documentation.
+
+    Attributes:
+        artifacts       The accepted metaphors, oldest first
+
+        haikus          The winning haiku of every step, oldest first
+
+        age             The number of steps run
+    """
+    def __init__(self, nouns, embeddings, fillers, shards=None, metaphor_agents=20, haiku_agents=5, metaphor_winners=5,
+                 seed=0):
+        """
+        :param nouns (list of :class:'Noun'): the nouns of the MetaphorAgents
+        :param embeddings (:class:'NounEmbeddings'): the noun similarities of the MetaphorAgents
+        :param fillers (list of :class:'Word'): the filler words of the HaikuAgents
+        :param shards (int): number of worker processes, by default one per core
+        :param metaphor_agents (int): number of MetaphorAgents, split evenly over the shards
+        :param haiku_agents (int): number of HaikuAgents, split evenly over the shards
+        :param metaphor_winners (int): the number of metaphors accepted every step
+        :param seed (int): the random generators of shard *i* are seeded with *seed* + *i*
+        """
+        self.num_metaphors_accepted_per_round = metaphor_winners
+        self.artifacts = []
+        self.haikus = []
+        self.age = 0
+        self.metrics = DISABLED
+        self.artifact_sink = None
+        self._broadcast = 0
+        shards = shards or os.cpu_count() or 1
+        self._connections = []
+        self._processes = []
+        for i, (metaphor_count, haiku_count) in enumerate(zip(self._split(metaphor_agents, shards),
+                                                              self._split(haiku_agents, shards))):
+            connection, shard_connection = Pipe()
+            process = Process(target=_shard, args=(shard_connection, i, nouns, embeddings, fillers, metaphor_count,
+                                                   haiku_count, metaphor_winners, seed + i), daemon=True)
+            process.start()
+            shard_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    choose_winners = MetaHaikuEnvironment.choose_winners
+
+    @staticmethod
+    def _split(count, shards):
+        return [len(part) for part in np.array_split(np.arange(count), shards)]
+
+    def _round_trip(self, command, payload):
+        for connection in self._connections:
+            connection.send((command, payload))
+        return [connection.recv() for connection in self._connections]
+
+    def add_artifact(self, artifact):
+        self.artifacts.append(artifact)
+
+    def step(self):
+        """
+        Run one simulation step: the agents of every shard act, then the coordinator votes on all candidates.
+        """
+        self.age += 1
+        metrics = self.metrics
+        winners = self.artifacts[self._broadcast:]
+        self._broadcast = len(self.artifacts)
+        start = metrics.clock()
+        candidates = [candidate for shard in self._round_trip('act', winners) for candidate in shard]
+        metrics.record('shard_act', start)
+
+        metaphor_candidates = [cand for cand in candidates if cand.domain() == Metaphor]
+        haiku_candidates = [cand for cand in candidates if cand.domain() == Haiku]
+        metrics.count('metaphor_candidates', len(metaphor_candidates))
+        metrics.count('haiku_candidates', len(haiku_candidates))
+        start = metrics.clock()
+        rows = self._round_trip('score', ([cand.obj for cand in metaphor_candidates],
+                                          [cand.obj for cand in haiku_candidates]))
+        metrics.record('shard_score', start)
+        metaphor_scores = np.vstack([metaphor for metaphor, _, _ in rows])
+        haiku_scores = np.vstack([haiku for _, haiku, _ in rows])
+        guesses = np.sum([shard_guesses for _, _, shard_guesses in rows], axis=0)
+        start = metrics.clock()
+        self.choose_winners(metaphor_candidates, metaphor_scores, haiku_candidates, haiku_scores, guesses)
+        metrics.record('choose_winners', start)
+        metrics.end_round(self.age)
+
+    def steps(self, n):
+        """
+        Run *n* simulation steps.
+        """
+        for _ in range(n):
+            self.step()
+
+    def close(self):
+        """
+        Stop the shards.
+        """
+        for connection in self._connections:
+            connection.send(('close', None))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+        self.metrics.close()
+        if self.artifact_sink is not None:
+            self.artifact_sink.close()
@@ -0,0 +1,139 @@
+"""
+Syllable counts for the words of the inspiring set.
+
+Counts come from the CMU pronouncing dictionary, but the dictionary is slow to load, so the lexicon build step
+(NounListGenerator.write_lexicon()) builds a plain text table from it, one "word count" line per word, with
+SyllableCounter.build().  Every other use reads that table and never imports cmudict, and a missing table is an error
+rather than a silent rebuild.  Words missing from the dictionary get an estimate from spelling rules instead of an
+error.  Every count is memoized, so a word is only looked up once per process.
+"""
+
+import os
+import re
+
+# The table next to this module, built from cmudict by the lexicon build step
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'syllables.txt')
+
+_VOWEL_GROUPS = re.compile(r'[aeiouy]+')
+# Vowel pairs which are usually two syllables
+_EXTRA_SYLLABLE = re.compile(r'io(?!n)|ia|iu|ua|oe[mt]|[^aeiou]ism$')
+# Endings where the final e is silent
+_SILENT_ENDING = re.compile(r'(?:[^aeiouyl]e|[^aeiouy]es|[^aeiouytd]ed)$')
+
+
+def estimate_syllables(word):
+    """
+    Estimate the number of syllables of a word from its spelling: count the groups of vowels, drop a silent final e
+    and split a few common vowel pairs.  Good enough for words which are not in the pronouncing dictionary.
+
+    :param word (str): the word
+    :return: the estimate, at least 1
+    """
+    word = re.sub(r'[^a-z]', '', word.lower())
+    if not word:
+        return 1
+    count = len(_VOWEL_GROUPS.findall(word))
+    if len(word) > 2 and _SILENT_ENDING.search(word):
+        count -= 1
+    count += len(_EXTRA_SYLLABLE.findall(word))
+    return max(count, 1)
+
+
+def cmudict_counts():
+    """
+    Read the syllable count of every word in the CMU pronouncing dictionary, using the first pronunciation.  This is
+    the slow path which loads the whole dictionary.
+
+    :return: dict from lower case word to its syllable count
+    """
+    from nltk.corpus import cmudict
+    counts = dict()
+    for word, phones in cmudict.entries():
+        if word not in counts:
+            counts[word] = sum(1 for phone in phones if phone[-1].isdigit())
+    return counts
+
+
+def write_table(file_name, counts):
+    """
+    Write a syllable table.
+
+    :param file_name: the file to write
+    :param counts (dict): word -> syllable count
+    """
+    with open(file_name, 'w', encoding='utf8') as f:
+        for word, count in sorted(counts.items()):
+            f.write("{} {}\n".format(word, count))
+
+
+def read_table(file_name):
+    """
+    Read a syllable table written by write_table().
+
+    :return: dict from word to syllable count
+    """
+    counts = dict()
+    with open(file_name, 'r', encoding='utf8') as f:
+        for line in f:
+            word, _, count = line.rpartition(' ')
+            counts[word] = int(count)
+    return counts
+
+
+class SyllableCounter:
+    """
+    Memoized syllable counts.  The table is loaded the first time a word is looked up, unless build() made it.  Words
+    which are not in the table are estimated with estimate_syllables().
+    """
+    def __init__(self, table_file=TABLE_FILE):
+        """
+        :param table_file (str): the syllable table, or None to only use the estimator
+        """
+        self.table_file = table_file
+        self._table = None
+        self._memo = dict()
+
+    def build(self):
+        """
+        Build the table from cmudict and save it to *table_file*, replacing any older table.  This is the slow path
+        which loads the whole dictionary.
+
+        :raises LookupError: if cmudict has not been downloaded
+        """
+        self._table = cmudict_counts()
+        self._memo = dict()
+        if self.table_file is not None:
+            write_table(self.table_file, self._table)
+
+    def _load(self):
+        if self.table_file is None:
+            self._table = dict()
+        elif os.path.isfile(self.table_file):
+            self._table = read_table(self.table_file)
+        else:
+            raise FileNotFoundError("no syllable table {}; it is built with the lexicon, see "
+                                    "NounListGenerator.write_lexicon()".format(self.table_file))
+
+    def known(self, word):
+        """
+        Returns True if the word is in the table, i.e. its count is not an estimate.
+        """
+        if self._table is None:
+            self._load()
+        return word.lower() in self._table
+
+    def count(self, word):
+        """
+        Returns the number of syllables of a word.
+        """
+        if word in self._memo:
+            return self._memo[word]
+        if self._table is None:
+            self._load()
+        count = self._table.get(word.lower())
+        if count is None:
+            count = estimate_syllables(word)
+        self._memo[word] = count
+        return count
+
+    __call__ = count
@@ -0,0 +1,249 @@
+"""
+Backends which run the agents' evaluations for :meth:'MetaHaikuEnvironment.vote'.
+
+Every executor takes a list of agents and a list of candidates and returns the agents x candidates score matrix along
+with the number of agents which guessed the topic of each candidate.  Agents are evaluated with their side-effect-free
+*score_batch*, so the guesses are only counted in the environment and all backends give the same result.
+
+* :class:'SerialExecutor' evaluates the agents one after another in the calling thread
+* :class:'ThreadExecutor' evaluates the agents in a thread pool
+* :class:'ProcessExecutor' sends compact snapshots of the agents' memories to a pool of worker processes
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from Model_Classes import Word, Noun, Metaphor
+from MetaphorMemory import MetaphorMemory, MetaphorStore
+from MetaphorAgent import MetaphorAgent
+from Embeddings import NounEmbeddings
+
+
+def score_matrix(agents, candidates):
+    """
+    Collect the evaluations of every agent for every candidate.  Agents without *score_batch* are evaluated with
+    *evaluate* and never count as guessing.
+
+    :param agents: the voting agents
+    :param candidates: the candidate artifacts
+    :return: a tuple of the agents x candidates float array and an int array with the number of guesses of each candidate
+    """
+    scores = np.zeros((len(agents), len(candidates)))
+    guesses = np.zeros(len(candidates), dtype=np.int64)
+    for row, agent in enumerate(agents):
+        if hasattr(agent, 'score_batch'):
+            scores[row], guessed = agent.score_batch(candidates)
+            guesses += guessed
+        else:
+            scores[row] = [agent.evaluate(candidate)[0] for candidate in candidates]
+    return scores, guesses
+
+
+class SerialExecutor:
+    """
+    Evaluate the agents one after another.  This is the default.
+
+    The time of each round's evaluations is recorded by the environment's *metrics* as the vote_metaphors and
+    vote_haiku phases, see :mod:'Metrics'.  The executor itself only keeps running totals.
+
+    Attributes:
+        calls           The number of evaluate() calls
+
+        total_seconds   The wall-clock time of all evaluate() calls, for comparing backends
+    """
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+
+    def evaluate(self, agents, candidates):
+        """
+        :return: the score matrix and guess counts, see score_matrix()
+        """
+        start = time.perf_counter()
+        result = self._evaluate(agents, candidates)
+        self.calls += 1
+        self.total_seconds += time.perf_counter() - start
+        return result
+
+    def _evaluate(self, agents, candidates):
+        return score_matrix(agents, candidates)
+
+    def close(self):
+        pass
+
+
+class ThreadExecutor(SerialExecutor):
+    """
+    Evaluate the agents in a thread pool.  The evaluations only read the agents' memories, so the threads need no
+    locking.  Most of the work holds the GIL, so this mostly helps agents whose evaluations spend time in NumPy.
+    """
+    def __init__(self, workers=None):
+        """
+        :param workers (int): number of threads, by default chosen by concurrent.futures
+        """
+        super().__init__()
+        self._pool = ThreadPoolExecutor(workers)
+
+    def _evaluate(self, agents, candidates):
+        scores = np.zeros((len(agents), len(candidates)))
+        guesses = np.zeros(len(candidates), dtype=np.int64)
+        rows = self._pool.map(lambda agent: score_matrix([agent], candidates), agents)
+        for row, (agent_scores, agent_guesses) in enumerate(rows):
+            scores[row] = agent_scores[0]
+            guesses += agent_guesses
+        return scores, guesses
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class Candidate:
+    """
+    Stands in for an Artifact in a worker process.  Only the object is sent, as artifacts refer to their creator.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+
+def snapshot(agents):
+    """
+    Encode the memories of the agents compactly.  The metaphors in any of the memories are listed once, as indexes
+    into a table of (word, syllables) pairs, and each memory becomes an array of metaphor indexes.
+
+    :param agents: agents with a *memory*, all using the same :class:'MetaphorStore'
+    :return: a tuple of the word table, the metaphor table (one (noun_1, noun_2, adjective) tuple of word indexes per
+     metaphor) and one (agent class, memory capacity, metaphor indexes) tuple per agent
+    """
+    words = dict()
+    metaphors = dict()
+
+    def word_index(word):
+        return words.setdefault((word.word, word.syllables), len(words))
+
+    ids = [agent.memory.ids() for agent in agents]
+    stores = set(id(agent.memory.store) for agent in agents)
+    assert len(stores) <= 1, "the agents' memories do not share a store"
+    store = agents[0].memory.store if agents else None
+    # Listed in the order they were added to the store, see restore()
+    for metaphor_id in sorted(set().union(*ids), key=store.sequence if store else None):
+        metaphor = store.metaphor(metaphor_id)
+        metaphors[metaphor_id] = (len(metaphors), (word_index(metaphor.noun_1), word_index(metaphor.noun_2),
+                                                   word_index(metaphor.adjective)))
+
+    memories = []
+    for agent, memory_ids in zip(agents, ids):
+        indexes = [metaphors[metaphor_id][0] for metaphor_id in memory_ids]
+        memories.append((type(agent), agent.memory.capacity, np.array(indexes, dtype=np.uint32)))
+    return list(words.keys()), [triple for _, triple in metaphors.values()], memories
+
+
+def restore(words, metaphors, memories, embeddings=None):
+    """
+    Rebuild detached agents from a snapshot().  The agents can only evaluate.  Their memories share a new store, and
+    the nouns are built without adjectives, which evaluation does not use.
+
+    :param embeddings: the similarities for the MetaphorAgents
+    :return: list of agents
+    """
+    nouns = dict()
+
+    def noun(i):
+        if i not in nouns:
+            nouns[i] = Noun(*words[i])
+        return nouns[i]
+
+    table = [Metaphor(noun(n_1), noun(n_2), Word.interned(*words[adj])) for n_1, n_2, adj in metaphors]
+    # The store gets every metaphor up front in the original order, so memory queries list metaphors in the same order
+    # (the haiku guesses depend on it)
+    store = MetaphorStore()
+    for metaphor in table:
+        store.retain(metaphor)
+    agents = []
+    for cls, capacity, indexes in memories:
+        agent = cls.__new__(cls)
+        agent.memory = MetaphorMemory(capacity, store=store)
+        for i in indexes:
+            agent.memory.memorize(table[i])
+        if issubclass(cls, MetaphorAgent):
+            agent.word2vec_model = embeddings
+        agents.append(agent)
+    return agents
+
+
+# The embeddings of a worker process, set once when the worker starts
+_worker_embeddings = None
+
+
+def _init_worker(words, vectors, cache):
+    global _worker_embeddings
+    if words is not None:
+        _worker_embeddings = NounEmbeddings(words, vectors, cache=cache, normalized=True)
+
+
+def _evaluate_snapshot(args):
+    words, metaphors, memories, objects = args
+    candidates = [Candidate(obj) for obj in objects]
+    return score_matrix(restore(words, metaphors, memories, _worker_embeddings), candidates)
+
+
+class ProcessExecutor(SerialExecutor):
+    """
+    Evaluate the agents in a pool of worker processes.  Every round, the agents are split in one group per worker and
+    each group is sent as a snapshot() of its memories along with the candidate objects.  The MetaphorAgents'
+    :class:'NounEmbeddings' are sent only once, when the workers start.
+    """
+    def __init__(self, processes=None, embeddings=None):
+        """
+        :param processes (int): number of worker processes, by default one per core
+        :param embeddings (:class:'NounEmbeddings'): the similarities shared by the MetaphorAgents.  By default they are
+         taken from the first MetaphorAgent when the pool is started
+        """
+        super().__init__()
+        self.processes = processes
+        self.embeddings = embeddings
+        self._pool = None
+
+    def _start(self, agents):
+        from multiprocessing import Pool
+        if self.embeddings is None:
+            self.embeddings = next((agent.word2vec_model for agent in agents if isinstance(agent, MetaphorAgent)), None)
+        # Only the vectors are sent to the workers.  A gensim model is not converted, as the workers would then score
+        # with different similarities than the agents in this process
+        assert self.embeddings is None or isinstance(self.embeddings, NounEmbeddings), \
+            "ProcessExecutor needs NounEmbeddings, not a {}; see NounEmbeddings.from_word2vec".format(
+                type(self.embeddings).__name__)
+        if self.embeddings is not None:
+            initargs = (self.embeddings.words, self.embeddings.vectors, self.embeddings.cache)
+        else:
+            initargs = (None, None, None)
+        self.processes = self.processes or os.cpu_count() or 1
+        self._pool = Pool(self.processes, initializer=_init_worker, initargs=initargs)
+
+    def _evaluate(self, agents, candidates):
+        if len(agents) == 0:
+            return score_matrix(agents, candidates)
+        if self._pool is None:
+            self._start(agents)
+        objects = [candidate.obj for candidate in candidates]
+        groups = np.array_split(np.arange(len(agents)), min(self.processes, len(agents)))
+        tasks = [snapshot([agents[i] for i in group]) + (objects,) for group in groups]
+        results = self._pool.map(_evaluate_snapshot, tasks)
+        scores = np.vstack([group_scores for group_scores, _ in results])
+        guesses = np.sum([group_guesses for _, group_guesses in results], axis=0)
+        return scores, guesses
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+EXECUTORS = {
+    'serial': SerialExecutor,
+    'thread': ThreadExecutor,
+    'process': ProcessExecutor,
+}
@@ -0,0 +1,72 @@
+import logging
+import os
+import random
+import sys
+
+import pytest
+from creamas import Artifact
+
+# The modules live at the top of the repository, next to the noun lists
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Benchmarks import load_nouns, StubWord2Vec, FILLERS  # noqa: E402
+from Embeddings import NounEmbeddings  # noqa: E402
+from FastSimulation import LocalEnvironment, local_agent  # noqa: E402
+from HaikuAgent import HaikuAgent  # noqa: E402
+from MetaphorAgent import MetaphorAgent  # noqa: E402
+from Lexicon import Lexicon, filter_nouns  # noqa: E402
+from Model_Classes import Word, Metaphor  # noqa: E402
+
+# The environments call artifact.domain() as in the creamas version the repository was written for, where newer
+# versions made it a property
+if isinstance(Artifact.__dict__.get('domain'), property):
+    Artifact.domain = lambda self: self._domain
+
+logging.getLogger('MetaHaikuEnvironment').setLevel(logging.WARNING)
+
+
+@pytest.fixture(scope='session')
+def nouns():
+    """
+    The first 300 nouns of nouns_brown.txt which share an adjective with another noun.
+    """
+    return filter_nouns(load_nouns()[:300])
+
+
+@pytest.fixture(scope='session')
+def embeddings(nouns):
+    return NounEmbeddings.from_word2vec(StubWord2Vec(), [noun.word for noun in nouns])
+
+
+@pytest.fixture(scope='session')
+def fillers():
+    return [Word(filler, 1) for filler in FILLERS]
+
+
+@pytest.fixture(scope='session')
+def lexicon(nouns):
+    return Lexicon(nouns)
+
+
+@pytest.fixture
+def haiku_agent(fillers, lexicon):
+    """
+    A HaikuAgent in a :class:'LocalEnvironment' which remembers 100 random metaphors of 200 it can hold.
+    """
+    random.seed(0)
+    agent = local_agent(HaikuAgent, LocalEnvironment(), fillers, mem_cap=200)
+    for _ in range(100):
+        agent.memory.memorize(Metaphor(*lexicon.sample()))
+    return agent
+
+
+@pytest.fixture
+def metaphor_agent(nouns, embeddings, lexicon):
+    """
+    A MetaphorAgent in a :class:'LocalEnvironment' with a full memory of 100 random metaphors.
+    """
+    random.seed(0)
+    agent = local_agent(MetaphorAgent, LocalEnvironment(), nouns, embeddings, mem_cap=100, lexicon=lexicon)
+    for _ in range(100):
+        agent.memory.memorize(Metaphor(*lexicon.sample()))
+    return agent
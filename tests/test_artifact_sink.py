@@ -0,0 +1,40 @@
+import pytest
+from creamas import Artifact
+
+from ArtifactSink import ArtifactSink, read_artifacts
+from Model_Classes import Word, Noun, Metaphor
+
+
+class BadCreator:
+    def __str__(self):
+        raise ValueError("no name")
+
+
+def metaphor(creator):
+    return Artifact(creator, Metaphor(Noun('cat', 1), Noun('dog', 1), Word('red', 1)), domain=Metaphor)
+
+
+def test_bad_record_only_drops_itself(tmp_path):
+    file_name = str(tmp_path / 'artifacts.jsonl')
+    sink = ArtifactSink(file_name)
+    for rank in range(5):
+        sink.add_metaphor(1, metaphor(BadCreator() if rank == 2 else 'agent{}'.format(rank)), 0.5, rank)
+    with pytest.raises(ValueError):
+        sink.flush()
+    assert sink.dropped == 1
+    assert [record['rank'] for record in read_artifacts(file_name)] == [0, 1, 3, 4]
+
+    # The error is raised once, and the sink goes on writing
+    sink.add_metaphor(2, metaphor('agent0'), 0.5, 0)
+    sink.close()
+    assert len(read_artifacts(file_name)) == 5
+
+
+def test_every_failure_is_logged(tmp_path, caplog):
+    sink = ArtifactSink(str(tmp_path / 'artifacts.jsonl'))
+    for rank in range(3):
+        sink.add_metaphor(1, metaphor(BadCreator()), 0.5, rank)
+    with pytest.raises(ValueError):
+        sink.close()
+    assert sink.dropped == 3
+    assert len([record for record in caplog.records if record.name == 'ArtifactSink']) == 3
@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+import pytest
+
+from Benchmarks import checkpoint_environment
+from Checkpoint import snapshot, restore, save_checkpoint, load_checkpoint
+from FastSimulation import build_environment
+from MetaphorMemory import EVICTION_POLICIES
+
+
+def simulation_state(env):
+    """
+    What a run of *env* produced and what it will carry on from: the winners with their evaluations and creators, and
+    every agent's evictions, memory and noun order.
+    """
+    return ([(str(artifact.obj), sorted(artifact.evals.items())) for artifact in env.artifacts],
+            [(str(haiku.obj), haiku.obj.get_str_metadata(), haiku.creator) for haiku in env.haikus],
+            [(agent.memory.evictions, [str(metaphor) for metaphor in agent.memory],
+              [noun.word for noun in agent.memory.nouns()]) for agent in env.get_agents(address=False)])
+
+
+@pytest.mark.parametrize('policy', sorted(EVICTION_POLICIES))
+def test_resumed_run_matches_straight_run(policy, nouns, embeddings, fillers, lexicon, tmp_path, steps=20, save_at=8):
+    random.seed(1)
+    np.random.seed(1)
+    env = checkpoint_environment(nouns, embeddings, fillers, lexicon, policy)
+    env.steps(steps)
+    straight = simulation_state(env)
+    assert any(agent.memory.evictions for agent in env.get_agents(address=False))
+
+    random.seed(1)
+    np.random.seed(1)
+    env = checkpoint_environment(nouns, embeddings, fillers, lexicon, policy)
+    env.steps(save_at)
+    file_name = str(tmp_path / 'checkpoint.bin')
+    save_checkpoint(env, file_name)
+    # Resume from other random states, as a new process would
+    random.seed(2)
+    np.random.seed(2)
+    env = load_checkpoint(file_name)
+    env.steps(steps - save_at)
+    assert simulation_state(env) == straight
+
+
+def test_creamas_checkpoints_are_refused(nouns, embeddings, fillers, tmp_path):
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents=2, haiku_agents=1)
+    state = snapshot(env)
+    assert state['environment'] == 'local'
+    state['environment'] = 'MetaHaikuEnvironment'
+    with pytest.raises(ValueError, match='MetaHaikuEnvironment'):
+        restore(state)
+
+    file_name = str(tmp_path / 'checkpoint.bin')
+    save_checkpoint(env, file_name)
+    assert load_checkpoint(file_name).age == env.age
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from CompiledLexicon import CompiledLexicon, load_nouns, write_compiled_lexicon
+from Lexicon import filter_nouns, incidence_matrix
+from Model_Classes import Noun
+
+LINES = [
+    "sea 1 deep 1 blue 1",
+    "sky 1 blue 1 wide 1",
+    "stone 1 grey 1",
+    "river 2 deep 1 wide 1 deep 1",
+    "ocean 2 blue 2",
+]
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    file_name = str(tmp_path / 'nouns.txt')
+    with open(file_name, 'w') as f:
+        f.write('\n'.join(LINES) + '\n')
+    return file_name
+
+
+def parsed():
+    return [Noun.parse(line) for line in LINES]
+
+
+def test_incidence_matrix_matches_lexicon(tmp_path):
+    nouns = parsed()
+    file_name = str(tmp_path / 'nouns.lex')
+    write_compiled_lexicon(file_name, nouns)
+    expected, expected_words = incidence_matrix(nouns)
+    with CompiledLexicon(file_name) as lexicon:
+        matrix, words = lexicon.incidence_matrix()
+        assert not lexicon._nouns
+    # 'blue' with one and with two syllables is a single column, as in Lexicon
+    assert words == expected_words
+    assert (matrix != expected).nnz == 0
+
+
+def test_context_manager_closes_mapping(tmp_path):
+    file_name = str(tmp_path / 'nouns.lex')
+    write_compiled_lexicon(file_name, parsed())
+    with CompiledLexicon(file_name) as lexicon:
+        sea = lexicon[0]
+    assert lexicon._mmap.closed
+    assert sea.full_string() == parsed()[0].full_string()
+
+
+def test_load_nouns_filtered_builds_kept_nouns_only(text_file, monkeypatch):
+    expected = [noun.full_string() for noun in filter_nouns(parsed())]
+    assert [noun.full_string() for noun in load_nouns(text_file, filtered=True)] == expected
+
+    write_compiled_lexicon(text_file + '.lex', parsed())
+    os.utime(text_file, (0, 0))
+    built = []
+    getitem = CompiledLexicon.__getitem__
+    monkeypatch.setattr(CompiledLexicon, '__getitem__', lambda self, i: built.append(i) or getitem(self, i))
+    assert [noun.full_string() for noun in load_nouns(text_file, filtered=True)] == expected
+    assert len(built) == len(expected)
@@ -0,0 +1,34 @@
+import numpy as np
+from Embeddings import NounEmbeddings
+
+
+def embeddings(size, cache, seed=0):
+    vectors = np.random.RandomState(seed).normal(size=(size, 8))
+    return NounEmbeddings(['w{}'.format(i) for i in range(size)], vectors, cache=cache)
+
+
+def test_auto_caches_small_vocabularies_only():
+    assert embeddings(100, 'auto').cache == 'dense'
+    assert embeddings(NounEmbeddings.DENSE_CACHE_LIMIT + 1, 'auto').cache is None
+
+
+def test_blocked_cache_stays_within_max_blocks(monkeypatch):
+    monkeypatch.setattr(NounEmbeddings, 'BLOCK_SIZE', 4)
+    monkeypatch.setattr(NounEmbeddings, 'MAX_BLOCKS', 3)
+    blocked = embeddings(64, 'blocked')
+    uncached = embeddings(64, None)
+    rng = np.random.RandomState(1)
+    for _ in range(50):
+        rows, cols = rng.randint(0, 64, 20), rng.randint(0, 64, 20)
+        np.testing.assert_allclose(blocked.similarities_by_index(rows, cols),
+                                   uncached.similarities_by_index(rows, cols), rtol=1e-5, atol=1e-6)
+        assert len(blocked._blocks) <= NounEmbeddings.MAX_BLOCKS
+
+
+def test_blocked_cache_keeps_recently_used_blocks(monkeypatch):
+    monkeypatch.setattr(NounEmbeddings, 'BLOCK_SIZE', 4)
+    monkeypatch.setattr(NounEmbeddings, 'MAX_BLOCKS', 2)
+    blocked = embeddings(16, 'blocked')
+    for row in (0, 4, 0, 8):
+        blocked.similarities_by_index([row], [1])
+    assert list(blocked._blocks) == [0, 2]
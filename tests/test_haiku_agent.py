@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from HaikuAgent import HaikuAgent
+
+
+def syllables(line):
+    return sum(word.syllables for word in line)
+
+
+@pytest.fixture
+def tries():
+    default = HaikuAgent.INVENT_TRIES
+    yield lambda count: setattr(HaikuAgent, 'INVENT_TRIES', count)
+    HaikuAgent.INVENT_TRIES = default
+
+
+def test_write_line_has_exact_length(haiku_agent):
+    nouns, adjectives = haiku_agent.get_applicable(haiku_agent.memory.nouns()[0])
+    for length in (1, 5, 7):
+        for _ in range(200):
+            assert syllables(haiku_agent.write_line(length, nouns, adjectives)) == length
+
+
+def test_single_try_does_not_build_tables(haiku_agent, tries):
+    tries(1)
+    haiku = haiku_agent.invent()
+    assert haiku_agent.invent_tries == 1
+    assert [syllables(line) for line in (haiku.obj.line_1, haiku.obj.line_2, haiku.obj.line_3)] == [5, 7, 5]
+    assert haiku_agent._line_tables == {}
+
+
+def test_batch_draws_from_one_table(haiku_agent, tries):
+    tries(5)
+    random.seed(1)
+    haiku = haiku_agent.invent()
+    assert haiku_agent.invent_tries == 5
+    assert [syllables(line) for line in (haiku.obj.line_1, haiku.obj.line_2, haiku.obj.line_3)] == [5, 7, 5]
+    assert list(haiku_agent._line_tables) == [haiku.obj.topic]
+
+
+def test_batch_scores_match_single_scores(haiku_agent):
+    haikus = [haiku_agent.generate().obj for _ in range(50)]
+    expected = [haiku_agent.eval_haiku(haiku)[0] for haiku in haikus]
+    assert haiku_agent.eval_haikus(haikus) == pytest.approx(expected)
+
+
+def test_invent_returns_the_best_haiku(haiku_agent, tries, monkeypatch):
+    tries(5)
+    batches = []
+    eval_haikus = haiku_agent.eval_haikus
+    monkeypatch.setattr(haiku_agent, 'eval_haikus', lambda haikus: batches.append((haikus, eval_haikus(haikus))) or
+                        batches[-1][1])
+    haiku = haiku_agent.invent()
+    haikus, scores = batches[0]
+    assert haiku.obj is haikus[max(range(len(haikus)), key=lambda i: scores[i])]
@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+
+from Benchmarks import legacy_generate, synthetic_nouns
+from Lexicon import Lexicon, filter_nouns, shared_adjective_counts
+from Model_Classes import Word, Noun
+
+SHARED = [Word('adj{}'.format(i), 1) for i in range(11)]
+
+
+def distribution_gaps(nouns, draws, seed=0):
+    """
+    The total variation distance between the metaphors drawn by the legacy search loop and by the :class:'Lexicon'
+    sampler, for the first noun and for the (first noun, second noun) pair, with the distance expected from sampling
+    noise alone.
+    """
+    lexicon = Lexicon(nouns)
+    random.seed(seed)
+    legacy = [legacy_generate(list(nouns)) for _ in range(draws)]
+    legacy = [(metaphor.noun_1.word, metaphor.noun_2.word) for metaphor in legacy if metaphor is not None]
+    random.seed(seed)
+    sampled = [(noun_1.word, noun_2.word) for noun_1, noun_2, _ in (lexicon.sample() for _ in range(len(legacy)))]
+
+    gaps = dict()
+    for name, key in (('noun_1', lambda pair: pair[0]), ('pair', lambda pair: pair)):
+        counts = dict()
+        for pair in legacy:
+            counts.setdefault(key(pair), [0, 0])[0] += 1
+        for pair in sampled:
+            counts.setdefault(key(pair), [0, 0])[1] += 1
+        frequencies = np.array(list(counts.values()), dtype=np.float64) / len(legacy)
+        gap = 0.5 * np.abs(frequencies[:, 0] - frequencies[:, 1]).sum()
+        # The expected distance between two samples of one distribution, from the normal approximation of each count
+        p = frequencies.mean(axis=1)
+        noise = 0.5 * np.sqrt(4 / np.pi * p * (1 - p) / len(legacy)).sum()
+        gaps[name] = (gap, noise)
+    return gaps
+
+
+def test_first_noun_is_drawn_like_the_search():
+    # The first noun shares one adjective with the third, the second shares ten
+    three = [Noun('a', 1, SHARED[:1]), Noun('b', 1, SHARED[1:]), Noun('c', 1, list(SHARED))]
+    gaps = distribution_gaps(three, 40000)
+    gap, noise = gaps['noun_1']
+    assert gap < 3 * noise
+    # The partner is drawn as if the partners were in a uniformly random order, which is close but not exact here,
+    # see the Lexicon docstring
+    gap, noise = gaps['pair']
+    assert gap < 0.03
+
+
+def test_synthetic_lexicon_is_drawn_like_the_search():
+    for name, (gap, noise) in distribution_gaps(synthetic_nouns(12, per_noun=3, seed=1), 20000).items():
+        assert gap < 3 * noise, name
+
+
+def test_filter_nouns_keeps_nouns_with_partners():
+    nouns = synthetic_nouns(300, per_noun=2, seed=2)
+    shared = shared_adjective_counts(nouns).tolil()
+    shared.setdiag(0)
+    expected = [noun for noun, row in zip(nouns, shared.tocsr()) if row.nnz > 0]
+    assert filter_nouns(nouns) == expected
@@ -0,0 +1,24 @@
+import random
+
+import numpy as np
+
+from MetaphorAgent import MetaphorAgent
+from Model_Classes import Metaphor
+
+
+def test_batch_scores_match_single_scores(metaphor_agent, lexicon):
+    candidates = [Metaphor(*lexicon.sample()) for _ in range(50)]
+    expected = [metaphor_agent.eval_metaphor(candidate) for candidate in candidates]
+    assert np.allclose(metaphor_agent.eval_metaphors(candidates), expected)
+
+
+def test_invent_returns_the_best_candidate(metaphor_agent):
+    random.seed(4)
+    state = random.getstate()
+    candidates = [metaphor_agent.generate() for _ in range(MetaphorAgent.INVENT_TRIES)]
+    random.setstate(state)
+    best = metaphor_agent.invent()
+    scores = [metaphor_agent.eval_metaphor(candidate.obj) for candidate in candidates]
+    assert metaphor_agent.invent_tries == MetaphorAgent.INVENT_TRIES
+    assert best.obj == candidates[int(np.argmax(scores))].obj
+    assert best.evals[metaphor_agent.name] == max(scores)
@@ -0,0 +1,31 @@
+import random
+
+import numpy as np
+
+from FastSimulation import build_environment
+from HaikuAgent import HaikuAgent
+from Metrics import Metrics, read_metrics
+from MetaphorAgent import MetaphorAgent
+
+
+def test_rounds_count_tries_and_candidates(nouns, embeddings, fillers, lexicon, tmp_path, steps=4):
+    random.seed(0)
+    np.random.seed(0)
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents=6, haiku_agents=2, lexicon=lexicon)
+    file_name = str(tmp_path / 'metrics' / 'metrics.jsonl')
+    env.metrics = Metrics(file_name)
+    env.steps(steps)
+    env.close()
+
+    rounds = read_metrics(file_name)
+    assert [line['round'] for line in rounds] == list(range(1, steps + 1))
+    for line in rounds:
+        counts = line['counts']
+        assert counts['metaphor_invent_tries'] == 6 * MetaphorAgent.INVENT_TRIES
+        assert counts['metaphor_candidates'] <= 6
+        assert counts.get('haiku_invent_tries', 0) <= 2 * HaikuAgent.INVENT_TRIES
+        assert counts.get('haiku_candidates', 0) <= 2
+        assert line['phases']['metaphor_act']['calls'] == 6
+        assert line['memorized'] >= 0 and line['evictions'] >= 0
+    # Haiku are written once the first metaphors have been accepted
+    assert rounds[-1]['counts']['haiku_candidates'] > 0
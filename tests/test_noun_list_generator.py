@@ -0,0 +1,30 @@
+import pytest
+
+nltk = pytest.importorskip('nltk')
+
+
+def has_data(*resources):
+    try:
+        for resource in resources:
+            nltk.data.find(resource)
+    except LookupError:
+        return False
+    return True
+
+
+pytestmark = pytest.mark.skipif(
+    not has_data('corpora/brown', 'taggers/averaged_perceptron_tagger'),
+    reason="the nltk brown corpus and tagger data are not installed")
+
+
+def test_tag_scanner_matches_chunk_parser(limit=2000):
+    from nltk.corpus import brown
+    import NounListGenerator
+    from Benchmarks import legacy_parse_sentence
+
+    sentences = list(brown.sents(categories=NounListGenerator.BROWN_CATEGORIES)[:limit])
+    expected = dict()
+    for sentence in nltk.pos_tag_sents(sentences):
+        legacy_parse_sentence(sentence, expected)
+    nouns = NounListGenerator.process_sentences(sentences, tokenize=False)
+    assert list(nouns.items()) == list(expected.items())
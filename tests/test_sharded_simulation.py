@@ -0,0 +1,22 @@
+from FastSimulation import build_environment
+from ShardedSimulation import ShardedSimulation
+
+
+def test_local_addresses_include_shard(nouns, embeddings, fillers):
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents=2, haiku_agents=1, shard=3)
+    assert env.get_agents() == ['local://3/0', 'local://3/1', 'local://3/2']
+    env.close()
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents=2, haiku_agents=1)
+    assert env.get_agents() == ['local://0', 'local://1', 'local://2']
+    env.close()
+
+
+def test_shards_have_distinct_creators(nouns, embeddings, fillers):
+    sim = ShardedSimulation(nouns, embeddings, fillers, shards=2, metaphor_agents=6, haiku_agents=2,
+                            metaphor_winners=5, seed=5)
+    try:
+        sim.steps(6)
+    finally:
+        sim.close()
+    creators = set(str(artifact.creator) for artifact in sim.artifacts)
+    assert set(creator.split('/')[2] for creator in creators) == {'0', '1'}
@@ -0,0 +1,31 @@
+import pytest
+
+import Syllables
+from Syllables import SyllableCounter, estimate_syllables, read_table, write_table
+
+
+def test_counts_come_from_the_table(tmp_path):
+    table_file = str(tmp_path / 'syllables.txt')
+    write_table(table_file, {'fire': 2, 'cat': 1})
+    counter = SyllableCounter(table_file)
+    assert counter.count('Fire') == 2
+    assert counter.known('cat') and not counter.known('zzyzx')
+    assert counter.count('zzyzx') == estimate_syllables('zzyzx')
+
+
+def test_missing_table_is_not_built_on_lookup(tmp_path, monkeypatch):
+    monkeypatch.setattr(Syllables, 'cmudict_counts', lambda: pytest.fail("cmudict was read"))
+    counter = SyllableCounter(str(tmp_path / 'syllables.txt'))
+    with pytest.raises(FileNotFoundError):
+        counter.count('fire')
+    assert SyllableCounter(None).count('fire') == estimate_syllables('fire')
+
+
+def test_build_replaces_the_table(tmp_path, monkeypatch):
+    table_file = str(tmp_path / 'syllables.txt')
+    write_table(table_file, {'fire': 1})
+    monkeypatch.setattr(Syllables, 'cmudict_counts', lambda: {'fire': 2})
+    counter = SyllableCounter(table_file)
+    counter.build()
+    assert counter.count('fire') == 2
+    assert read_table(table_file) == {'fire': 2}
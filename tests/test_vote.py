@@ -0,0 +1,16 @@
+import random
+
+import numpy as np
+
+from Benchmarks import legacy_vote_winners
+from MetaHaikuEnvironment import top_k
+
+
+def test_top_k_matches_sorted_averages():
+    random.seed(0)
+    candidates = list(range(40))
+    for k in (1, 5, 40, 50):
+        # Few distinct scores, so that ties have to keep their order.  Eight voters keep both averages exact
+        votes = [[(candidate, random.randint(0, 3)) for candidate in candidates] for _ in range(8)]
+        scores = np.array([[score for _, score in agent_votes] for agent_votes in votes]).mean(axis=0)
+        assert [candidates[i] for i in top_k(scores, k)] == legacy_vote_winners(votes, candidates, k)
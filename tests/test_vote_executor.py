@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from MetaphorAgent import MetaphorAgent
+from Metrics import Metrics, read_metrics
+from Model_Classes import Metaphor
+from VoteExecutor import EXECUTORS, Candidate
+from FastSimulation import build_environment
+
+
+@pytest.mark.parametrize('name', sorted(EXECUTORS))
+def test_backends_agree_and_keep_running_totals(name, nouns, embeddings, fillers, lexicon):
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents=4, haiku_agents=2, lexicon=lexicon)
+    env.steps(3)
+    agents = env.get_agents(address=False, agent_cls=MetaphorAgent)
+    candidates = [Candidate(Metaphor(*lexicon.sample())) for _ in range(6)]
+    expected = env.vote_executor.evaluate(agents, candidates)
+    executor = EXECUTORS[name]()
+    try:
+        for _ in range(3):
+            scores, guesses = executor.evaluate(agents, candidates)
+    finally:
+        executor.close()
+    assert np.array_equal(scores, expected[0]) and np.array_equal(guesses, expected[1])
+    assert executor.calls == 3 and executor.total_seconds > 0
+    env.close()
+
+
+def test_vote_timings_go_to_metrics(nouns, embeddings, fillers, tmp_path):
+    env = build_environment(nouns, embeddings, fillers, metaphor_agents=6, haiku_agents=2)
+    env.metrics = Metrics(str(tmp_path / 'metrics.jsonl'))
+    env.steps(4)
+    env.close()
+    rounds = read_metrics(str(tmp_path / 'metrics.jsonl'))
+    assert len(rounds) == 4
+    assert all(r['phases']['vote_metaphors']['calls'] == 1 and r['phases']['vote_haiku']['calls'] == 1 for r in rounds)
+    assert env.vote_executor.calls == 8